@@ -19,7 +19,11 @@ from zoneinfo import ZoneInfo
 TIMEZONE = ZoneInfo("America/Mexico_City")
 import logging
 import threading
-from typing import Dict, List, Any
+import uuid
+from typing import Dict, List, Any, Optional
+
+from modules.optimized_db_manager import init_optimized_database, queue_activities, existing_activity_ids
+from models import ACTIVITY_STATUSES, validate_activity_data
 
 # Configuración de la aplicación
 app = Flask(__name__)
@@ -50,6 +54,9 @@ system_stats = {
 }
 
 recent_activities = []
+activities_lock = threading.Lock()
+MAX_RECENT_ACTIVITIES = 50
+BULK_MAX_ITEMS = 5000  # Elementos máximos por petición de ingesta masiva
 
 # Configuración de rutas de logs
 LOG_PATHS = [
@@ -539,7 +546,7 @@ def process_log_files() -> List[Dict[str, Any]]:
 
 def update_system_stats():
     """Actualizar estadísticas del sistema"""
-    global system_stats, recent_activities
+    global system_stats
     
     try:
         # Obtener métricas del sistema
@@ -547,7 +554,8 @@ def update_system_stats():
         
         # Procesar logs para obtener actividades
         activities = process_log_files()
-        recent_activities = activities
+        with activities_lock:
+            recent_activities[:] = activities
         
         # Contar amenazas
         threats = len([a for a in activities if a['status'] == 'high'])
@@ -703,6 +711,28 @@ def manual_refresh():
         logger.error(f"Error in manual refresh: {e}")
         return jsonify({"error": "Failed to refresh stats"}), 500
 
+def record_activities(activities: List[Dict[str, Any]]):
+    """Añadir actividades a recent_activities (en el sitio) y actualizar las estadísticas"""
+    with activities_lock:
+        recent_activities[:0] = activities[::-1][:MAX_RECENT_ACTIVITIES]
+        del recent_activities[MAX_RECENT_ACTIVITIES:]
+
+    for activity in activities:
+        if activity.get('status') == 'high':
+            system_stats["threats_detected"] += 1
+            system_stats["network_status"] = "ALERT"
+        elif activity.get('status') == 'medium':
+            if system_stats["network_status"] == "SECURE":
+                system_stats["network_status"] = "WARNING"
+
+    system_stats["logs_per_minute"] += len(activities)
+    system_stats["last_update"] = datetime.now().isoformat()
+
+def emit_updates():
+    """Emitir estadísticas y últimas actividades a los clientes conectados"""
+    socketio.emit('stats_update', system_stats)
+    socketio.emit('activity_update', recent_activities[:10])
+
 @app.route('/api/analyze', methods=['POST'])
 def analyze_log():
     """Analizar un log específico"""
@@ -717,32 +747,17 @@ def analyze_log():
         if not result:
             return jsonify({"error": "Failed to parse log entry"}), 400
         
-        # Agregar a actividades recientes
         result.update({
-            'id': len(recent_activities) + 1,
+            'id': uuid.uuid4().hex,
             'source': log_data.get('source', 'api_submission')
         })
         
-        recent_activities.insert(0, result)
-        
-        # Mantener solo últimas 50 actividades
-        if len(recent_activities) > 50:
-            recent_activities = recent_activities[:50]
-        
-        # Actualizar estadísticas
-        if result['status'] == 'high':
-            system_stats["threats_detected"] += 1
-            system_stats["network_status"] = "ALERT"
-        elif result['status'] == 'medium':
-            if system_stats["network_status"] == "SECURE":
-                system_stats["network_status"] = "WARNING"
-        
-        system_stats["logs_per_minute"] += 1
-        system_stats["last_update"] = datetime.now().isoformat()
+        # Agregar a actividades recientes y actualizar estadísticas
+        record_activities([result])
+        queue_activities([result])
         
         # Emitir actualización en tiempo real
-        socketio.emit('stats_update', system_stats)
-        socketio.emit('activity_update', recent_activities[:10])
+        emit_updates()
         
         return jsonify(result)
         
@@ -750,6 +765,118 @@ def analyze_log():
         logger.error(f"Error in analyze endpoint: {e}")
         return jsonify({"error": "Analysis failed"}), 500
 
+def read_bulk_items() -> Optional[List[Any]]:
+    """
+    Elementos de una petición de ingesta masiva: un array JSON o NDJSON
+    (una línea JSON por elemento). En NDJSON una línea que no es JSON se
+    toma como línea de log sin procesar. Devuelve None si el cuerpo no es válido.
+    """
+    body = request.get_data(as_text=True)
+    if request.mimetype == 'application/json':
+        try:
+            items = json.loads(body)
+        except ValueError:
+            return None
+        return items if isinstance(items, list) else None
+
+    items = []
+    for line in body.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            items.append(json.loads(line))
+        except ValueError:
+            items.append(line)
+    return items
+
+def parse_bulk_item(item: Any, default_source: str) -> Optional[Dict[str, Any]]:
+    """
+    Convertir un elemento en actividad: una cadena es una línea de log; un
+    objeto con 'status' se toma como ya procesado; uno con solo 'message' se
+    parsea y conserva sus demás campos. Los objetos pasan por
+    validate_activity_data (solo campos conocidos) y un status fuera de
+    ACTIVITY_STATUSES los rechaza. El id del cliente se guarda con el prefijo
+    de su fuente (fuente:id) para no chocar con los de otros enviadores.
+    """
+    if isinstance(item, str):
+        if not item.strip():
+            return None
+        activity = parse_log_entry(item)
+        client_id = None
+    elif isinstance(item, dict) and isinstance(item.get('message'), str):
+        status = item.get('status')
+        if status and status not in ACTIVITY_STATUSES:
+            return None
+        parsed = dict(item) if status else parse_log_entry(item['message'])
+        if not parsed:
+            return None
+        try:
+            activity = validate_activity_data({**parsed, **item, 'id': 0}).to_dict()
+        except (TypeError, ValueError):
+            return None
+        client_id = item.get('id')
+    else:
+        return None
+    if not activity:
+        return None
+
+    activity.setdefault('timestamp', datetime.now(TIMEZONE).isoformat())
+    if not (isinstance(item, dict) and item.get('source')):
+        activity['source'] = default_source
+    activity['id'] = f"{activity['source']}:{client_id}" if client_id not in (None, '') else uuid.uuid4().hex
+    return activity
+
+@app.route('/api/analyze/bulk', methods=['POST'])
+def analyze_bulk():
+    """
+    Ingesta masiva para enviadores de logs: array JSON o NDJSON de líneas de
+    log o actividades ya procesadas. Se parsea todo el cuerpo, se encola un
+    solo lote de almacenamiento y se emite una única actualización.
+    """
+    try:
+        items = read_bulk_items()
+        if items is None:
+            return jsonify({"error": "Body must be a JSON array or NDJSON"}), 400
+        if len(items) > BULK_MAX_ITEMS:
+            return jsonify({"error": f"Too many items, maximum is {BULK_MAX_ITEMS} per request"}), 413
+
+        default_source = request.args.get('source', 'bulk_api')
+        parsed = [(index, parse_bulk_item(item, default_source)) for index, item in enumerate(items)]
+        # Los ids repetidos (en el cuerpo o ya guardados) se ignorarían al insertar: se rechazan
+        stored_ids = existing_activity_ids([activity['id'] for _, activity in parsed if activity])
+        accepted = []
+        rejected = []
+        duplicates = 0
+        for index, activity in parsed:
+            if activity is None:
+                rejected.append(index)
+            elif activity['id'] in stored_ids:
+                rejected.append(index)
+                duplicates += 1
+            else:
+                stored_ids.add(activity['id'])
+                accepted.append(activity)
+
+        stored = queue_activities(accepted) if accepted else True
+        # Si el lote no se encoló (503) no se muestra ni se emite: el cliente lo reintentará
+        if accepted and stored:
+            record_activities(accepted)
+            emit_updates()
+
+        return jsonify({
+            "accepted": len(accepted),
+            "rejected": len(rejected),
+            "duplicates": duplicates,
+            "rejected_indexes": rejected[:100],
+            "stored": stored,
+            "threats": len([a for a in accepted if a.get('status') == 'high'])
+        }), 200 if stored else 503
+
+    except Exception as e:
+        logger.error(f"Error in bulk analyze endpoint: {e}")
+        return jsonify({"error": "Bulk analysis failed"}), 500
+
 @app.route('/api/test-threat', methods=['POST'])
 def test_threat():
     """Endpoint para generar amenazas de prueba"""
@@ -797,6 +924,9 @@ if __name__ == '__main__':
     logger.info(f"🔧 Platform: {platform.system()} {platform.release()}")
     logger.info(f"🐍 Python: {platform.python_version()}")
     
+    # Base de datos para las actividades recibidas por la API
+    init_optimized_database()
+
     # Actualización inicial
     update_system_stats()
     
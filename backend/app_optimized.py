@@ -1,18 +1,19 @@
 # backend/app_optimized.py - Sistema optimizado para Raspberry Pi
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
 from flask_cors import CORS
 from flask_socketio import SocketIO, emit
 import json
 import time
 import os
+import hmac
 import psutil
 import logging
 import threading
 import signal
 import sys
 from datetime import datetime, timedelta
-from zoneinfo import ZoneInfo
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional
+from collections import OrderedDict
 
 # Importar gestores optimizados
 from modules.optimized_db_manager import (
@@ -21,13 +22,29 @@ from modules.optimized_db_manager import (
     get_paginated_activities,
     get_activity_statistics,
     cleanup_database,
+    get_last_retention_report,
+    backup_database,
+    get_backup_status,
+    get_query_stats,
+    get_slow_queries,
+    get_storage_metrics,
+    query_archive,
+    iter_activities,
+    get_trends,
+    search_activities,
+    submit_query,
+    get_write_generation,
+    get_network_summary,
+    get_changes,
+    get_optimized_db,
     shutdown_database
 )
+from modules.query_pool import QueryTimeout, QueryRejected
+from modules import export, federation, ip_utils
 from modules.system_monitor import get_system_metrics
 from modules.security_monitor import SecurityMonitor
-
-# Configuración de zona horaria
-TIMEZONE = ZoneInfo("America/Mexico_City")
+from modules.time_utils import TIMEZONE, now_epoch_ms, to_epoch_ms
+from modules.rollups import GRANULARITIES, ROLLUP_RETENTION_DAYS, bucket_start
 
 # Configuración optimizada para Raspberry Pi
 app = Flask(__name__)
@@ -86,10 +103,14 @@ system_stats = {
     "temperature": 0.0
 }
 
-# Cache para optimizar respuestas
-response_cache = {}
+# Cache para optimizar respuestas. Las respuestas de la base de datos se
+# guardan con la generación de escritura del motor y valen hasta el siguiente
+# commit; las demás (métricas del sistema) caducan a los CACHE_TIMEOUT segundos.
+response_cache = OrderedDict()
 cache_lock = threading.RLock()
 CACHE_TIMEOUT = 30  # segundos
+CACHE_MAX_AGE = 300  # segundos: las ventanas relativas (últimos N días) avanzan sin escrituras
+CACHE_MAX_ENTRIES = 64
 
 def create_paginated_response(data: List[Any], total: int, page: int, limit: int, source: str = "database") -> Dict:
     """Crear respuesta paginada estandarizada"""
@@ -110,27 +131,56 @@ def create_paginated_response(data: List[Any], total: int, page: int, limit: int
         }
     }
 
-def get_cached_response(cache_key: str):
-    """Obtener respuesta del cache si es válida"""
+def run_query(fn, *args, **kwargs):
+    """
+    Ejecutar una consulta en el pool de lectores del motor. Una consulta lenta
+    se interrumpe al vencer su plazo en lugar de retener el hilo del servidor.
+    """
+    return submit_query(fn, *args, **kwargs).result()
+
+def query_error_response(e: Exception):
+    """Respuesta para una consulta interrumpida (504) o rechazada por saturación (503)"""
+    if isinstance(e, QueryTimeout):
+        return jsonify({"error": "Query timed out"}), 504
+    return jsonify({"error": "Storage busy, retry later"}), 503
+
+def get_cached_response(cache_key: str, generation: Optional[int] = None):
+    """
+    Obtener respuesta del cache si es válida. Con generation, la entrada vale
+    solo si se calculó con esa misma generación de escritura.
+    """
     with cache_lock:
         if cache_key in response_cache:
-            cached_data, timestamp = response_cache[cache_key]
-            if time.time() - timestamp < CACHE_TIMEOUT:
+            cached_data, timestamp, cached_generation = response_cache[cache_key]
+            age = time.time() - timestamp
+            if generation is None:
+                valid = cached_generation is None and age < CACHE_TIMEOUT
+            else:
+                valid = cached_generation == generation and age < CACHE_MAX_AGE
+            if valid:
+                response_cache.move_to_end(cache_key)
                 return cached_data
             else:
                 del response_cache[cache_key]
     return None
 
-def set_cached_response(cache_key: str, data: Any):
-    """Guardar respuesta en cache"""
+def set_cached_response(cache_key: str, data: Any, generation: Optional[int] = None):
+    """
+    Guardar respuesta en cache. generation debe leerse antes de consultar la
+    base de datos: si entra un commit durante la consulta, la entrada nace caducada.
+    """
     with cache_lock:
-        # Limpiar cache si está muy grande
-        if len(response_cache) > 20:
-            oldest_key = min(response_cache.keys(), 
-                           key=lambda k: response_cache[k][1])
-            del response_cache[oldest_key]
-        
-        response_cache[cache_key] = (data, time.time())
+        if generation is not None:
+            # Las entradas de generaciones anteriores ya no se pueden servir
+            for key in [k for k, entry in response_cache.items()
+                        if entry[2] is not None and entry[2] < generation]:
+                del response_cache[key]
+
+        response_cache[cache_key] = (data, time.time(), generation)
+        response_cache.move_to_end(cache_key)
+        # Limpiar cache si está muy grande (la menos usada primero)
+        while len(response_cache) > CACHE_MAX_ENTRIES:
+            response_cache.popitem(last=False)
 
 def generate_sample_activities(count: int = 10) -> List[Dict]:
     """Generar actividades de ejemplo con patrones realistas"""
@@ -297,20 +347,26 @@ def get_historical_activities():
         days = min(int(request.args.get('days', 7)), 30)  # Máximo 30 días
         status_filter = request.args.get('status', '').strip()
         source_filter = request.args.get('source', '').strip()
+        ip_filter = request.args.get('ip', '').strip()
+        if ip_filter and not _valid_network(ip_filter):
+            return invalid_ip_response('ip')
         
         # Cache key
-        cache_key = f"historical_{page}_{limit}_{days}_{status_filter}_{source_filter}"
-        cached = get_cached_response(cache_key)
+        cache_key = f"historical_{page}_{limit}_{days}_{status_filter}_{source_filter}_{ip_filter}"
+        generation = get_write_generation()
+        cached = get_cached_response(cache_key, generation)
         if cached:
             return jsonify(cached)
         
         # Obtener datos de la base de datos
-        activities, total, pages = get_paginated_activities(
+        activities, total, pages = run_query(
+            get_paginated_activities,
             page=page,
             limit=limit, 
             days=days,
             status_filter=status_filter or None,
-            source_filter=source_filter or None
+            source_filter=source_filter or None,
+            ip_filter=ip_filter or None
         )
         
         # Si no hay datos en DB, generar datos de ejemplo
@@ -338,9 +394,11 @@ def get_historical_activities():
                 source="database"
             )
         
-        set_cached_response(cache_key, response)
+        set_cached_response(cache_key, response, generation)
         return jsonify(response)
         
+    except (QueryTimeout, QueryRejected) as e:
+        return query_error_response(e)
     except Exception as e:
         logger.error(f"Error getting historical activities: {e}")
         return jsonify({"error": "Failed to retrieve historical activities"}), 500
@@ -352,7 +410,8 @@ def get_activity_stats():
         days = min(int(request.args.get('days', 7)), 30)
         
         cache_key = f"activity_stats_{days}"
-        cached = get_cached_response(cache_key)
+        generation = get_write_generation()
+        cached = get_cached_response(cache_key, generation)
         if cached:
             return jsonify(cached)
         
@@ -379,13 +438,501 @@ def get_activity_stats():
                 'last_sync': int(time.time())
             }
         
-        set_cached_response(cache_key, stats)
+        set_cached_response(cache_key, stats, generation)
         return jsonify(stats)
         
     except Exception as e:
         logger.error(f"Error getting activity stats: {e}")
         return jsonify({"error": "Failed to retrieve activity statistics"}), 500
 
+def _valid_network(value: str) -> bool:
+    """Filtro de IP válido: una dirección o una red CIDR (203.0.113.0/24)"""
+    try:
+        ip_utils.parse_network(value)
+        return True
+    except ValueError:
+        return False
+
+def invalid_ip_response(name: str):
+    """Respuesta 400 para un filtro de IP o red no válido"""
+    return jsonify({"error": f"Invalid IP address or CIDR network in '{name}'"}), 400
+
+def _time_param(name: str, default: int) -> int:
+    """Leer un parámetro de tiempo (epoch en ms/segundos o ISO 8601)"""
+    value = request.args.get(name, '').strip()
+    if value.isdigit():
+        return to_epoch_ms(int(value))
+    return to_epoch_ms(value, default=default)
+
+@app.route('/api/activities/search')
+def search_activities_endpoint():
+    """Búsqueda de texto completo en el historial (ranking, rango de tiempo y cursor)"""
+    try:
+        query = request.args.get('q', '').strip()
+        if not query:
+            return jsonify({"error": "Missing search query parameter 'q'"}), 400
+
+        sort = request.args.get('sort', 'rank')
+        if sort not in ('rank', 'time'):
+            return jsonify({"error": "Invalid sort, use 'rank' or 'time'"}), 400
+
+        limit = min(int(request.args.get('limit', 50)), 100)
+        days = min(int(request.args.get('days', 30)), 30)
+
+        # Rango explícito (epoch ms o ISO 8601) o últimos X días
+        end_ms = _time_param('end', now_epoch_ms())
+        start_ms = _time_param('start', end_ms - days * 86400 * 1000)
+        if start_ms > end_ms:
+            return jsonify({"error": "'start' must be before 'end'"}), 400
+
+        result = run_query(
+            search_activities,
+            query,
+            start_ms,
+            end_ms,
+            limit=limit,
+            cursor=request.args.get('cursor') or None,
+            sort=sort,
+            status_filter=request.args.get('status', '').strip() or None
+        )
+        if result.get('error'):
+            return jsonify({"error": "Search failed", "details": result['error']}), 500
+
+        return jsonify({
+            "success": True,
+            "query": query,
+            "data": result['data'],
+            "count": result['count'],
+            "next_cursor": result['next_cursor'],
+            "range": {"start_ms": start_ms, "end_ms": end_ms},
+            "timestamp": datetime.now(TIMEZONE).isoformat()
+        })
+
+    except ValueError:
+        return jsonify({"error": "Invalid numeric parameter"}), 400
+    except (QueryTimeout, QueryRejected) as e:
+        return query_error_response(e)
+    except Exception as e:
+        logger.error(f"Error searching activities: {e}")
+        return jsonify({"error": "Failed to search activities"}), 500
+
+@app.route('/api/activities/archive')
+def get_archived_activities():
+    """Conteos y filas del almacenamiento en frío (actividades fuera de la ventana caliente)"""
+    try:
+        limit = min(int(request.args.get('limit', 50)), 200)
+        days = min(int(request.args.get('days', 90)), 365)
+
+        end_ms = _time_param('end', now_epoch_ms())
+        start_ms = _time_param('start', end_ms - days * 86400 * 1000)
+        if start_ms > end_ms:
+            return jsonify({"error": "'start' must be before 'end'"}), 400
+
+        ip_filter = request.args.get('ip', '').strip()
+        if ip_filter and not _valid_network(ip_filter):
+            return invalid_ip_response('ip')
+
+        result = run_query(
+            query_archive,
+            start_ms,
+            end_ms,
+            status_filter=request.args.get('status', '').strip() or None,
+            source_filter=request.args.get('source', '').strip() or None,
+            ip_filter=ip_filter or None,
+            limit=limit
+        )
+        if result.get('error'):
+            return jsonify({"error": "Archive query failed", "details": result['error']}), 500
+
+        return jsonify({
+            "success": True,
+            "data": result['data'],
+            "counts": result['counts'],
+            "total": result['total'],
+            "segments": result['segments'],
+            "range": {"start_ms": start_ms, "end_ms": end_ms},
+            "timestamp": datetime.now(TIMEZONE).isoformat()
+        })
+
+    except ValueError:
+        return jsonify({"error": "Invalid numeric parameter"}), 400
+    except (QueryTimeout, QueryRejected) as e:
+        return query_error_response(e)
+    except Exception as e:
+        logger.error(f"Error querying archived activities: {e}")
+        return jsonify({"error": "Failed to query archived activities"}), 500
+
+@app.route('/api/activities/export')
+def export_activities():
+    """
+    Exportar actividades de cualquier rango como NDJSON o CSV en streaming
+    (incluye el almacenamiento en frío). Con gzip=1 se comprime al vuelo.
+    """
+    try:
+        fmt = request.args.get('format', 'ndjson').lower()
+        if fmt not in export.EXPORT_FORMATS:
+            return jsonify({"error": f"Invalid format, use one of: {', '.join(export.EXPORT_FORMATS)}"}), 400
+
+        days = min(int(request.args.get('days', 30)), 365)
+        end_ms = _time_param('end', now_epoch_ms())
+        start_ms = _time_param('start', end_ms - days * 86400 * 1000)
+        if start_ms > end_ms:
+            return jsonify({"error": "'start' must be before 'end'"}), 400
+
+        ip_filter = request.args.get('ip', '').strip()
+        if ip_filter and not _valid_network(ip_filter):
+            return invalid_ip_response('ip')
+
+        compress = request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+        activities = iter_activities(
+            start_ms,
+            end_ms,
+            status_filter=request.args.get('status', '').strip() or None,
+            source_filter=request.args.get('source', '').strip() or None,
+            ip_filter=ip_filter or None,
+            include_archive=request.args.get('archive', '1').lower() not in ('0', 'false', 'no')
+        )
+
+        filename = f"activities-{datetime.fromtimestamp(start_ms / 1000, TIMEZONE):%Y%m%d}-" \
+                   f"{datetime.fromtimestamp(end_ms / 1000, TIMEZONE):%Y%m%d}.{fmt}"
+        if compress:
+            # Archivo .gz descargable (sin Content-Encoding, el navegador no lo descomprime)
+            filename += '.gz'
+
+        return Response(
+            stream_with_context(export.stream(activities, fmt, compress)),
+            mimetype='application/gzip' if compress else export.EXPORT_FORMATS[fmt],
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+        )
+
+    except ValueError:
+        return jsonify({"error": "Invalid numeric parameter"}), 400
+    except Exception as e:
+        logger.error(f"Error exporting activities: {e}")
+        return jsonify({"error": "Failed to export activities"}), 500
+
+@app.route('/api/activities/network')
+def get_network_activity():
+    """
+    Actividad de una red CIDR como origen o destino (total, estados y
+    direcciones con más actividad), resuelta con un rango del índice de IPs
+    """
+    try:
+        network = request.args.get('cidr', '').strip()
+        if not network:
+            return jsonify({"error": "Missing network parameter 'cidr'"}), 400
+        if not _valid_network(network):
+            return invalid_ip_response('cidr')
+
+        direction = request.args.get('direction', 'src')
+        if direction not in ('src', 'dst'):
+            return jsonify({"error": "Invalid direction, use 'src' or 'dst'"}), 400
+
+        limit = min(int(request.args.get('limit', 20)), 200)
+        days = min(int(request.args.get('days', 7)), 30)
+        end_ms = _time_param('end', now_epoch_ms())
+        start_ms = _time_param('start', end_ms - days * 86400 * 1000)
+        if start_ms > end_ms:
+            return jsonify({"error": "'start' must be before 'end'"}), 400
+
+        cache_key = f"network_{network}_{direction}_{limit}_{start_ms // 60000}_{end_ms // 60000}"
+        generation = get_write_generation()
+        cached = get_cached_response(cache_key, generation)
+        if cached:
+            return jsonify(cached)
+
+        summary = run_query(get_network_summary, network, start_ms, end_ms, direction=direction, limit=limit)
+        if summary.get('error'):
+            return jsonify({"error": "Network query failed", "details": summary['error']}), 500
+
+        response = {
+            "success": True,
+            **summary,
+            "range": {"start_ms": start_ms, "end_ms": end_ms},
+            "timestamp": datetime.now(TIMEZONE).isoformat()
+        }
+        set_cached_response(cache_key, response, generation)
+        return jsonify(response)
+
+    except ValueError:
+        return jsonify({"error": "Invalid numeric parameter"}), 400
+    except (QueryTimeout, QueryRejected) as e:
+        return query_error_response(e)
+    except Exception as e:
+        logger.error(f"Error getting network activity: {e}")
+        return jsonify({"error": "Failed to retrieve network activity"}), 500
+
+@app.route('/api/activities/trends')
+def get_activity_trends():
+    """Tendencias por minuto, hora o día leídas de los rollups materializados"""
+    try:
+        granularity = request.args.get('granularity', 'hour')
+        if granularity not in GRANULARITIES:
+            return jsonify({"error": f"Invalid granularity, use one of: {', '.join(GRANULARITIES)}"}), 400
+
+        # Número de buckets, limitado a la ventana que se conserva
+        width = GRANULARITIES[granularity]
+        max_points = ROLLUP_RETENTION_DAYS[granularity] * GRANULARITIES['day'] // width
+        default_points = {'minute': 60, 'hour': 24, 'day': 7}[granularity]
+        points = max(1, min(int(request.args.get('points', default_points)), max_points))
+
+        now_ms = now_epoch_ms()
+        start_ms = bucket_start(now_ms - (points - 1) * width, granularity)
+
+        # El primer bucket forma parte de la clave: la ventana avanza con el tiempo
+        cache_key = f"trends_{granularity}_{points}_{start_ms}"
+        generation = get_write_generation()
+        cached = get_cached_response(cache_key, generation)
+        if cached:
+            return jsonify(cached)
+
+        series = get_trends(granularity, start_ms, now_ms)
+
+        data = []
+        for bucket_ms, dimensions in series.items():
+            statuses = dimensions.get('status', {})
+            total = dimensions.get('total', {}).get('', 0)
+            threats = statuses.get('medium', 0) + statuses.get('high', 0)
+            data.append({
+                'bucket_ms': bucket_ms,
+                'timestamp': datetime.fromtimestamp(bucket_ms / 1000, TIMEZONE).isoformat(),
+                'total': total,
+                'normal': total - threats,
+                'threats': threats,
+                'status': statuses
+            })
+
+        response = {
+            "success": True,
+            "granularity": granularity,
+            "points": points,
+            "data": data,
+            "timestamp": datetime.now(TIMEZONE).isoformat()
+        }
+
+        set_cached_response(cache_key, response, generation)
+        return jsonify(response)
+
+    except ValueError:
+        return jsonify({"error": "Invalid points parameter"}), 400
+    except Exception as e:
+        logger.error(f"Error getting activity trends: {e}")
+        return jsonify({"error": "Failed to retrieve activity trends"}), 500
+
+@app.route('/api/system/retention')
+def get_retention_report():
+    """Informe de la última ejecución del motor de retención"""
+    try:
+        return jsonify({
+            "success": True,
+            "data": get_last_retention_report(),
+            "timestamp": datetime.now(TIMEZONE).isoformat()
+        })
+    except Exception as e:
+        logger.error(f"Error getting retention report: {e}")
+        return jsonify({"error": "Failed to retrieve retention report"}), 500
+
+@app.route('/api/system/storage')
+def get_storage_status():
+    """Métricas del motor de almacenamiento: tamaño del WAL y checkpoints"""
+    try:
+        return jsonify({
+            "success": True,
+            "data": get_storage_metrics(),
+            "timestamp": datetime.now(TIMEZONE).isoformat()
+        })
+    except Exception as e:
+        logger.error(f"Error getting storage metrics: {e}")
+        return jsonify({"error": "Failed to retrieve storage metrics"}), 500
+
+# ===================================================================
+# FEDERACIÓN: sensores por sede y nodo agregador
+# ===================================================================
+
+# Agregador de sensores remotos (solo con SHIELD_SENSORS definido)
+federation_aggregator: Optional[federation.FederationAggregator] = None
+
+def federation_unauthorized():
+    """
+    Respuesta 404 si no hay token de federación configurado (la federación
+    está desactivada) y 401 si la petición no trae el token correcto
+    """
+    token = federation.federation_token()
+    if token is None:
+        return jsonify({"error": "Federation is disabled (set SHIELD_FEDERATION_TOKEN)"}), 404
+    if not hmac.compare_digest(request.headers.get(federation.TOKEN_HEADER, ''), token):
+        return jsonify({"error": "Invalid federation token"}), 401
+    return None
+
+@app.route('/api/federation/changes')
+def get_federation_changes():
+    """
+    Actividades nuevas de este sensor tras un rowid (after), para el nodo
+    agregador. JSON comprimido con gzip si el cliente lo acepta.
+    """
+    unauthorized = federation_unauthorized()
+    if unauthorized:
+        return unauthorized
+    try:
+        after_id = max(int(request.args.get('after', 0)), 0)
+        limit = min(max(int(request.args.get('limit', federation.FEDERATION_PAGE_ROWS)), 1), 5000)
+
+        changes = run_query(get_changes, after_id, limit)
+        if 'gzip' in request.headers.get('Accept-Encoding', ''):
+            return Response(federation.encode_changes(changes), mimetype='application/json',
+                            headers={"Content-Encoding": "gzip", "Vary": "Accept-Encoding"})
+        return jsonify(changes)
+
+    except ValueError:
+        return jsonify({"error": "Invalid numeric parameter"}), 400
+    except (QueryTimeout, QueryRejected) as e:
+        return query_error_response(e)
+    except Exception as e:
+        logger.error(f"Error getting federation changes: {e}")
+        return jsonify({"error": "Failed to retrieve changes"}), 500
+
+def aggregator_unavailable():
+    """Respuesta 404 cuando este nodo no es agregador"""
+    return jsonify({"error": "Aggregator mode is disabled (set SHIELD_SENSORS)"}), 404
+
+@app.route('/api/federation/status')
+def get_federation_status():
+    """Cursores, retraso y volumen transferido de cada sensor"""
+    if federation_aggregator is None:
+        return aggregator_unavailable()
+    try:
+        return jsonify({
+            "success": True,
+            "data": federation_aggregator.get_status(),
+            "timestamp": datetime.now(TIMEZONE).isoformat()
+        })
+    except Exception as e:
+        logger.error(f"Error getting federation status: {e}")
+        return jsonify({"error": "Failed to retrieve federation status"}), 500
+
+@app.route('/api/federation/stats')
+def get_federation_stats():
+    """Estadísticas de todos los sensores consultados en paralelo, con el total agregado"""
+    if federation_aggregator is None:
+        return aggregator_unavailable()
+    try:
+        days = min(int(request.args.get('days', 7)), 30)
+        results = federation_aggregator.fan_out('/api/activities/stats', {'days': days})
+
+        totals = {'total_activities': 0, 'status_distribution': {'high': 0, 'medium': 0, 'low': 0}}
+        for result in results.values():
+            if not result['ok']:
+                continue
+            totals['total_activities'] += result['data'].get('total_activities', 0)
+            for status, count in result['data'].get('status_distribution', {}).items():
+                totals['status_distribution'][status] = totals['status_distribution'].get(status, 0) + count
+
+        return jsonify({
+            "success": True,
+            "days_range": days,
+            "totals": totals,
+            "sensors": results,
+            "timestamp": datetime.now(TIMEZONE).isoformat()
+        })
+
+    except ValueError:
+        return jsonify({"error": "Invalid numeric parameter"}), 400
+    except Exception as e:
+        logger.error(f"Error getting federation stats: {e}")
+        return jsonify({"error": "Failed to retrieve federation stats"}), 500
+
+@app.route('/api/federation/search')
+def search_federation():
+    """Búsqueda de texto en todos los sensores en paralelo, fusionada por instante"""
+    if federation_aggregator is None:
+        return aggregator_unavailable()
+    try:
+        query = request.args.get('q', '').strip()
+        if not query:
+            return jsonify({"error": "Missing search query parameter 'q'"}), 400
+        limit = min(int(request.args.get('limit', 50)), 100)
+        params = {
+            'q': query,
+            'limit': limit,
+            'days': min(int(request.args.get('days', 30)), 30),
+            'sort': 'time',
+            'status': request.args.get('status', '').strip() or None
+        }
+        results = federation_aggregator.fan_out('/api/activities/search', params)
+
+        data = []
+        for sensor, result in results.items():
+            if result['ok']:
+                data.extend({**activity, 'sensor': sensor} for activity in result['data'].get('data', []))
+        data.sort(key=lambda activity: to_epoch_ms(activity.get('timestamp'), default=0), reverse=True)
+
+        return jsonify({
+            "success": True,
+            "query": query,
+            "data": data[:limit],
+            "count": min(len(data), limit),
+            "sensors": {
+                sensor: {key: value for key, value in result.items() if key != 'data'}
+                for sensor, result in results.items()
+            },
+            "timestamp": datetime.now(TIMEZONE).isoformat()
+        })
+
+    except ValueError:
+        return jsonify({"error": "Invalid numeric parameter"}), 400
+    except Exception as e:
+        logger.error(f"Error searching federation: {e}")
+        return jsonify({"error": "Failed to search sensors"}), 500
+
+@app.route('/api/system/queries')
+def get_query_timings():
+    """Histogramas de tiempos por consulta (cola, lock, ejecución, lectura) y consultas lentas"""
+    try:
+        slow_limit = min(max(int(request.args.get('slow_limit', 20)), 0), 50)
+        return jsonify({
+            "success": True,
+            "data": {
+                **get_query_stats(),
+                "slow_queries": get_slow_queries(slow_limit)
+            },
+            "timestamp": datetime.now(TIMEZONE).isoformat()
+        })
+    except ValueError:
+        return jsonify({"error": "Invalid slow_limit parameter"}), 400
+    except Exception as e:
+        logger.error(f"Error getting query timings: {e}")
+        return jsonify({"error": "Failed to retrieve query timings"}), 500
+
+@app.route('/api/system/backups', methods=['GET'])
+def get_backups():
+    """Estado de las copias de seguridad: última ejecución y copias disponibles"""
+    try:
+        return jsonify({
+            "success": True,
+            "data": get_backup_status(),
+            "timestamp": datetime.now(TIMEZONE).isoformat()
+        })
+    except Exception as e:
+        logger.error(f"Error getting backup status: {e}")
+        return jsonify({"error": "Failed to retrieve backup status"}), 500
+
+@app.route('/api/system/backups', methods=['POST'])
+def create_backup():
+    """Lanzar una copia de seguridad en segundo plano (el progreso en GET)"""
+    try:
+        data = request.get_json(silent=True) or {}
+        started = backup_database(force=True, compress=bool(data.get('compress', True)))
+        if not started:
+            return jsonify({"error": "A backup is already running"}), 409
+        return jsonify({
+            "success": True,
+            "message": "Backup started",
+            "timestamp": datetime.now(TIMEZONE).isoformat()
+        }), 202
+    except Exception as e:
+        logger.error(f"Error starting backup: {e}")
+        return jsonify({"error": "Failed to start backup"}), 500
+
 @app.route('/api/activities/live')
 def get_live_activities():
     """Endpoint para actividades en vivo (datos frescos)"""
@@ -643,6 +1190,7 @@ def update_system_stats():
 def background_updater():
     """Hilo de actualización en segundo plano optimizado"""
     logger.info("Background updater started")
+    last_cleanup = time.time()
     
     while True:
         try:
@@ -653,9 +1201,11 @@ def background_updater():
                 sample_activities = generate_sample_activities(5)
                 queue_activities(sample_activities)
             
-            # Limpiar datos antiguos cada hora
-            if int(time.time()) % 3600 == 0:
+            # Limpiar datos antiguos cada hora (y lanzar la copia de seguridad si toca)
+            if time.time() - last_cleanup >= 3600:
                 cleanup_database(days_to_keep=30)
+                backup_database()
+                last_cleanup = time.time()
             
             # Dormir 10 segundos
             time.sleep(10)
@@ -671,6 +1221,8 @@ def background_updater():
 def signal_handler(signum, frame):
     """Manejar señales para cierre limpio"""
     logger.info(f"Received signal {signum}, shutting down...")
+    if federation_aggregator is not None:
+        federation_aggregator.stop()
     shutdown_database()
     sys.exit(0)
 
@@ -683,6 +1235,7 @@ signal.signal(signal.SIGTERM, signal_handler)
 
 def initialize_application():
     """Inicializar aplicación de forma segura"""
+    global federation_aggregator
     try:
         # Inicializar base de datos optimizada
         if not init_optimized_database():
@@ -692,6 +1245,15 @@ def initialize_application():
         # Inicializar estadísticas del sistema
         update_system_stats()
         
+        # Modo agregador: sincronizar los sensores de SHIELD_SENSORS
+        sensors = federation.parse_sensors(os.environ.get('SHIELD_SENSORS'))
+        token = federation.federation_token()
+        if sensors and token is None:
+            logger.error("SHIELD_SENSORS is set but SHIELD_FEDERATION_TOKEN is not: aggregator disabled")
+        elif sensors:
+            federation_aggregator = federation.FederationAggregator(get_optimized_db(), sensors, token=token)
+            federation_aggregator.start()
+
         # Iniciar hilo de actualización en segundo plano
         updater_thread = threading.Thread(target=background_updater, daemon=True, name="BackgroundUpdater")
         updater_thread.start()
@@ -714,7 +1276,7 @@ if __name__ == '__main__':
             socketio.run(
                 app, 
                 host='0.0.0.0', 
-                port=5000, 
+                port=int(os.environ.get('SHIELD_PORT', 5000)),  # Varias instancias en una máquina
                 debug=False,  # Desactivar debug en producción
                 use_reloader=False,  # Evitar reinicio automático
                 allow_unsafe_werkzeug=True
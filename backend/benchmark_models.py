@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Benchmark de models.Activity: compara la actividad compacta (slots y solo
+los campos presentes, con to_dict() cacheado) con el dataclass anterior
+(todos los campos en __dict__ y to_dict() con asdict + filtro de None).
+Mide memoria por actividad con tracemalloc, tiempo de construcción y de
+serialización (primera llamada, llamadas siguientes y JSON) para varias
+formas de actividad: solo obligatorios, la del simulador y todos los campos.
+Uso: python benchmark_models.py [actividades]
+"""
+import sys
+import json
+import time
+import random
+import tracemalloc
+from dataclasses import asdict, field, make_dataclass
+from typing import Optional
+
+from models import Activity, ACTIVITY_REQUIRED_FIELDS, ACTIVITY_OPTIONAL_FIELDS, validate_activity_data
+from modules.log_monitor import generate_simulated_activity
+
+def legacy_to_dict(self):
+    """to_dict del dataclass anterior"""
+    data = asdict(self)
+    return {k: v for k, v in data.items() if v is not None}
+
+# El dataclass anterior, con los mismos campos y el mismo to_dict
+LegacyActivity = make_dataclass(
+    'LegacyActivity',
+    [(name, object) for name in ACTIVITY_REQUIRED_FIELDS]
+    + [(name, Optional[str], field(default=None)) for name in ACTIVITY_OPTIONAL_FIELDS],
+    namespace={'to_dict': legacy_to_dict}
+)
+
+def make_shape(shape, i):
+    """Datos ya validados de una actividad con la forma indicada"""
+    if shape == 'simulator':
+        data = generate_simulated_activity()
+    else:
+        data = {'message': f"Conexión sospechosa {i}", 'source': 'firewall',
+                'status': random.choice(['low', 'medium', 'high']), 'threat_score': random.random()}
+        if shape == 'full':
+            data.update({name: f"{name}-{i % 50}" for name in ACTIVITY_OPTIONAL_FIELDS})
+    data['id'] = i
+    return validate_activity_data(data).to_dict()
+
+def bytes_per_object(build, datas):
+    """Memoria nueva por actividad (los valores de los campos se comparten entre ambas)"""
+    tracemalloc.start()
+    objects = [build(data) for data in datas]
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    # Sin contar el puntero de la lista que las mantiene vivas
+    return allocated / len(objects) - 8, objects
+
+def cache_bytes_per_object(objects):
+    """Memoria que queda retenida tras el primer to_dict() (la caché)"""
+    tracemalloc.start()
+    for obj in objects:
+        obj.to_dict()
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return retained / len(objects)
+
+def time_per_call_us(fn, objects):
+    started = time.perf_counter()
+    for obj in objects:
+        fn(obj)
+    return (time.perf_counter() - started) / len(objects) * 1e6
+
+def run_shape(shape, total):
+    datas = [make_shape(shape, i) for i in range(total)]
+    result = {'fields': sum(len(data) for data in datas) / total}
+
+    for label, cls in (('dataclass', LegacyActivity), ('compact', Activity)):
+        memory, objects = bytes_per_object(lambda data: cls(**data), datas)
+        result[f"{label}_bytes"] = memory
+        result[f"{label}_build_us"] = time_per_call_us(lambda data: cls(**data), datas)
+        result[f"{label}_to_dict_first_us"] = time_per_call_us(lambda obj: obj.to_dict(), objects)
+        result[f"{label}_to_dict_us"] = time_per_call_us(lambda obj: obj.to_dict(), objects)
+        result[f"{label}_json_us"] = time_per_call_us(lambda obj: json.dumps(obj.to_dict()), objects)
+
+    # La caché se mide en objetos nuevos, antes de su primera serialización
+    _, objects = bytes_per_object(lambda data: Activity(**data), datas)
+    result['compact_cache_bytes'] = cache_bytes_per_object(objects)
+    return result
+
+if __name__ == "__main__":
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    random.seed(42)
+
+    print("📊 PI-Cooking-Shield Activity Model Benchmark")
+    print("=" * 55)
+    print(f"Actividades por forma: {total}")
+
+    for shape in ('minimal', 'simulator', 'full'):
+        r = run_shape(shape, total)
+        print(f"\n▶ {shape} ({r['fields']:.0f} campos presentes)")
+        print(f"   {'':22s} {'dataclass':>10s} {'compacta':>10s}")
+        print(f"   {'bytes/actividad':22s} {r['dataclass_bytes']:10.0f} {r['compact_bytes']:10.0f}"
+              f"   (+{r['compact_cache_bytes']:.0f} con to_dict cacheado)")
+        for key, label in (('build_us', 'construcción (us)'), ('to_dict_first_us', 'to_dict 1ª (us)'),
+                           ('to_dict_us', 'to_dict siguientes (us)'), ('json_us', 'json.dumps (us)')):
+            print(f"   {label:22s} {r['dataclass_' + key]:10.2f} {r['compact_' + key]:10.2f}")
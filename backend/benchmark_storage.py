@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+Benchmark del almacenamiento: compara los caminos de escritura antiguos
+(conexión por llamada y pool con BEGIN IMMEDIATE) con el motor único de
+un solo escritor, bajo escritores y lectores concurrentes.
+Uso: python benchmark_storage.py [actividades] [hilos_escritores] [hilos_lectores]
+"""
+import os
+import sys
+import json
+import time
+import random
+import logging
+import sqlite3
+import tempfile
+import threading
+
+from modules import schema
+from modules.optimized_db_manager import OptimizedDBManager, init_optimized_database
+from modules.time_utils import now_iso, to_epoch_ms, now_epoch_ms, days_ago_epoch_ms
+
+STATUSES = ['low', 'low', 'low', 'medium', 'high']
+
+# Los caminos antiguos escriben las columnas de texto (antes de value_lookups, v10)
+LEGACY_SCHEMA_VERSION = 9
+
+def make_activity(i):
+    """Generar una actividad sintética"""
+    return {
+        'id': f"bench-{i}-{random.randint(0, 1 << 30)}",
+        'timestamp': now_iso(),
+        'message': f"Conexión sospechosa {i} desde 192.168.1.{i % 255}",
+        'source': random.choice(['firewall', 'log_monitor', 'network']),
+        'status': random.choice(STATUSES),
+        'alert_level': 'LOW',
+        'threat_score': random.random(),
+        'src_ip': f"192.168.1.{i % 255}",
+        'dst_ip': '10.0.0.1',
+        'service': 'ssh',
+        'action': 'blocked'
+    }
+
+def percentile(values, pct):
+    """Percentil simple sobre una lista de latencias"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+def legacy_insert(conn, activity):
+    """Inserción como la hacía el db_manager antiguo"""
+    timestamp = activity['timestamp']
+    conn.execute('''
+    INSERT OR IGNORE INTO activities
+    (activity_id, timestamp, ts_epoch_ms, message, source, status, alert_level, threat_score,
+     src_ip, dst_ip, service, action, device_name, device_type, json_data)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (activity['id'], timestamp, to_epoch_ms(timestamp, default=now_epoch_ms()), activity['message'],
+          activity['source'], activity['status'], activity['alert_level'], activity['threat_score'],
+          activity['src_ip'], activity['dst_ip'], activity['service'], activity['action'],
+          None, None, json.dumps(activity)))
+
+class ConnectPerCallPath:
+    """Camino antiguo: una conexión nueva por cada escritura y lectura"""
+    name = 'connect-per-call'
+    schema_version = LEGACY_SCHEMA_VERSION
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+
+    def write(self, activities):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            for activity in activities:
+                legacy_insert(conn, activity)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def read(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            return conn.execute(
+                "SELECT json_data FROM activities WHERE ts_epoch_ms >= ? ORDER BY ts_epoch_ms DESC LIMIT 50",
+                (days_ago_epoch_ms(7),)
+            ).fetchall()
+        finally:
+            conn.close()
+
+    def finish(self):
+        pass
+
+    def close(self):
+        pass
+
+class PooledImmediatePath:
+    """Camino antiguo: pool compartido con BEGIN IMMEDIATE en cada escritura"""
+    name = 'pooled-immediate'
+    schema_version = LEGACY_SCHEMA_VERSION
+
+    def __init__(self, db_path, pool_size=3):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.pool = [self._connect() for _ in range(pool_size)]
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        return conn
+
+    def _acquire(self):
+        with self.lock:
+            if self.pool:
+                return self.pool.pop()
+        return self._connect()
+
+    def _release(self, conn):
+        with self.lock:
+            self.pool.append(conn)
+
+    def write(self, activities):
+        conn = self._acquire()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for activity in activities:
+                    legacy_insert(conn, activity)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            self._release(conn)
+
+    def read(self):
+        conn = self._acquire()
+        try:
+            return conn.execute(
+                "SELECT json_data FROM activities WHERE ts_epoch_ms >= ? ORDER BY ts_epoch_ms DESC LIMIT 50",
+                (days_ago_epoch_ms(7),)
+            ).fetchall()
+        finally:
+            self._release(conn)
+
+    def finish(self):
+        pass
+
+    def close(self):
+        with self.lock:
+            for conn in self.pool:
+                conn.close()
+            self.pool.clear()
+
+class UnifiedEnginePath:
+    """Motor único: escritor dedicado y lectores de solo lectura"""
+    name = 'unified-engine'
+    schema_version = schema.SCHEMA_VERSION
+
+    def __init__(self, db_path):
+        self.manager = OptimizedDBManager(db_path=db_path)
+
+    def write(self, activities):
+        # Encolar con reintento para medir el mismo volumen que los otros caminos
+        while not self.manager.queue_activity_insert(activities):
+            time.sleep(0.001)
+
+    def read(self):
+        return self.manager.get_recent_activities(limit=50)
+
+    def finish(self):
+        self.manager.flush(timeout=120)
+
+    def close(self):
+        self.manager.shutdown()
+
+def prepare_database(db_path, target_version=schema.SCHEMA_VERSION):
+    """Crear esquema en una base de datos temporal"""
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA page_size = 4096")
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("PRAGMA journal_mode = WAL")
+    schema.ensure_schema(conn, target_version=target_version)
+    conn.close()
+
+def run_path(path, total, writers, readers, batch_size=10):
+    """Ejecutar escritores y lectores concurrentes y medir latencias"""
+    write_latencies = []
+    read_latencies = []
+    errors = []
+    stop_readers = threading.Event()
+    per_writer = total // writers
+
+    def writer(worker):
+        for start in range(0, per_writer, batch_size):
+            batch = [make_activity(worker * per_writer + start + i) for i in range(batch_size)]
+            t0 = time.perf_counter()
+            try:
+                path.write(batch)
+            except Exception as e:
+                errors.append(str(e))
+            write_latencies.append(time.perf_counter() - t0)
+
+    def reader():
+        while not stop_readers.is_set():
+            t0 = time.perf_counter()
+            try:
+                path.read()
+            except Exception as e:
+                errors.append(str(e))
+            read_latencies.append(time.perf_counter() - t0)
+            time.sleep(0.005)
+
+    reader_threads = [threading.Thread(target=reader) for _ in range(readers)]
+    writer_threads = [threading.Thread(target=writer, args=(w,)) for w in range(writers)]
+
+    started = time.perf_counter()
+    for thread in reader_threads + writer_threads:
+        thread.start()
+    for thread in writer_threads:
+        thread.join()
+    path.finish()
+    elapsed = time.perf_counter() - started
+    stop_readers.set()
+    for thread in reader_threads:
+        thread.join()
+
+    return {
+        'rows_per_sec': round(per_writer * writers / elapsed, 1),
+        'write_p50_ms': round(percentile(write_latencies, 50) * 1000, 2),
+        'write_p99_ms': round(percentile(write_latencies, 99) * 1000, 2),
+        'read_p50_ms': round(percentile(read_latencies, 50) * 1000, 2),
+        'read_p99_ms': round(percentile(read_latencies, 99) * 1000, 2),
+        'errors': len(errors)
+    }
+
+def count_rows(db_path):
+    """Contar filas escritas realmente"""
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM activities").fetchone()[0]
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    writers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    readers = int(sys.argv[3]) if len(sys.argv) > 3 else 2
+
+    # Los avisos de cola llena son esperados al saturar el escritor
+    logging.basicConfig(level=logging.ERROR)
+
+    print("📊 PI-Cooking-Shield Storage Benchmark")
+    print("=" * 55)
+    print(f"Actividades: {total} | Escritores: {writers} | Lectores: {readers}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for factory in (ConnectPerCallPath, PooledImmediatePath, UnifiedEnginePath):
+            db_path = os.path.join(tmp, f"{factory.name}.db")
+            prepare_database(db_path, factory.schema_version)
+            path = factory(db_path)
+            if isinstance(path, UnifiedEnginePath):
+                init_optimized_database(path.manager)
+            try:
+                result = run_path(path, total, writers, readers)
+            finally:
+                path.close()
+            result['rows_written'] = count_rows(db_path)
+
+            print(f"\n▶ {factory.name}")
+            for key, value in result.items():
+                print(f"   {key:14s} {value}")
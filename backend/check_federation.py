@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Prueba de extremo a extremo del modo agregador con procesos locales.
+Crea N sensores con su propia base de datos sembrada, los arranca como
+procesos de app_optimized.py en puertos distintos (SHIELD_DB_PATH y
+SHIELD_PORT), arranca un agregador apuntando a ellos (SHIELD_SENSORS) y
+comprueba que cada sensor queda replicado entero y sin duplicados, que sus
+cambios no se sirven sin el token de federación, cuánto
+tarda, cuánto ocupa la transferencia comprimida y que las consultas entre
+sedes responden aunque un sensor se caiga.
+Uso: python check_federation.py [--sensors 3] [--rows 20000] [--base-port 5601]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import sqlite3
+import argparse
+import tempfile
+import subprocess
+from urllib import request as urlrequest
+from urllib.error import HTTPError
+
+from check_query_plans import populate, connect
+from modules.optimized_db_manager import OptimizedDBManager, init_optimized_database
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+STARTUP_TIMEOUT = 60
+SYNC_TIMEOUT = 300
+FEDERATION_TOKEN = 'check-federation-token'
+
+def get_json(url: str):
+    with urlrequest.urlopen(url, timeout=30) as response:
+        return json.loads(response.read())
+
+def seed_sensor(db_path: str, rows: int):
+    """Base de datos de un sensor con rows actividades e índice de texto"""
+    manager = OptimizedDBManager(db_path)
+    init_optimized_database(manager)
+    manager.shutdown()
+    populate(db_path, rows)
+    conn = connect(db_path)
+    conn.execute("INSERT INTO activities_fts(activities_fts) VALUES ('rebuild')")
+    conn.commit()
+    conn.close()
+
+def start_node(db_path: str, port: int, log_path: str, sensors: str = '') -> subprocess.Popen:
+    env = dict(os.environ, SHIELD_DB_PATH=db_path, SHIELD_PORT=str(port),
+               SHIELD_FEDERATION_TOKEN=FEDERATION_TOKEN)
+    if sensors:
+        env['SHIELD_SENSORS'] = sensors
+    log = open(log_path, 'w')
+    return subprocess.Popen([sys.executable, 'app_optimized.py'], cwd=BACKEND_DIR, env=env,
+                            stdout=log, stderr=subprocess.STDOUT)
+
+def wait_ready(port: int):
+    deadline = time.time() + STARTUP_TIMEOUT
+    while time.time() < deadline:
+        try:
+            get_json(f"http://127.0.0.1:{port}/api/system/storage")
+            return
+        except OSError:
+            time.sleep(0.5)
+    raise RuntimeError(f"Node on port {port} did not start")
+
+def http_status(url: str, headers: dict) -> int:
+    try:
+        with urlrequest.urlopen(urlrequest.Request(url, headers=headers), timeout=30) as response:
+            return response.status
+    except HTTPError as e:
+        return e.code
+
+def count_rows(db_path: str, sql: str, params=()) -> int:
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        return conn.execute(sql, params).fetchone()[0]
+    finally:
+        conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Federated aggregation check with local sensor processes")
+    parser.add_argument('--sensors', type=int, default=3)
+    parser.add_argument('--rows', type=int, default=20000, help="Activities seeded per sensor")
+    parser.add_argument('--base-port', type=int, default=5601)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='shield-federation-')
+    processes = []
+    failures = 0
+    try:
+        names = [f"site{i + 1}" for i in range(args.sensors)]
+        sensor_dbs = {}
+        print(f"📦 Sembrando {args.sensors} sensores con {args.rows} actividades cada uno...")
+        for i, name in enumerate(names):
+            sensor_dbs[name] = os.path.join(workdir, name, 'shield.db')
+            os.makedirs(os.path.dirname(sensor_dbs[name]))
+            seed_sensor(sensor_dbs[name], args.rows)
+
+        ports = {name: args.base_port + i for i, name in enumerate(names)}
+        for name in names:
+            processes.append(start_node(sensor_dbs[name], ports[name], os.path.join(workdir, f"{name}.log")))
+        for name in names:
+            wait_ready(ports[name])
+
+        # Los cambios de un sensor solo se sirven con el token correcto
+        changes_url = f"http://127.0.0.1:{ports[names[0]]}/api/federation/changes?limit=1"
+        statuses = [http_status(changes_url, headers) for headers in
+                    ({}, {'X-Federation-Token': 'wrong'}, {'X-Federation-Token': FEDERATION_TOKEN})]
+        ok = statuses == [401, 401, 200]
+        failures += not ok
+        print(f"{'✅' if ok else '❌'} Token de federación: sin token {statuses[0]}, "
+              f"incorrecto {statuses[1]}, correcto {statuses[2]}")
+
+        central_db = os.path.join(workdir, 'central', 'shield.db')
+        os.makedirs(os.path.dirname(central_db))
+        sensors = ','.join(f"{name}=http://127.0.0.1:{ports[name]}" for name in names)
+        central_port = args.base_port + args.sensors
+        started = time.time()
+        processes.append(start_node(central_db, central_port, os.path.join(workdir, 'central.log'), sensors))
+        wait_ready(central_port)
+        print(f"🚀 {args.sensors} sensores y agregador en marcha (puertos {args.base_port}-{central_port})")
+
+        # Esperar a que el cursor de cada sensor alcance su último rowid
+        targets = {name: count_rows(sensor_dbs[name], "SELECT MAX(id) FROM activities") for name in names}
+        status = {}
+        while time.time() - started < SYNC_TIMEOUT:
+            status = get_json(f"http://127.0.0.1:{central_port}/api/federation/status")['data']['sensors']
+            if all(status[name]['cursor'].get('last_id', 0) >= targets[name] for name in names):
+                break
+            time.sleep(0.5)
+        elapsed = time.time() - started
+
+        total = 0
+        for name in names:
+            sensor = status[name]
+            last_id = sensor['cursor'].get('last_id', 0)
+            expected = count_rows(sensor_dbs[name], "SELECT COUNT(*) FROM activities WHERE id <= ?", (last_id,))
+            merged = count_rows(central_db, "SELECT COUNT(*) FROM activities WHERE activity_id LIKE ?",
+                                (f"{name}:%",))
+            total += merged
+            ok = last_id >= targets[name] and merged == expected
+            failures += not ok
+            print(f"{'✅' if ok else '❌'} {name}: {merged}/{expected} filas, {sensor['pages']} páginas, "
+                  f"{sensor['bytes_received'] / 1048576:.1f} MB recibidos "
+                  f"(compresión {sensor['compression_ratio']}x), errores {sensor['errors']}")
+        print(f"⏱️  {total} filas replicadas en {elapsed:.1f} s ({total / elapsed:.0f} filas/s)")
+
+        # Consultas entre sedes en paralelo, también con un sensor caído
+        for label in ('todos los sensores', f'{names[0]} caído'):
+            if label != 'todos los sensores':
+                processes[0].terminate()
+                processes[0].wait(timeout=15)
+            query_started = time.time()
+            stats = get_json(f"http://127.0.0.1:{central_port}/api/federation/stats?days=30")
+            search = get_json(f"http://127.0.0.1:{central_port}/api/federation/search?q=malware&limit=20")
+            answered = sorted(name for name, result in stats['sensors'].items() if result['ok'])
+            print(f"🔎 Fan-out ({label}): stats + búsqueda en {(time.time() - query_started) * 1000:.0f} ms, "
+                  f"responden {answered}, total {stats['totals']['total_activities']}, "
+                  f"{search['count']} resultados")
+            expected_answers = names if label == 'todos los sensores' else names[1:]
+            failures += answered != expected_answers
+
+    finally:
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print("✅ Federación correcta" if not failures else f"❌ {failures} comprobaciones fallidas")
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+Verificación de planes de consulta del motor de almacenamiento.
+Ejecuta las consultas reales del motor (capturadas con un trace callback),
+aplica EXPLAIN QUERY PLAN a cada una y falla si alguna recorre una tabla
+completa (SCAN) o necesita ordenar con un B-tree temporal.
+Con --bench rellena bases de datos grandes y compara los tiempos con los
+índices anteriores (esquema v3) y los actuales; las consultas que usan las
+columnas codificadas (v10) no existen en v3 y solo tienen tiempo actual.
+Uso:
+    python check_query_plans.py
+    python check_query_plans.py --bench 1000000 10000000
+"""
+import os
+import sys
+import json
+import time
+import random
+import logging
+import sqlite3
+import argparse
+import tempfile
+import statistics
+
+from modules import schema, ip_utils, lookups
+from modules.message_codec import MessageCodec
+from modules.optimized_db_manager import OptimizedDBManager, init_optimized_database
+from modules.time_utils import now_iso, now_epoch_ms, days_ago_epoch_ms
+from modules.rollups import bucket_start
+
+# Versión del esquema con los índices anteriores (para comparar)
+LEGACY_SCHEMA_VERSION = 3
+
+SOURCES = ['firewall', 'router', 'log_monitor', 'network']
+STATUSES = ['low', 'low', 'low', 'medium', 'high']
+
+class TracingDBManager(OptimizedDBManager):
+    """Motor que registra las sentencias de lectura y borrado que ejecuta"""
+
+    def __init__(self, db_path):
+        self.captured = []
+        super().__init__(db_path=db_path)
+
+    def _trace(self, statement):
+        # Las sentencias internas de FTS5 sobre sus tablas sombra van con 'main'.
+        if "'main'." in statement:
+            return
+        if statement.lstrip().upper().startswith(('SELECT', 'WITH', 'DELETE', 'UPDATE')):
+            self.captured.append(statement)
+
+    def _create_read_connection(self):
+        conn = super()._create_read_connection()
+        conn.set_trace_callback(self._trace)
+        return conn
+
+    def _create_optimized_connection(self):
+        conn = super()._create_optimized_connection()
+        conn.set_trace_callback(self._trace)
+        return conn
+
+def query_scenarios(manager, now_ms):
+    """Formas de consulta que ejecuta la API: (nombre, llamada, prefijos de plan permitidos)"""
+    week_ms = bucket_start(now_ms - 6 * 86400 * 1000, 'day')
+    # Ordenar por bm25 exige ordenar el resultado filtrado
+    sort_by_aggregate = ('USE TEMP B-TREE',)
+    # Una red CIDR abarca varias claves: sus filas se ordenan por tiempo aparte
+    sort_network_range = ('USE TEMP B-TREE FOR ORDER BY',)
+    # Los totales de rollups agrupan por valor unas decenas de filas de buckets
+    group_by_value = ('USE TEMP B-TREE FOR GROUP BY',)
+    return [
+        ('recent', lambda: manager.get_recent_activities(limit=50), ()),
+        ('recent_status', lambda: manager.get_recent_activities(limit=50, status_filter='high'), ()),
+        ('recent_source', lambda: manager.get_recent_activities(limit=50, source_filter='firewall'), ()),
+        ('recent_ip', lambda: manager.get_recent_activities(limit=50, ip_filter='192.168.1.10'), ()),
+        ('paginated', lambda: manager.get_activities_paginated(page=2, limit=20), ()),
+        ('paginated_status', lambda: manager.get_activities_paginated(page=1, limit=20, status_filter='medium'), ()),
+        ('paginated_source_status', lambda: manager.get_activities_paginated(
+            page=1, limit=20, status_filter='high', source_filter='router'), ()),
+        ('paginated_ip', lambda: manager.get_activities_paginated(page=1, limit=20, days=30, ip_filter='192.168.1.10'), ()),
+        ('paginated_cidr', lambda: manager.get_activities_paginated(
+            page=1, limit=20, days=30, ip_filter='192.168.1.0/24'), sort_network_range),
+        ('network_summary', lambda: manager.get_network_summary('192.168.0.0/16', days_ago_epoch_ms(7), now_ms), ()),
+        ('network_summary_dst', lambda: manager.get_network_summary(
+            '10.0.0.0/8', days_ago_epoch_ms(7), now_ms, direction='dst'), ()),
+        ('count', lambda: manager.count_activities(days=30), ()),
+        ('count_status', lambda: manager.count_activities(status_filter='high', days=7), ()),
+        ('count_by_status', lambda: manager.count_activities_by_status(days=7), ()),
+        ('activity_stats', lambda: manager.get_activity_stats(days=7), ()),
+        ('in_range', lambda: manager.get_activities_in_range(now_ms - 3600 * 1000, now_ms), ()),
+        ('daily_stats', lambda: manager.get_daily_stats(30), ()),
+        ('rollup_totals', lambda: manager.get_rollup_totals('day', week_ms, now_ms, 'threat'), group_by_value),
+        ('rollup_series', lambda: manager.get_rollup_series('hour', now_ms - 24 * 3600 * 1000, now_ms), ()),
+        ('top_threat_sources', lambda: manager.get_top_threat_sources(days=7), ()),
+        ('heavy_hitters_hour', lambda: manager.get_heavy_hitters(
+            'threat_dst', 'hour', now_ms - 24 * 3600 * 1000, now_ms), ()),
+        ('search_rank', lambda: manager.search_activities('malware', days_ago_epoch_ms(30), now_ms), sort_by_aggregate),
+        ('search_time', lambda: manager.search_activities('malware', days_ago_epoch_ms(30), now_ms, sort='time'),
+         sort_by_aggregate),
+        ('existing_ids', lambda: manager.existing_activity_ids(['seed-1', 'bulk:seed-2']), ()),
+        ('federation_changes', lambda: manager.get_changes(after_id=500, limit=200), ()),
+        ('retention', lambda: manager.cleanup_old_data(30, wait=True), ()),
+        # Tras la retención las actividades de más de 30 días están en frío
+        ('archive', lambda: manager.query_archive(days_ago_epoch_ms(60), now_ms, status_filter='high'), ()),
+        ('count_with_archive', lambda: manager.count_activities_by_status(days=60), ()),
+        ('export', lambda: list(manager.iter_activities(days_ago_epoch_ms(60), now_ms, chunk_size=200)), ()),
+        ('export_status', lambda: list(manager.iter_activities(
+            days_ago_epoch_ms(60), now_ms, status_filter='high', chunk_size=200)), ()),
+        ('export_cidr', lambda: list(manager.iter_activities(
+            days_ago_epoch_ms(60), now_ms, ip_filter='192.168.2.0/24', chunk_size=200)), sort_network_range),
+    ]
+
+def plan_problems(conn, statement, allowed):
+    """Devolver (plan, problemas) de una sentencia"""
+    plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {statement}")]
+    problems = []
+    for detail in plan:
+        if any(detail.startswith(prefix) for prefix in allowed):
+            continue
+        if detail.startswith('SCAN') and 'VIRTUAL TABLE' not in detail:
+            problems.append(detail)
+        elif 'TEMP B-TREE' in detail:
+            problems.append(detail)
+    return plan, problems
+
+def make_row(i, now_ms, span_ms):
+    """Fila sintética para poblar la tabla activities"""
+    ts = now_ms - random.randint(0, span_ms)
+    status = random.choice(STATUSES)
+    activity = {
+        'id': f"seed-{i}",
+        'message': f"{random.choice(['malware', 'scan', 'ping', 'login failed'])} srcip=10.0.{i % 250}.{i % 7}",
+        'source': random.choice(SOURCES),
+        'status': status,
+        'src_ip': f"192.168.{i % 4}.{i % 250}",
+    }
+    return (activity['id'], now_iso(), ts, activity['message'], activity['source'], status, 'LOW', 0.0,
+            activity['src_ip'], '10.0.0.1', 'ssh', 'blocked', None, None, json.dumps(activity), now_iso(),
+            ip_utils.ip_key(activity['src_ip']), ip_utils.ip_key('10.0.0.1'))
+
+def populate(db_path, rows, chunk=50000):
+    """Insertar filas directamente (sin pasar por la cola del motor)"""
+    now_ms = now_epoch_ms()
+    span_ms = 40 * 86400 * 1000
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA synchronous = OFF")
+    # Columnas de texto hasta el esquema v9, códigos de value_lookups desde v10
+    legacy = schema._column_exists(conn, 'activities', 'status')
+    names = [field if legacy else f"{field}_id" for field in lookups.LOOKUP_FIELDS]
+    encoder = lookups.LookupEncoder()
+
+    def ordered(row):
+        """Fila de make_row con los campos de LOOKUP_FIELDS primero (texto o código)"""
+        texts = (row[4], row[5], row[6], row[10], row[11], row[13])
+        if not legacy:
+            texts = tuple(encoder.encode(conn, field, text) for field, text in zip(lookups.LOOKUP_FIELDS, texts))
+        return row[:4] + texts + row[7:10] + row[12:13] + row[14:]
+
+    for start in range(0, rows, chunk):
+        conn.executemany(f"""
+        INSERT INTO activities (
+            activity_id, timestamp, ts_epoch_ms, message, {', '.join(names)},
+            threat_score, src_ip, dst_ip, device_name, json_data, created_at, src_ip_key, dst_ip_key
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (ordered(make_row(i, now_ms, span_ms)) for i in range(start, min(start + chunk, rows))))
+        conn.commit()
+    conn.close()
+
+def capture_statements(db_path, seed_rows=2000):
+    """Ejecutar los escenarios sobre una BD pequeña y capturar sus sentencias"""
+    manager = TracingDBManager(db_path)
+    init_optimized_database(manager)
+    populate(db_path, seed_rows)
+    # Índice de texto completo y estadísticas del planificador para los datos sembrados
+    conn = connect(db_path)
+    conn.execute("INSERT INTO activities_fts(activities_fts) VALUES ('rebuild')")
+    conn.execute("PRAGMA optimize")
+    conn.commit()
+    conn.close()
+
+    captured = []
+    for name, call, allowed in query_scenarios(manager, now_epoch_ms()):
+        manager.captured.clear()
+        call()
+        # Una sola vez cada forma de sentencia (la retención repite el borrado por bloques)
+        statements = list(dict.fromkeys(manager.captured))
+        captured.append((name, statements, allowed))
+    manager.shutdown()
+    return captured
+
+def connect(db_path):
+    """Conexión con message_text() registrada (la usan las consultas del motor)"""
+    conn = sqlite3.connect(db_path)
+    MessageCodec().register(conn)
+    return conn
+
+def check_plans(captured, db_path):
+    """Revisar el plan de cada sentencia capturada. Devuelve el número de fallos."""
+    conn = connect(db_path)
+    failures = 0
+    for name, statements, allowed in captured:
+        seen_plans = set()
+        for statement in statements:
+            plan, problems = plan_problems(conn, statement, allowed)
+            if tuple(plan) in seen_plans:
+                continue
+            seen_plans.add(tuple(plan))
+            status = "❌" if problems else "✅"
+            print(f"{status} {name}: {' | '.join(plan)}")
+            if problems:
+                failures += 1
+                print(f"   {' '.join(statement.split())[:200]}")
+    conn.close()
+    return failures
+
+def time_statements(db_path, captured, runs=5):
+    """
+    Mediana en ms de cada sentencia de lectura capturada (None si no se
+    puede ejecutar con ese esquema: las columnas codificadas llegan en v10)
+    """
+    conn = connect(db_path)
+    timings = {}
+    for name, statements, _ in captured:
+        reads = [s for s in statements if s.lstrip().upper().startswith(('SELECT', 'WITH'))]
+        if not reads or name in ('retention', 'archive', 'count_with_archive', 'export', 'export_status', 'export_cidr'):
+            continue
+        samples = []
+        try:
+            for _ in range(runs):
+                started = time.perf_counter()
+                for statement in reads:
+                    conn.execute(statement).fetchall()
+                samples.append((time.perf_counter() - started) * 1000)
+        except sqlite3.OperationalError:
+            timings[name] = None
+            continue
+        timings[name] = statistics.median(samples)
+    conn.close()
+    return timings
+
+def benchmark(captured, rows):
+    """Comparar índices v3 y actuales sobre la misma BD con N filas"""
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        conn = sqlite3.connect(db_path)
+        conn.execute("PRAGMA journal_mode = WAL")
+        schema.ensure_schema(conn, target_version=LEGACY_SCHEMA_VERSION)
+        conn.close()
+
+        started = time.time()
+        populate(db_path, rows)
+        conn = sqlite3.connect(db_path)
+        conn.execute("INSERT INTO activities_fts(activities_fts) VALUES ('rebuild')")
+        conn.execute("ANALYZE")
+        conn.commit()
+        conn.close()
+        print(f"   {rows} filas insertadas en {time.time() - started:.1f}s")
+
+        before = time_statements(db_path, captured)
+
+        conn = sqlite3.connect(db_path)
+        started = time.time()
+        schema.ensure_schema(conn)
+        conn.execute("ANALYZE")
+        conn.close()
+        print(f"   Migración de índices en {time.time() - started:.1f}s")
+
+        after = time_statements(db_path, captured)
+
+        print(f"   {'consulta':26s} {'v3 (ms)':>10s} {'actual (ms)':>12s}")
+        def cell(value, width):
+            return f"{'n/a':>{width}s}" if value is None else f"{value:{width}.2f}"
+
+        for name in after:
+            print(f"   {name:26s} {cell(before.get(name), 10)} {cell(after[name], 12)}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="EXPLAIN QUERY PLAN check for storage queries")
+    parser.add_argument('--bench', nargs='*', type=int, help="row counts to benchmark (e.g. 1000000 10000000)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+
+    print("🔎 PI-Cooking-Shield Query Plan Check")
+    print("=" * 55)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'plans.db')
+        captured = capture_statements(db_path)
+        failures = check_plans(captured, db_path)
+
+    if args.bench:
+        for rows in args.bench:
+            print(f"\n📊 Benchmark con {rows} filas")
+            benchmark(captured, rows)
+
+    if failures:
+        print(f"\n❌ {failures} consultas con SCAN o B-tree temporal")
+        sys.exit(1)
+    print("\n✅ Todas las consultas usan índices")
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Comprobación de recuperación del spool de escritura.
+Guarda actividades, cierra el motor, borra o recorta el spool en disco (como
+tras perder la tarjeta SD o restaurar solo la base de datos) y comprueba que
+las escrituras siguientes se confirman de verdad: wait=True solo devuelve
+True cuando la fila está en la tabla, y tras reiniciar no se pierde ni
+duplica nada. También comprueba que el spool lleno rechaza lotes nuevos.
+Uso: python check_spool.py
+"""
+import os
+import sys
+import shutil
+import logging
+import sqlite3
+import tempfile
+
+from modules.optimized_db_manager import OptimizedDBManager, init_optimized_database
+from modules.time_utils import now_iso
+
+def make_activities(first: int, count: int):
+    return [{
+        'id': f"spool-{i}",
+        'timestamp': now_iso(),
+        'message': f"Actividad de prueba {i}",
+        'source': 'check_spool',
+        'status': 'low',
+        'threat_score': 0.1
+    } for i in range(first, first + count)]
+
+def count_rows(db_path: str) -> int:
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM activities").fetchone()[0]
+    finally:
+        conn.close()
+
+def start(db_path: str, **spool_options) -> OptimizedDBManager:
+    manager = OptimizedDBManager(db_path)
+    for name, value in spool_options.items():
+        setattr(manager.spool, name, value)
+    init_optimized_database(manager)
+    return manager
+
+def check_damaged_spool(tmp: str, name: str, damage) -> bool:
+    """Escribir, dañar el spool con damage(directorio) y volver a escribir"""
+    db_path = os.path.join(tmp, f"{name}.db")
+    spool_dir = f"{db_path}-spool"
+
+    manager = start(db_path)
+    stored = manager.queue_activity_insert(make_activities(0, 20), wait=True)
+    manager.shutdown()
+    damage(spool_dir)
+
+    manager = start(db_path)
+    acknowledged = manager.queue_activity_insert(make_activities(20, 5), wait=True)
+    after_write = count_rows(db_path)
+    metrics = manager.spool.get_metrics()
+    manager.shutdown()
+
+    manager = start(db_path)
+    manager.flush()
+    after_restart = count_rows(db_path)
+    manager.shutdown()
+
+    ok = stored and acknowledged and after_write == 25 and after_restart == 25 and metrics['depth'] == 0
+    print(f"{'✅' if ok else '❌'} {name}: confirmado={acknowledged}, filas={after_write}, "
+          f"tras reiniciar={after_restart}, profundidad={metrics['depth']}")
+    return ok
+
+def truncate_segments(spool_dir: str):
+    """Segmentos más cortos que la posición confirmada"""
+    for segment in os.listdir(spool_dir):
+        with open(os.path.join(spool_dir, segment), 'r+b') as f:
+            f.truncate(0)
+
+def check_spool_full(tmp: str) -> bool:
+    """Con el tope alcanzado el lote se rechaza y se informa"""
+    db_path = os.path.join(tmp, 'full.db')
+    manager = start(db_path, max_bytes=4096)
+    # Con el escritor detenido nada se confirma y el spool se llena
+    manager.shutdown_flag.set()
+    manager.write_queue.put_nowait(None)
+    manager.writer_thread.join()
+    accepted = 0
+    while manager.queue_activity_insert(make_activities(accepted, 1)) and accepted < 1000:
+        accepted += 1
+    metrics = manager.spool.get_metrics()
+    manager.shutdown()
+
+    ok = 0 < accepted < 1000 and metrics['full'] and metrics['rejected'] == 1
+    print(f"{'✅' if ok else '❌'} spool lleno: {accepted} lotes aceptados, "
+          f"{metrics['depth_bytes']}/{metrics['max_bytes']} bytes, rechazados={metrics['rejected']}")
+    return ok
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.ERROR)
+
+    print("🔎 PI-Cooking-Shield Write Spool Check")
+    print("=" * 55)
+
+    tmp = tempfile.mkdtemp()
+    try:
+        results = [
+            check_damaged_spool(tmp, 'spool_borrado', shutil.rmtree),
+            check_damaged_spool(tmp, 'segmento_recortado', truncate_segments),
+            check_spool_full(tmp),
+        ]
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    if not all(results):
+        print("\n❌ El spool pierde o retiene escrituras")
+        sys.exit(1)
+    print("\n✅ El spool se recupera sin perder escrituras")
@@ -3,10 +3,13 @@
 # Elimina inconsistencias y estandariza tipos de datos
 # ===================================================================
 
-from typing import Dict, List, Optional, Literal, TypedDict
+from typing import Dict, List, Optional, Literal, Tuple, TypedDict
 from datetime import datetime
 from dataclasses import dataclass, asdict
 import json
+from operator import itemgetter
+
+from modules.time_utils import now_iso
 
 # ===================================================================
 # TIPOS BASE
@@ -35,61 +38,122 @@ class SystemStats:
         """Convertir a diccionario para JSON"""
         return asdict(self)
 
-@dataclass 
+# Campos de Activity en el orden de to_dict()
+ACTIVITY_REQUIRED_FIELDS = ('id', 'message', 'timestamp', 'source', 'threat_score', 'status', 'alert_level')
+ACTIVITY_OPTIONAL_FIELDS = (
+    # Información de dispositivo
+    'device_name', 'device_type', 'os_name', 'device_category', 'src_mac',
+    # IPs y países
+    'src_ip', 'dst_ip', 'src_country', 'dst_country',
+    # Puertos y servicios
+    'src_port', 'dst_port', 'service',
+    # Protocolo y acción
+    'protocol', 'action',
+    # Interfaces de red
+    'src_interface', 'dst_interface', 'src_interface_role', 'dst_interface_role',
+    'policy_id', 'policy_type',
+    # Estadísticas de tráfico
+    'bytes_sent', 'bytes_received', 'packets_sent', 'packets_received',
+    'session_duration', 'translation_type'
+)
+_OPTIONAL_FIELD_SET = frozenset(ACTIVITY_OPTIONAL_FIELDS)
+
+# Valores válidos de status y alert_level
+ACTIVITY_STATUSES = ('low', 'medium', 'high')
+ACTIVITY_ALERT_LEVELS = ('LOW', 'MEDIUM', 'HIGH', 'CRITICAL')
+
+class _FieldLayout:
+    """Campos opcionales presentes en una actividad y su posición (compartido)"""
+    __slots__ = ('names', 'index', 'pick')
+
+    def __init__(self, names: Tuple[str, ...]):
+        self.names = names
+        self.index = {name: position for position, name in enumerate(names)}
+        # pick(kwargs) -> tupla de valores en el orden de names
+        if len(names) > 1:
+            self.pick = itemgetter(*names)
+        elif names:
+            self.pick = lambda values, name=names[0]: (values[name],)
+        else:
+            self.pick = lambda values: ()
+
+# Una disposición por combinación de campos presentes (cada fuente usa unas pocas),
+# indexada también por el orden en que llegan los argumentos para no reordenarlos
+_layouts: Dict[Tuple[str, ...], _FieldLayout] = {}
+_layouts_by_keys: Dict[Tuple[str, ...], _FieldLayout] = {}
+
+def _field_layout(keys: Tuple[str, ...]) -> _FieldLayout:
+    layout = _layouts_by_keys.get(keys)
+    if layout is None:
+        unknown = set(keys) - _OPTIONAL_FIELD_SET
+        if unknown:
+            raise TypeError(f"Activity got unexpected fields: {', '.join(sorted(unknown))}")
+        names = tuple(name for name in ACTIVITY_OPTIONAL_FIELDS if name in keys)
+        layout = _layouts.setdefault(names, _FieldLayout(names))
+        layout = _layouts_by_keys.setdefault(keys, layout)
+    return layout
+
 class Activity:
-    """Actividad de red/seguridad - ESTANDARIZADO"""
-    # Campos obligatorios
-    id: int
-    message: str
-    timestamp: str
-    source: str
-    threat_score: float
-    status: ThreatStatus
-    alert_level: AlertLevel
-    
-    # Información de dispositivo (opcional)
-    device_name: Optional[str] = None
-    device_type: Optional[str] = None
-    os_name: Optional[str] = None
-    device_category: Optional[str] = None
-    src_mac: Optional[str] = None
-    
-    # IPs y países (opcional)
-    src_ip: Optional[str] = None
-    dst_ip: Optional[str] = None
-    src_country: Optional[str] = None
-    dst_country: Optional[str] = None
-    
-    # Puertos y servicios (opcional)
-    src_port: Optional[str] = None
-    dst_port: Optional[str] = None
-    service: Optional[str] = None
-    
-    # Protocolo y acción (opcional)
-    protocol: Optional[str] = None
-    action: Optional[str] = None
-    
-    # Interfaces de red (opcional)
-    src_interface: Optional[str] = None
-    dst_interface: Optional[str] = None
-    src_interface_role: Optional[str] = None
-    dst_interface_role: Optional[str] = None
-    policy_id: Optional[str] = None
-    policy_type: Optional[str] = None
-    
-    # Estadísticas de tráfico (opcional)
-    bytes_sent: Optional[str] = None
-    bytes_received: Optional[str] = None
-    packets_sent: Optional[str] = None
-    packets_received: Optional[str] = None
-    session_duration: Optional[str] = None
-    translation_type: Optional[str] = None
-    
+    """
+    Actividad de red/seguridad - ESTANDARIZADO
+    Compacta: los campos obligatorios son slots y de los opcionales solo se
+    guardan los presentes, en una tupla cuyo orden describe una disposición
+    compartida con las demás actividades de la misma forma. Es inmutable, así
+    que el diccionario de to_dict() se construye una vez y se reutiliza.
+    """
+    __slots__ = ACTIVITY_REQUIRED_FIELDS + ('_layout', '_values', '_dict')
+
+    def __init__(self, id: int, message: str, timestamp: str, source: str, threat_score: float,
+                 status: ThreatStatus, alert_level: AlertLevel, **optional: Optional[str]):
+        if None in optional.values():
+            optional = {name: value for name, value in optional.items() if value is not None}
+        layout = _field_layout(tuple(optional))
+
+        set_field = object.__setattr__
+        set_field(self, 'id', id)
+        set_field(self, 'message', message)
+        set_field(self, 'timestamp', timestamp)
+        set_field(self, 'source', source)
+        set_field(self, 'threat_score', threat_score)
+        set_field(self, 'status', status)
+        set_field(self, 'alert_level', alert_level)
+        set_field(self, '_layout', layout)
+        set_field(self, '_values', layout.pick(optional))
+        set_field(self, '_dict', None)
+
+    def __getattr__(self, name: str):
+        # Solo llega aquí lo que no es un slot: los campos opcionales
+        if name in _OPTIONAL_FIELD_SET:
+            position = self._layout.index.get(name)
+            return None if position is None else self._values[position]
+        raise AttributeError(f"'Activity' object has no attribute '{name}'")
+
+    def __setattr__(self, name: str, value):
+        raise AttributeError("Activity is immutable")
+
+    def _as_dict(self) -> Dict:
+        data = self._dict
+        if data is None:
+            data = {name: getattr(self, name) for name in ACTIVITY_REQUIRED_FIELDS}
+            data.update(zip(self._layout.names, self._values))
+            data = {k: v for k, v in data.items() if v is not None}
+            object.__setattr__(self, '_dict', data)
+        return data
+
     def to_dict(self) -> Dict:
         """Convertir a diccionario para JSON - SIN CAMPOS FANTASMA"""
-        data = asdict(self)
-        # Eliminar campos None para JSON más limpio
-        return {k: v for k, v in data.items() if v is not None}
+        # Copia superficial del diccionario cacheado: quien la modifique no altera la caché
+        return dict(self._as_dict())
+
+    def __eq__(self, other):
+        if not isinstance(other, Activity):
+            return NotImplemented
+        return self._as_dict() == other._as_dict()
+
+    __hash__ = None  # Como el dataclass mutable al que sustituye
+
+    def __repr__(self) -> str:
+        return f"Activity({', '.join(f'{k}={v!r}' for k, v in self._as_dict().items())})"
 
 @dataclass
 class NetworkInterface:
@@ -145,7 +209,7 @@ def validate_activity_data(data: Dict) -> Activity:
     activity_data = {
         'id': int(data.get('id', 0)),
         'message': str(data.get('message', 'Unknown activity')),
-        'timestamp': str(data.get('timestamp', datetime.now().isoformat())),
+        'timestamp': str(data.get('timestamp') or now_iso()),
         'source': str(data.get('source', 'unknown')),
         'threat_score': float(data.get('threat_score', 0.0)),
         'status': data.get('status', 'low'),
@@ -153,25 +217,14 @@ def validate_activity_data(data: Dict) -> Activity:
     }
     
     # Validar enums
-    if activity_data['status'] not in ['low', 'medium', 'high']:
+    if activity_data['status'] not in ACTIVITY_STATUSES:
         activity_data['status'] = 'low'
     
-    if activity_data['alert_level'] not in ['LOW', 'MEDIUM', 'HIGH', 'CRITICAL']:
+    if activity_data['alert_level'] not in ACTIVITY_ALERT_LEVELS:
         activity_data['alert_level'] = 'LOW'
     
     # Campos opcionales - SOLO los válidos
-    optional_fields = [
-        'device_name', 'device_type', 'os_name', 'device_category', 'src_mac',
-        'src_ip', 'dst_ip', 'src_country', 'dst_country',
-        'src_port', 'dst_port', 'service',
-        'protocol', 'action',
-        'src_interface', 'dst_interface', 'src_interface_role', 'dst_interface_role',
-        'policy_id', 'policy_type',
-        'bytes_sent', 'bytes_received', 'packets_sent', 'packets_received',
-        'session_duration', 'translation_type'
-    ]
-    
-    for field in optional_fields:
+    for field in ACTIVITY_OPTIONAL_FIELDS:
         if field in data and data[field] is not None:
             activity_data[field] = str(data[field])
     
@@ -5,12 +5,13 @@ Integra el sistema de actividades en memoria con la base de datos para persisten
 import logging
 import threading
 import time
-from datetime import datetime, timedelta
+from datetime import datetime
 from typing import List, Dict, Any, Optional
-from zoneinfo import ZoneInfo
 
 # Importar módulos internos
 from modules import db_manager
+from modules.activity_ring import ActivityRing
+from modules.time_utils import TIMEZONE, to_epoch_ms
 from models import Activity, validate_activity_data
 
 logger = logging.getLogger(__name__)
@@ -18,26 +19,41 @@ logger = logging.getLogger(__name__)
 class ActivityManager:
     """
     Gestor centralizado de actividades que combina:
-    - Datos en memoria para acceso rápido
+    - Datos en memoria para acceso rápido (búfer circular indexado por estado)
     - Persistencia en base de datos para histórico
     - Thread-safety para concurrencia
     """
     
     def __init__(self, timezone=None):
         self._lock = threading.Lock()
-        self._activities: List[Activity] = []
         self._max_memory_activities = 500  # AUMENTADO: Mantener más actividades en memoria
-        self._timezone = timezone or ZoneInfo("America/Mexico_City")
+        self._activities = ActivityRing(self._max_memory_activities)
+        self._timezone = timezone or TIMEZONE
         self._last_db_sync = 0
         self._db_sync_interval = 30  # Sincronizar con BD cada 30 segundos
-        
-        # MEJORADO: Cargar más actividades recientes de la BD al inicializar
-        self._load_recent_from_db()
-        
-        # NUEVO: Programar limpieza periódica de datos antiguos
-        self._start_cleanup_thread()
-        
-        logger.info(f"ActivityManager initialized with {len(self._activities)} activities from database")
+        self._started = False
+        self._start_lock = threading.Lock()
+    
+    def init(self):
+        """
+        Cargar las actividades recientes de la BD y arrancar la limpieza
+        periódica. Se hace una sola vez, aquí o en el primer uso de la memoria,
+        nunca al construir el gestor (importar el módulo no toca la BD).
+        """
+        if self._started:
+            return
+        with self._start_lock:
+            if self._started:
+                return
+            
+            # MEJORADO: Cargar más actividades recientes de la BD al inicializar
+            self._load_recent_from_db()
+            
+            # NUEVO: Programar limpieza periódica de datos antiguos
+            self._start_cleanup_thread()
+            
+            self._started = True
+            logger.info(f"ActivityManager initialized with {len(self._activities)} activities from database")
     
     def _load_recent_from_db(self):
         """MEJORADO: Cargar más actividades recientes de la base de datos al inicializar"""
@@ -49,44 +65,44 @@ class ActivityManager:
             )
             
             # Convertir a objetos Activity
+            loaded = []
             for activity_data in db_activities:
                 try:
                     activity = validate_activity_data(activity_data)
-                    self._activities.append(activity)
+                    loaded.append(activity)
                 except Exception as e:
                     logger.warning(f"Error loading activity from DB: {e}")
             
-            # Ordenar por timestamp (más reciente primero)
-            self._activities.sort(key=lambda a: a.timestamp, reverse=True)
+            # Ordenar por instante real (más reciente primero)
+            loaded.sort(key=lambda a: to_epoch_ms(a.timestamp, default=0), reverse=True)
+            self._activities.extend_newest_first(loaded)
             
             logger.info(f"Loaded {len(self._activities)} recent activities from database (last 3 days)")
             
         except Exception as e:
             logger.error(f"Error loading activities from database: {e}")
-            self._activities = []
+            self._activities.clear()
     
     def add_activity(self, activity: Activity):
         """
         Agregar nueva actividad al sistema.
         Se guarda en memoria inmediatamente y se programa para guardar en BD.
         """
+        self.init()
         with self._lock:
-            # Agregar al inicio de la lista (más reciente primero)
-            self._activities.insert(0, activity)
-            
-            # Mantener solo las actividades más recientes en memoria
-            self._activities = self._activities[:self._max_memory_activities]
-            
-            # Guardar en BD de forma asíncrona (no bloquear)
-            try:
-                activity_dict = activity.to_dict()
-                success = db_manager.save_activity(activity_dict)
-                if success:
-                    logger.debug(f"Activity {activity.id} saved to database")
-                else:
-                    logger.warning(f"Failed to save activity {activity.id} to database")
-            except Exception as e:
-                logger.error(f"Error saving activity to database: {e}")
+            # O(1): ocupa el hueco de la más antigua si el búfer está lleno
+            self._activities.append(activity)
+        
+        # Encolar en BD fuera del lock (el hilo escritor hace el commit)
+        try:
+            activity_dict = activity.to_dict()
+            success = db_manager.save_activity(activity_dict)
+            if success:
+                logger.debug(f"Activity {activity.id} queued for database")
+            else:
+                logger.warning(f"Failed to queue activity {activity.id} for database")
+        except Exception as e:
+            logger.error(f"Error saving activity to database: {e}")
     
     def add_activities_batch(self, activities: List[Activity]):
         """
@@ -96,31 +112,30 @@ class ActivityManager:
         if not activities:
             return
         
+        self.init()
         with self._lock:
-            # Agregar todas las actividades al inicio
-            new_activities = activities + self._activities
-            
-            # Mantener solo las más recientes
-            self._activities = new_activities[:self._max_memory_activities]
-            
-            # Guardar en BD en lote (más eficiente)
-            try:
-                activities_dicts = [a.to_dict() for a in activities]
-                saved_count = db_manager.save_activities_batch(activities_dicts)
-                logger.info(f"Saved {saved_count}/{len(activities)} activities to database")
-            except Exception as e:
-                logger.error(f"Error saving activity batch to database: {e}")
+            # activities[0] es la más reciente, como en el resto de listas
+            self._activities.extend_newest_first(activities)
+        
+        # Guardar en BD en lote fuera del lock (más eficiente)
+        try:
+            activities_dicts = [a.to_dict() for a in activities]
+            saved_count = db_manager.save_activities_batch(activities_dicts)
+            logger.info(f"Queued {saved_count}/{len(activities)} activities for database")
+        except Exception as e:
+            logger.error(f"Error saving activity batch to database: {e}")
     
     def get_recent_activities(self, limit: int = 50) -> List[Activity]:
         """Obtener actividades recientes de la memoria"""
+        self.init()
         with self._lock:
-            return self._activities[:limit].copy()
+            return self._activities.recent(limit)
     
     def get_activities_by_status(self, status: str, limit: int = 50) -> List[Activity]:
         """Obtener actividades filtradas por estado"""
+        self.init()
         with self._lock:
-            filtered = [a for a in self._activities if a.status == status]
-            return filtered[:limit]
+            return self._activities.recent_by(status, limit)
     
     def get_historical_activities(self, 
                                 days: int = 7, 
@@ -156,7 +171,7 @@ class ActivityManager:
             logger.error(f"Error retrieving historical activities: {e}")
             # Fallback: devolver actividades de memoria si la BD falla
             with self._lock:
-                return self._activities[:limit].copy()
+                return self._activities.recent(limit)
     
     def get_activities_by_date_range(self, 
                                    start_date: datetime, 
@@ -164,22 +179,21 @@ class ActivityManager:
                                    limit: int = 200) -> List[Activity]:
         """Obtener actividades en un rango de fechas específico"""
         try:
-            # Esta funcionalidad requeriría una nueva función en db_manager
-            # Por ahora, filtrar de las actividades históricas
-            all_activities = self.get_historical_activities(days=30, limit=500)
+            # Fechas sin zona horaria se interpretan en la zona del sistema
+            db_activities = db_manager.get_activities_in_range(
+                to_epoch_ms(start_date),
+                to_epoch_ms(end_date),
+                limit=limit
+            )
             
-            filtered = []
-            for activity in all_activities:
+            activities = []
+            for activity_data in db_activities:
                 try:
-                    activity_time = datetime.fromisoformat(activity.timestamp.replace('Z', '+00:00'))
-                    if start_date <= activity_time <= end_date:
-                        filtered.append(activity)
-                        if len(filtered) >= limit:
-                            break
+                    activities.append(validate_activity_data(activity_data))
                 except Exception as e:
-                    logger.warning(f"Error parsing activity timestamp: {e}")
+                    logger.warning(f"Error validating activity in date range: {e}")
             
-            return filtered
+            return activities
             
         except Exception as e:
             logger.error(f"Error getting activities by date range: {e}")
@@ -196,17 +210,7 @@ class ActivityManager:
     def count_activities_by_status(self, days: int = 7) -> Dict[str, int]:
         """Contar actividades por estado en los últimos X días"""
         try:
-            total = db_manager.count_activities(days=days)
-            high = db_manager.count_activities(status_filter='high', days=days)
-            medium = db_manager.count_activities(status_filter='medium', days=days)
-            low = db_manager.count_activities(status_filter='low', days=days)
-            
-            return {
-                'total': total,
-                'high': high,
-                'medium': medium,
-                'low': low
-            }
+            return db_manager.count_activities_by_status(days=days)
         except Exception as e:
             logger.error(f"Error counting activities by status: {e}")
             return {'total': 0, 'high': 0, 'medium': 0, 'low': 0}
@@ -220,6 +224,7 @@ class ActivityManager:
         if current_time - self._last_db_sync < self._db_sync_interval:
             return
         
+        self.init()
         self._last_db_sync = current_time
         
         try:
@@ -245,39 +250,33 @@ class ActivityManager:
                             logger.warning(f"Error validating DB activity during sync: {e}")
                 
                 if new_from_db:
-                    # Agregar al inicio y mantener límite
-                    all_activities = new_from_db + self._activities
-                    self._activities = all_activities[:self._max_memory_activities]
+                    # Agregar como las más recientes (el búfer expulsa las más antiguas)
+                    self._activities.extend_newest_first(new_from_db)
                     logger.debug(f"Synced {len(new_from_db)} activities from database")
             
         except Exception as e:
             logger.error(f"Error during database sync: {e}")
     
-    def cleanup_old_data(self, days_to_keep: int = 30):
+    def cleanup_old_data(self, days_to_keep: int = 30) -> Dict[str, Any]:
         """
         Limpiar datos antiguos de la base de datos.
         Mantener solo los últimos X días.
         """
         try:
-            cutoff_date = datetime.now(self._timezone) - timedelta(days=days_to_keep)
-            
-            # Esta funcionalidad requeriría una nueva función en db_manager
-            # Por ahora, solo log la intención
-            logger.info(f"Cleanup would remove activities older than {cutoff_date.isoformat()}")
-            
-            # TODO: Implementar db_manager.cleanup_old_activities(cutoff_date)
-            
+            return db_manager.cleanup_old_activities(days_to_keep=days_to_keep)
         except Exception as e:
             logger.error(f"Error during data cleanup: {e}")
+            return {}
     
     def get_stats_summary(self) -> Dict[str, Any]:
         """Obtener resumen de estadísticas del gestor de actividades"""
+        self.init()
         with self._lock:
             memory_count = len(self._activities)
             memory_by_status = {
-                'high': len([a for a in self._activities if a.status == 'high']),
-                'medium': len([a for a in self._activities if a.status == 'medium']),
-                'low': len([a for a in self._activities if a.status == 'low'])
+                'high': self._activities.count('high'),
+                'medium': self._activities.count('medium'),
+                'low': self._activities.count('low')
             }
         
         # Obtener estadísticas de BD
@@ -299,7 +298,7 @@ class ActivityManager:
             while True:
                 try:
                     time.sleep(3600)  # Limpiar cada hora
-                    self._cleanup_old_data()
+                    self.cleanup_old_data()
                 except Exception as e:
                     logger.error(f"Error in cleanup thread: {e}")
         
@@ -307,23 +306,10 @@ class ActivityManager:
         cleanup_thread.start()
         logger.info("Started cleanup thread for old data")
     
-    def _cleanup_old_data(self):
-        """NUEVO: Limpiar datos antiguos de la memoria"""
-        try:
-            with self._lock:
-                # Mantener solo las actividades más recientes en memoria
-                old_count = len(self._activities)
-                self._activities = self._activities[:self._max_memory_activities]
-                new_count = len(self._activities)
-                
-                if old_count > new_count:
-                    logger.info(f"Memory cleanup: reduced from {old_count} to {new_count} activities")
-                
-        except Exception as e:
-            logger.error(f"Error during memory cleanup: {e}")
-    
     def save_state(self):
         """NUEVO: Guardar estado actual para persistencia al apagar"""
+        if not self._started:
+            return True  # Nunca se usó: no hay estado en memoria que guardar
         try:
             # Forzar sincronización con base de datos
             self.sync_with_database()
@@ -332,7 +318,7 @@ class ActivityManager:
             state_info = {
                 'timestamp': datetime.now(self._timezone).isoformat(),
                 'memory_activities': len(self._activities),
-                'last_activity_id': self._activities[0].id if self._activities else None,
+                'last_activity_id': self._activities.newest().id if len(self._activities) else None,
                 'last_sync': self._last_db_sync
             }
             
@@ -347,6 +333,10 @@ class ActivityManager:
 activity_manager = ActivityManager()
 
 # Funciones de conveniencia para mantener compatibilidad
+def init():
+    """Cargar el gestor de actividades ahora en lugar de en su primer uso"""
+    return activity_manager.init()
+
 def add_activity(activity: Activity):
     """Agregar una actividad al sistema"""
     return activity_manager.add_activity(activity)
@@ -400,6 +390,6 @@ def get_memory_usage():
     """Obtener información de uso de memoria del sistema"""
     return {
         'total_activities_in_memory': len(activity_manager._activities),
-        'max_memory_limit': activity_manager._max_memory_activities,
-        'memory_usage_percent': (len(activity_manager._activities) / activity_manager._max_memory_activities) * 100
+        'max_memory_limit': activity_manager._activities.capacity,
+        'memory_usage_percent': (len(activity_manager._activities) / activity_manager._activities.capacity) * 100
     }
@@ -0,0 +1,104 @@
+"""
+Búfer circular de capacidad fija para las actividades en memoria.
+Las actividades se guardan en un array de tamaño fijo por número de
+secuencia (la posición es secuencia % capacidad): añadir sobrescribe el
+hueco de la más antigua, sin desplazar ni copiar el resto. Cada estado
+tiene además su propio anillo de secuencias (deque) y su contador, que se
+actualizan en la misma operación que el búfer principal: al expulsar una
+actividad su secuencia es siempre la más antigua de su estado, así que
+sale por la izquierda en O(1). Las consultas por estado recorren solo las
+k que devuelven y los conteos son la longitud de cada anillo.
+No es seguro entre hilos por sí mismo: ActivityManager lo usa bajo su lock.
+"""
+from collections import deque
+from itertools import islice
+from operator import attrgetter
+from typing import Any, Callable, Deque, Dict, Hashable, Iterator, List, Optional
+
+class ActivityRing:
+    """Últimas capacity actividades con índice secundario por estado"""
+
+    def __init__(self, capacity: int, key: Callable[[Any], Hashable] = attrgetter('status')):
+        if capacity <= 0:
+            raise ValueError("Ring capacity must be positive")
+        self.capacity = capacity
+        self._key = key
+        self._slots: List[Any] = [None] * capacity
+        self._slot_keys: List[Hashable] = [None] * capacity  # Clave de cada hueco al insertarlo
+        self._next_seq = 0  # Secuencia de la próxima actividad (total añadidas)
+        self._by_key: Dict[Hashable, Deque[int]] = {}
+
+    def __len__(self) -> int:
+        return min(self._next_seq, self.capacity)
+
+    def append(self, item: Any):
+        """Añadir una actividad como la más reciente, expulsando la más antigua si está lleno"""
+        seq = self._next_seq
+        slot = seq % self.capacity
+        if seq >= self.capacity:
+            evicted_key = self._slot_keys[slot]
+            index = self._by_key[evicted_key]
+            index.popleft()
+            if not index:
+                del self._by_key[evicted_key]
+        key = self._key(item)
+        self._slots[slot] = item
+        self._slot_keys[slot] = key
+        index = self._by_key.get(key)
+        if index is None:
+            index = self._by_key[key] = deque()
+        index.append(seq)
+        self._next_seq = seq + 1
+
+    def extend_newest_first(self, items: List[Any]):
+        """
+        Añadir un lote ordenado de más reciente a más antigua (el orden de
+        las listas de la API): items[0] queda como la más reciente. Del lote
+        solo se insertan las que caben.
+        """
+        for item in reversed(items[:self.capacity]):
+            self.append(item)
+
+    def _item(self, seq: int) -> Any:
+        return self._slots[seq % self.capacity]
+
+    def recent(self, limit: Optional[int] = None) -> List[Any]:
+        """Las limit más recientes, la más reciente primero (O(limit))"""
+        count = len(self) if limit is None else max(0, min(limit, len(self)))
+        return [self._item(seq) for seq in range(self._next_seq - 1, self._next_seq - 1 - count, -1)]
+
+    def recent_by(self, key: Hashable, limit: Optional[int] = None) -> List[Any]:
+        """Las limit más recientes con esa clave, la más reciente primero (O(limit))"""
+        index = self._by_key.get(key)
+        if not index:
+            return []
+        return [self._item(seq) for seq in islice(reversed(index), limit)]
+
+    def count(self, key: Hashable) -> int:
+        """Actividades en memoria con esa clave (O(1))"""
+        index = self._by_key.get(key)
+        return len(index) if index else 0
+
+    def counts(self) -> Dict[Hashable, int]:
+        """Conteo por clave de todas las que hay en memoria"""
+        return {key: len(index) for key, index in self._by_key.items()}
+
+    def newest(self) -> Optional[Any]:
+        return self._item(self._next_seq - 1) if self._next_seq else None
+
+    def __iter__(self) -> Iterator[Any]:
+        """Recorrido de la más reciente a la más antigua"""
+        return (self._item(seq) for seq in range(self._next_seq - 1, self._next_seq - 1 - len(self), -1))
+
+    def clear(self):
+        self._slots = [None] * self.capacity
+        self._slot_keys = [None] * self.capacity
+        self._next_seq = 0
+        self._by_key.clear()
+
+    def check(self) -> bool:
+        """Comprobar que los índices por clave coinciden con el búfer (para depuración)"""
+        expected: Dict[Hashable, List[int]] = {}
+        for seq in range(self._next_seq - len(self), self._next_seq):
+            expected.setdefault(self._slot_keys[seq % self.capacity], []).append(seq)
+        return expected == {key: list(index) for key, index in self._by_key.items()}
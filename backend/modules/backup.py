@@ -0,0 +1,253 @@
+"""
+Copias de seguridad en caliente con la API de backup de SQLite.
+La copia se hace por pasos de BACKUP_STEP_PAGES páginas con una pausa entre
+ellos desde una conexión de lectura propia, nunca desde la del hilo escritor.
+La conexión mantiene abierta una transacción de lectura durante toda la
+copia: en WAL eso no bloquea al escritor y fija una instantánea, mientras
+que sin ella cada commit ajeno reinicia la copia desde la primera página y
+con escrituras continuas no terminaría nunca. El archivo resultante puede
+comprimirse con gzip y se verifica restaurándolo en un temporal y pasando
+integrity_check antes de darlo por bueno.
+"""
+import os
+import gzip
+import shutil
+import sqlite3
+import logging
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Any, Optional
+
+from modules.message_codec import MessageCodec
+from modules.time_utils import TIMEZONE
+
+logger = logging.getLogger(__name__)
+
+BACKUP_STEP_PAGES = 64           # Páginas por paso (256 KB con páginas de 4 KB)
+BACKUP_STEP_SLEEP = 0.01         # Pausa entre pasos para ceder disco y CPU al resto
+BACKUP_KEEP = 7                  # Copias que se conservan en el directorio
+COMPRESS_CHUNK_BYTES = 1024 * 1024
+COMPRESS_LEVEL = 6               # gzip: el 9 apenas gana tamaño y cuesta el doble en una Pi
+BACKUP_PREFIX = 'shield-'
+BACKUP_SUFFIXES = ('.db', '.db.gz')
+
+def backup_name(at: Optional[float] = None) -> str:
+    """Nombre de una copia: shield-AAAAMMDD-HHMMSS.db (hora local, ordenable)"""
+    stamp = datetime.fromtimestamp(at if at is not None else time.time(), TIMEZONE)
+    return f"{BACKUP_PREFIX}{stamp.strftime('%Y%m%d-%H%M%S')}.db"
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def copy_database(source: sqlite3.Connection, dest_path: str,
+                  step_pages: int = BACKUP_STEP_PAGES, step_sleep: float = BACKUP_STEP_SLEEP) -> Dict[str, Any]:
+    """
+    Copiar la base de datos de source a dest_path por pasos.
+    source debe estar dentro de una transacción de lectura (BEGIN): la
+    primera lectura fija la instantánea que se copia entera.
+    """
+    if not source.in_transaction:
+        raise ValueError("Backup source must be inside a read transaction")
+    source.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchone()
+
+    steps = 0
+    restarts = 0
+    last_remaining = None
+    total_pages = 0
+
+    def progress(status, remaining, total):
+        nonlocal steps, restarts, last_remaining, total_pages
+        steps += 1
+        if last_remaining is not None and remaining > last_remaining:
+            restarts += 1
+        last_remaining = remaining
+        total_pages = total
+        if remaining and step_sleep > 0:
+            time.sleep(step_sleep)
+
+    dest = sqlite3.connect(dest_path)
+    try:
+        source.backup(dest, pages=step_pages, progress=progress)
+        # La cabecera copiada marca WAL: la copia queda como un único archivo autónomo
+        dest.execute("PRAGMA journal_mode = DELETE")
+        page_size = dest.execute("PRAGMA page_size").fetchone()[0]
+    finally:
+        dest.close()
+
+    return {'pages': total_pages, 'page_size': page_size, 'steps': steps, 'restarts': restarts}
+
+def compress_file(path: str, level: int = COMPRESS_LEVEL) -> str:
+    """Comprimir un archivo con gzip por bloques; devuelve la ruta .gz y borra el original"""
+    target = f"{path}.gz"
+    temporary = f"{target}.tmp"
+    try:
+        with open(path, 'rb') as src, gzip.open(temporary, 'wb', compresslevel=level) as dst:
+            shutil.copyfileobj(src, dst, COMPRESS_CHUNK_BYTES)
+        os.replace(temporary, target)
+    except Exception:
+        _remove(temporary)
+        raise
+    os.remove(path)
+    return target
+
+def _decompress_to(path: str, target: str):
+    with gzip.open(path, 'rb') as src, open(target, 'wb') as dst:
+        shutil.copyfileobj(src, dst, COMPRESS_CHUNK_BYTES)
+
+def check_database(db_path: str) -> Dict[str, Any]:
+    """
+    integrity_check de un archivo de base de datos y, si existe, del índice de
+    texto. Se abre en escritura porque el integrity-check de FTS5 es un INSERT
+    (no modifica nada y no se confirma), así que db_path debe ser una copia.
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        # El índice de texto lee los mensajes a través de message_text()
+        codec = MessageCodec()
+        codec.register(conn)
+        has_dictionaries = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'message_dictionaries'"
+        ).fetchone()
+        if has_dictionaries:
+            codec.load(conn)
+
+        problems = [row[0] for row in conn.execute("PRAGMA integrity_check")]
+        result = {'integrity': 'ok' if problems == ['ok'] else problems[:10]}
+
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'activities_fts'").fetchone():
+            try:
+                conn.execute("INSERT INTO activities_fts(activities_fts, rank) VALUES ('integrity-check', 1)")
+                result['fts'] = 'ok'
+            except sqlite3.DatabaseError as e:
+                result['fts'] = str(e)
+
+        result['schema_version'] = conn.execute("PRAGMA user_version").fetchone()[0]
+        result['ok'] = result['integrity'] == 'ok' and result.get('fts', 'ok') == 'ok'
+        return result
+    finally:
+        conn.close()
+
+def verify_backup(path: str) -> Dict[str, Any]:
+    """
+    Verificar una copia restaurándola en un archivo temporal (descomprimido
+    si es .gz) y comprobando su integridad.
+    """
+    started = time.time()
+    temporary = f"{path}.verify"
+    try:
+        if path.endswith('.gz'):
+            _decompress_to(path, temporary)
+        else:
+            shutil.copyfile(path, temporary)
+        result = check_database(temporary)
+    except (OSError, sqlite3.DatabaseError) as e:
+        result = {'ok': False, 'integrity': str(e)}
+    finally:
+        _remove(temporary)
+    result['seconds'] = round(time.time() - started, 3)
+    return result
+
+def restore_backup(path: str, db_path: str, overwrite: bool = False) -> Dict[str, Any]:
+    """
+    Restaurar una copia en db_path (con el servicio parado).
+    La copia se descomprime junto al destino, se verifica y solo entonces
+    reemplaza al archivo; los -wal/-shm anteriores se eliminan porque
+    pertenecen a la base de datos sustituida.
+    """
+    if os.path.exists(db_path) and not overwrite:
+        raise FileExistsError(f"{db_path} already exists")
+
+    temporary = f"{db_path}.restore"
+    try:
+        if path.endswith('.gz'):
+            _decompress_to(path, temporary)
+        else:
+            shutil.copyfile(path, temporary)
+        result = check_database(temporary)
+        if not result['ok']:
+            raise ValueError(f"Backup {path} failed verification: {result}")
+        for suffix in ('-wal', '-shm'):
+            _remove(f"{db_path}{suffix}")
+        os.replace(temporary, db_path)
+    finally:
+        _remove(temporary)
+
+    logger.info(f"Restored {path} into {db_path}")
+    return result
+
+def list_backups(directory: str) -> List[Dict[str, Any]]:
+    """Copias del directorio, de la más antigua a la más reciente"""
+    try:
+        names = sorted(os.listdir(directory))
+    except FileNotFoundError:
+        return []
+    backups = []
+    for name in names:
+        if not name.startswith(BACKUP_PREFIX) or not name.endswith(BACKUP_SUFFIXES):
+            continue
+        path = os.path.join(directory, name)
+        stat = os.stat(path)
+        backups.append({'name': name, 'path': path, 'bytes': stat.st_size, 'created_at': int(stat.st_mtime)})
+    return backups
+
+def prune_backups(directory: str, keep: int = BACKUP_KEEP) -> int:
+    """Borrar las copias más antiguas dejando keep; devuelve cuántas se borraron"""
+    backups = list_backups(directory)
+    expired = backups[:-keep] if keep > 0 else backups
+    for backup in expired:
+        _remove(backup['path'])
+    return len(expired)
+
+def run_backup(copy: Callable[[str], Dict[str, Any]], directory: str, compress: bool = True,
+               verify: bool = True, keep: int = BACKUP_KEEP) -> Dict[str, Any]:
+    """
+    Hacer una copia completa en directory.
+    copy(ruta) escribe la base de datos en la ruta (normalmente copy_database
+    con una conexión de lectura del motor) y devuelve sus métricas. Se escribe
+    con un nombre temporal y se renombra al terminar, así una copia
+    interrumpida nunca aparece en list_backups(). Devuelve el informe con
+    duración y rendimiento de cada fase.
+    """
+    os.makedirs(directory, exist_ok=True)
+    started = time.time()
+    path = os.path.join(directory, backup_name(started))
+    temporary = f"{path}.tmp"
+
+    report: Dict[str, Any] = {'started_at': int(started)}
+    try:
+        report.update(copy(temporary))
+        os.replace(temporary, path)
+    except Exception:
+        _remove(temporary)
+        raise
+
+    copy_seconds = time.time() - started
+    database_bytes = os.path.getsize(path)
+    report['copy_seconds'] = round(copy_seconds, 3)
+    report['database_bytes'] = database_bytes
+    report['copy_mb_per_s'] = round(database_bytes / 1048576 / copy_seconds, 2) if copy_seconds else 0.0
+
+    if compress:
+        compress_started = time.time()
+        path = compress_file(path)
+        compress_seconds = time.time() - compress_started
+        report['compress_seconds'] = round(compress_seconds, 3)
+        report['compress_mb_per_s'] = round(database_bytes / 1048576 / compress_seconds, 2) if compress_seconds else 0.0
+
+    report['path'] = path
+    report['bytes'] = os.path.getsize(path)
+    report['compression_ratio'] = round(database_bytes / report['bytes'], 2) if report['bytes'] else 0.0
+
+    if verify:
+        report['verification'] = verify_backup(path)
+        if not report['verification']['ok']:
+            # Una copia que no se puede restaurar no debe desplazar a las buenas
+            _remove(path)
+            raise ValueError(f"Backup failed verification: {report['verification']}")
+
+    report['pruned'] = prune_backups(directory, keep)
+    report['duration_seconds'] = round(time.time() - started, 3)
+    return report
@@ -0,0 +1,393 @@
+"""
+Almacenamiento en frío de actividades antiguas en segmentos columnares.
+Cada segmento es un archivo .npz comprimido con un array NumPy por columna:
+los instantes se guardan como deltas y las columnas de texto con
+codificación por diccionario (códigos enteros + diccionario UTF-8). El
+resto de json_data (protocolo, puertos, países, tráfico, interfaces...) se
+guarda por fila en una columna de texto JSON, así archivar no pierde
+campos. Las consultas de conteo y filtro se resuelven con máscaras
+vectorizadas sin reconstruir las filas.
+"""
+import os
+import json
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Any, Optional, Iterable, Tuple
+
+import numpy as np
+
+from modules import ip_utils
+from modules.time_utils import TIMEZONE
+
+logger = logging.getLogger(__name__)
+
+# Columnas de texto codificadas por diccionario (el código 0 es NULL)
+DICT_COLUMNS = ('activity_id', 'message', 'source', 'status', 'alert_level', 'src_ip',
+                'dst_ip', 'service', 'action', 'device_name', 'device_type')
+
+# Orden de las columnas que recibe write_segment() (extra es el json_data de la fila)
+SEGMENT_COLUMNS = ('ts_epoch_ms', 'threat_score') + DICT_COLUMNS + ('extra',)
+
+# Columnas de IP: sus filtros admiten una IP o red CIDR y comparan claves ip_key
+IP_COLUMNS = ('src_ip', 'dst_ip')
+
+# Campos de json_data que ya guardan las columnas (el mensaje solo está en
+# json_data cuando la columna lo recorta, y entonces se conserva entero)
+COLUMN_FIELDS = frozenset(('id', 'timestamp', 'threat_score') + tuple(
+    column for column in DICT_COLUMNS if column not in ('activity_id', 'message')))
+
+COLD_CACHE_SEGMENTS = 64  # Segmentos abiertos sin usar que se conservan en memoria
+
+def _encode_strings(values: List[Optional[str]]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Codificar una columna de texto: (códigos, diccionario UTF-8, desplazamientos)"""
+    lookup: Dict[str, int] = {}
+    codes = np.zeros(len(values), dtype=np.uint32)
+    for i, value in enumerate(values):
+        if value is None:
+            continue
+        code = lookup.get(value)
+        if code is None:
+            code = lookup[value] = len(lookup) + 1
+        codes[i] = code
+
+    encoded = [value.encode('utf-8') for value in lookup]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.uint32)
+    if encoded:
+        offsets[1:] = np.cumsum([len(value) for value in encoded])
+    blob = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+
+    # Códigos con el tipo más pequeño que admite el diccionario
+    if len(lookup) < 2 ** 8:
+        codes = codes.astype(np.uint8)
+    elif len(lookup) < 2 ** 16:
+        codes = codes.astype(np.uint16)
+    return codes, blob, offsets
+
+def extra_json(json_data: Optional[str]) -> str:
+    """json_data de una fila sin los campos que ya tienen columna (JSON compacto)"""
+    try:
+        stored = json.loads(json_data) if json_data else {}
+    except (json.JSONDecodeError, TypeError):
+        stored = {}
+    if not isinstance(stored, dict):
+        stored = {}
+    extra = {key: value for key, value in stored.items() if key not in COLUMN_FIELDS}
+    return json.dumps(extra, separators=(',', ':'), default=str, ensure_ascii=False) if extra else ''
+
+def _encode_text(values: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """Columna de texto sin diccionario (un valor distinto por fila): (UTF-8, desplazamientos)"""
+    encoded = [value.encode('utf-8') for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.uint32)
+    if encoded:
+        offsets[1:] = np.cumsum([len(value) for value in encoded])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+class Segment:
+    """
+    Segmento abierto. Cada columna se descomprime la primera vez que se usa,
+    así un conteo por estado solo lee los instantes y los códigos de estado.
+    """
+
+    def __init__(self, path: str):
+        self._npz = np.load(path, allow_pickle=False)
+        self._arrays: Dict[str, np.ndarray] = {}
+        self._lock = threading.Lock()
+        self._blobs: Dict[str, bytes] = {}
+        self._keys: Dict[str, List[Optional[bytes]]] = {}
+        self.ts = np.cumsum(self._array('ts_delta'))
+        # Los segmentos anteriores a la columna extra solo tienen las columnas de diccionario
+        self.has_extra = 'extra_text' in self._npz.files
+        # Lecturas en curso y si ya salió de la caché (los gestiona ColdStore con su lock):
+        # el archivo se cierra cuando sale de la caché y nadie lo está leyendo
+        self.refs = 0
+        self.evicted = False
+
+    def _array(self, key: str) -> np.ndarray:
+        array = self._arrays.get(key)
+        if array is None:
+            # El zip subyacente no admite lecturas concurrentes
+            with self._lock:
+                array = self._arrays[key] = self._npz[key]
+        return array
+
+    def close(self):
+        self._npz.close()
+
+    def __len__(self) -> int:
+        return len(self.ts)
+
+    @property
+    def threat_score(self) -> np.ndarray:
+        return self._array('threat_score')
+
+    def codes(self, column: str) -> np.ndarray:
+        return self._array(f"{column}_codes")
+
+    def _dictionary_key(self, column: str) -> str:
+        """Clave del npz con el texto de una columna (extra no tiene diccionario)"""
+        return 'extra_text' if column == 'extra' else f"{column}_dict"
+
+    def _dictionary(self, column: str) -> Tuple[bytes, np.ndarray]:
+        """Diccionario de una columna: bytes UTF-8 concatenados y desplazamientos"""
+        blob = self._blobs.get(column)
+        if blob is None:
+            blob = self._blobs[column] = self._array(self._dictionary_key(column)).tobytes()
+        return blob, self._array(f"{column}_offsets")
+
+    def value(self, column: str, code: int) -> Optional[str]:
+        """Decodificar un único código (0 es NULL)"""
+        if code == 0:
+            return None
+        blob, offsets = self._dictionary(column)
+        return blob[offsets[code - 1]:offsets[code]].decode('utf-8')
+
+    def code_of(self, column: str, value: str) -> int:
+        """Código de un valor (-1 si no aparece en el segmento), sin decodificar el diccionario"""
+        blob, offsets = self._dictionary(column)
+        target = value.encode('utf-8')
+        position = blob.find(target)
+        while position >= 0:
+            index = int(np.searchsorted(offsets, position))
+            if index < len(offsets) - 1 and offsets[index] == position and offsets[index + 1] == position + len(target):
+                return index + 1
+            position = blob.find(target, position + 1)
+        return -1
+
+    def _ip_keys(self, column: str) -> List[Optional[bytes]]:
+        """Claves ip_key de cada entrada del diccionario de una columna (cacheadas)"""
+        keys = self._keys.get(column)
+        if keys is None:
+            blob, offsets = self._dictionary(column)
+            keys = self._keys[column] = [
+                ip_utils.ip_key(blob[offsets[i]:offsets[i + 1]].decode('utf-8'))
+                for i in range(len(offsets) - 1)
+            ]
+        return keys
+
+    def codes_in_network(self, column: str, network: ip_utils.IPNetwork) -> np.ndarray:
+        """
+        Códigos de las IPs del diccionario de una columna que pertenecen a una
+        red. Se comparan claves ip_key, no el texto: 1.2.3.4/32 o una IPv6 no
+        canónica encuentran la dirección igual que en la tabla caliente.
+        """
+        low, high = ip_utils.network_range(network)
+        codes = [i + 1 for i, key in enumerate(self._ip_keys(column)) if key is not None and low <= key <= high]
+        return np.asarray(codes, dtype=np.uint32)
+
+    def mask(self, start_ms: int, end_ms: int, filters: Dict[str, Any]) -> np.ndarray:
+        """Filas del rango [start_ms, end_ms] que cumplen los filtros (las columnas de IP admiten una red CIDR)"""
+        mask = (self.ts >= start_ms) & (self.ts <= end_ms)
+        for column, value in filters.items():
+            if value is None:
+                continue
+            if column in IP_COLUMNS:
+                # Misma semántica que _ip_condition() en la tabla caliente
+                network = ip_utils.parse_network(value)
+                mask &= np.isin(self.codes(column), self.codes_in_network(column, network))
+            else:
+                code = self.code_of(column, value)
+                if code < 0:
+                    return np.zeros(len(self.ts), dtype=bool)
+                mask &= self.codes(column) == code
+            if not mask.any():
+                break
+        return mask
+
+    def extra(self, index: int) -> Dict[str, Any]:
+        """Campos de json_data sin columna propia de una fila"""
+        if not self.has_extra:
+            return {}
+        blob, offsets = self._dictionary('extra')
+        text = blob[offsets[index]:offsets[index + 1]]
+        return json.loads(text) if text else {}
+
+    def rows(self, indexes: Iterable[int]) -> List[Dict[str, Any]]:
+        """Reconstruir actividades completas (columnas y resto de json_data)"""
+        codes = {column: self.codes(column) for column in DICT_COLUMNS}
+        results = []
+        for i in indexes:
+            activity = {column: self.value(column, int(codes[column][i])) for column in DICT_COLUMNS}
+            # El mensaje entero de extra (si lo hay) sustituye al recortado de la columna
+            activity.update(self.extra(int(i)))
+            activity['id'] = activity.pop('activity_id')
+            activity['timestamp'] = datetime.fromtimestamp(int(self.ts[i]) / 1000, TIMEZONE).isoformat()
+            activity['threat_score'] = float(self.threat_score[i])
+            activity['archived'] = True
+            results.append(activity)
+        return results
+
+class ColdStore:
+    """
+    Directorio de segmentos con caché LRU de segmentos decodificados.
+    Cada lectura toma una referencia al segmento mientras lo usa: salir de
+    la caché o borrarse no cierra un segmento que otro hilo aún lee (una
+    exportación en streaming, un conteo concurrente).
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._cache: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory, f"{name}.npz")
+
+    def write_segment(self, name: str, columns: Dict[str, List[Any]]) -> int:
+        """Escribir un segmento de forma atómica. Devuelve su tamaño en bytes."""
+        os.makedirs(self.directory, exist_ok=True)
+        ts = np.asarray(columns['ts_epoch_ms'], dtype=np.int64)
+        arrays = {
+            # Filas ordenadas por tiempo: los deltas son pequeños y comprimen bien
+            'ts_delta': np.diff(ts, prepend=np.int64(0)),
+            'threat_score': np.asarray([v or 0.0 for v in columns['threat_score']], dtype=np.float32)
+        }
+        for column in DICT_COLUMNS:
+            codes, blob, offsets = _encode_strings(columns[column])
+            arrays[f"{column}_codes"] = codes
+            arrays[f"{column}_dict"] = blob
+            arrays[f"{column}_offsets"] = offsets
+        arrays['extra_text'], arrays['extra_offsets'] = _encode_text([extra_json(value) for value in columns['extra']])
+
+        path = self.path(name)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez_compressed(f, **arrays)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        return os.path.getsize(path)
+
+    def acquire(self, name: str) -> Segment:
+        """Cargar (o tomar de la caché) un segmento con una referencia; devolverla con release()"""
+        with self._lock:
+            segment = self._cache.get(name)
+            if segment is not None:
+                self._cache.move_to_end(name)
+                segment.refs += 1
+                return segment
+
+        loaded = Segment(self.path(name))
+        to_close = []
+        with self._lock:
+            segment = self._cache.get(name)
+            if segment is None:
+                segment = self._cache[name] = loaded
+            else:
+                # Otro hilo lo cargó mientras tanto
+                to_close.append(loaded)
+            segment.refs += 1
+            while len(self._cache) > COLD_CACHE_SEGMENTS:
+                oldest = self._cache.popitem(last=False)[1]
+                oldest.evicted = True
+                if not oldest.refs:
+                    to_close.append(oldest)
+        for other in to_close:
+            other.close()
+        return segment
+
+    def release(self, segment: Segment):
+        """Devolver la referencia de acquire(); cierra el segmento si ya salió de la caché"""
+        with self._lock:
+            segment.refs -= 1
+            close = segment.evicted and not segment.refs
+        if close:
+            segment.close()
+
+    def remove(self, name: str):
+        """Borrar un segmento y sacarlo de la caché"""
+        with self._lock:
+            segment = self._cache.pop(name, None)
+            close = segment is not None and not segment.refs
+            if segment is not None:
+                segment.evicted = True
+        if close:
+            segment.close()
+        try:
+            os.remove(self.path(name))
+        except FileNotFoundError:
+            pass
+
+    def remove_orphans(self, known: Iterable[str]) -> int:
+        """Borrar archivos sin fila en el manifiesto (tiering interrumpido)"""
+        if not os.path.isdir(self.directory):
+            return 0
+        known = set(known)
+        removed = 0
+        for filename in os.listdir(self.directory):
+            name = filename.split('.npz')[0]
+            if filename.endswith('.tmp') or (filename.endswith('.npz') and name not in known):
+                os.remove(os.path.join(self.directory, filename))
+                removed += 1
+        return removed
+
+    def _segments(self, names: Iterable[str]):
+        """
+        Cargar segmentos en orden, saltando los borrados por la retención
+        mientras tanto. Cada uno conserva su referencia hasta pedir el siguiente.
+        """
+        for name in names:
+            try:
+                segment = self.acquire(name)
+            except FileNotFoundError:
+                logger.debug(f"Cold segment {name} no longer exists")
+                continue
+            try:
+                yield segment
+            finally:
+                self.release(segment)
+
+    def count(self, names: Iterable[str], start_ms: int, end_ms: int, filters: Dict[str, Any]) -> int:
+        """Contar filas que cumplen los filtros"""
+        return sum(int(segment.mask(start_ms, end_ms, filters).sum()) for segment in self._segments(names))
+
+    def count_by(self, names: Iterable[str], column: str, start_ms: int, end_ms: int,
+                 filters: Dict[str, Any]) -> Dict[str, int]:
+        """Conteo por valor de una columna de texto: {valor: filas}"""
+        totals: Dict[str, int] = {}
+        for segment in self._segments(names):
+            codes = segment.codes(column)[segment.mask(start_ms, end_ms, filters)]
+            if not len(codes):
+                continue
+            counts = np.bincount(codes)
+            for code in np.flatnonzero(counts):
+                value = segment.value(column, int(code)) or 'unknown'
+                totals[value] = totals.get(value, 0) + int(counts[code])
+        return totals
+
+    def select(self, names: Iterable[str], start_ms: int, end_ms: int, filters: Dict[str, Any],
+               limit: int = 100, offset: int = 0) -> List[Dict[str, Any]]:
+        """Filas que cumplen los filtros, de la más reciente a la más antigua (saltando offset)"""
+        results = []
+        if limit <= 0:
+            return results
+        # Los segmentos llegan ordenados por tiempo descendente
+        for segment in self._segments(names):
+            indexes = np.flatnonzero(segment.mask(start_ms, end_ms, filters))[::-1]
+            if offset >= len(indexes):
+                # Segmento entero antes de la página: solo se cuentan sus filas
+                offset -= len(indexes)
+                continue
+            results.extend(segment.rows(indexes[offset:offset + limit - len(results)]))
+            offset = 0
+            if len(results) >= limit:
+                break
+        return results
+
+    def iter_rows(self, names: Iterable[str], start_ms: int, end_ms: int, filters: Dict[str, Any],
+                  chunk_size: int = 1000):
+        """Filas que cumplen los filtros en orden cronológico (segmentos en orden ascendente)"""
+        for segment in self._segments(names):
+            indexes = np.flatnonzero(segment.mask(start_ms, end_ms, filters))
+            for i in range(0, len(indexes), chunk_size):
+                yield from segment.rows(indexes[i:i + chunk_size])
+
+def segment_columns(rows: List[Tuple]) -> Dict[str, List[Any]]:
+    """Pasar filas (en el orden de SEGMENT_COLUMNS) a columnas"""
+    return {column: [row[i] for row in rows] for i, column in enumerate(SEGMENT_COLUMNS)}
+
+def segment_name(day_start_ms: int, first_id: int) -> str:
+    """Nombre de segmento: día local y primer rowid (un día puede ocupar varios)"""
+    day = datetime.fromtimestamp(day_start_ms / 1000, TIMEZONE).strftime('%Y%m%d')
+    return f"{day}-{first_id}"
@@ -0,0 +1,74 @@
+"""
+Exportación en streaming de actividades como NDJSON o CSV.
+Los generadores reciben las actividades de OptimizedDBManager.iter_activities
+(bloques pequeños por keyset) y producen trozos de bytes de tamaño acotado,
+opcionalmente comprimidos en gzip sobre la marcha: la memoria no depende
+del número de filas exportadas.
+"""
+import io
+import csv
+import json
+import zlib
+from typing import Dict, Any, Iterable, Iterator
+
+# Columnas del CSV (las del Dashboard más el estado y la puntuación)
+CSV_COLUMNS = ('timestamp', 'id', 'status', 'alert_level', 'threat_score', 'source', 'message',
+               'src_ip', 'dst_ip', 'service', 'action', 'protocol', 'dst_country',
+               'device_name', 'device_type')
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv'
+}
+
+EXPORT_FLUSH_BYTES = 64 * 1024  # Tamaño de cada trozo entregado al servidor
+
+def _buffered(lines: Iterable[str]) -> Iterator[bytes]:
+    """Agrupar líneas en trozos de EXPORT_FLUSH_BYTES"""
+    buffer = []
+    size = 0
+    for line in lines:
+        buffer.append(line)
+        size += len(line)
+        if size >= EXPORT_FLUSH_BYTES:
+            yield ''.join(buffer).encode('utf-8')
+            buffer, size = [], 0
+    if buffer:
+        yield ''.join(buffer).encode('utf-8')
+
+def ndjson_lines(activities: Iterable[Dict[str, Any]]) -> Iterator[str]:
+    """Una actividad JSON por línea"""
+    for activity in activities:
+        yield json.dumps(activity, separators=(',', ':'), default=str, ensure_ascii=False) + '\n'
+
+def csv_lines(activities: Iterable[Dict[str, Any]]) -> Iterator[str]:
+    """Cabecera y una fila por actividad con las columnas de CSV_COLUMNS"""
+    out = io.StringIO()
+    writer = csv.writer(out)
+
+    def take() -> str:
+        line = out.getvalue()
+        out.seek(0)
+        out.truncate()
+        return line
+
+    writer.writerow(CSV_COLUMNS)
+    yield take()
+    for activity in activities:
+        writer.writerow(['' if activity.get(column) is None else activity.get(column) for column in CSV_COLUMNS])
+        yield take()
+
+def gzip_chunks(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Comprimir un flujo de trozos en formato gzip sin acumularlo"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31: cabecera gzip
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+def stream(activities: Iterable[Dict[str, Any]], fmt: str = 'ndjson', compress: bool = False) -> Iterator[bytes]:
+    """Trozos de bytes de la exportación en el formato pedido"""
+    lines = csv_lines(activities) if fmt == 'csv' else ndjson_lines(activities)
+    chunks = _buffered(lines)
+    return gzip_chunks(chunks) if compress else chunks
@@ -0,0 +1,242 @@
+"""
+Agregación de varios sensores (una Pi por sede, cada una con su shield.db).
+Cada sensor publica sus actividades nuevas en /api/federation/changes por
+orden de rowid; el nodo agregador las pide con un cursor incremental por
+sensor (último rowid fusionado, y el instante de esa fila para medir el
+retraso), las recibe en JSON comprimido con gzip y las fusiona en su propio
+motor con el cursor en la misma transacción: tras un corte se reanuda justo
+donde se confirmó y una página repetida no duplica filas. Las consultas
+entre sedes se reparten en paralelo a todos los sensores (fan_out).
+Configuración por entorno: SHIELD_SENSORS="sede1=http://10.0.0.2:5000,..."
+activa el modo agregador y SHIELD_FEDERATION_TOKEN se exige y se envía en la
+cabecera X-Federation-Token. Sin token la federación queda desactivada: el
+sensor no publica sus cambios y el agregador no arranca.
+"""
+import os
+import gzip
+import json
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional, Tuple
+from urllib import request as urlrequest
+from urllib.parse import urlencode
+
+logger = logging.getLogger(__name__)
+
+FEDERATION_PAGE_ROWS = 2000          # Filas pedidas por página de cambios
+FEDERATION_PULL_INTERVAL = 15        # Segundos entre rondas de sincronización
+FEDERATION_MAX_PAGES = 50            # Páginas máximas por sensor y ronda (el resto, en la siguiente)
+FEDERATION_TIMEOUT = 10              # Plazo HTTP por petición a un sensor
+FAN_OUT_WORKERS = 8                  # Peticiones simultáneas a sensores
+TOKEN_HEADER = 'X-Federation-Token'
+
+def federation_token() -> Optional[str]:
+    """Token compartido entre sensores y agregador (None: federación desactivada)"""
+    return os.environ.get('SHIELD_FEDERATION_TOKEN') or None
+
+def parse_sensors(value: Optional[str]) -> Dict[str, str]:
+    """Sensores de SHIELD_SENSORS: "nombre=url,nombre=url" -> {nombre: url}"""
+    sensors = {}
+    for item in (value or '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        name, separator, url = item.partition('=')
+        if not separator or not name.strip() or not url.strip():
+            raise ValueError(f"Invalid sensor '{item}', expected name=url")
+        sensors[name.strip()] = url.strip().rstrip('/')
+    return sensors
+
+def encode_changes(changes: Dict[str, Any]) -> bytes:
+    """Página de cambios en JSON compacto comprimido con gzip"""
+    body = json.dumps(changes, separators=(',', ':'), default=str, ensure_ascii=False).encode('utf-8')
+    return gzip.compress(body, compresslevel=6)
+
+def remote_activity(sensor: str, activity: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Actividad de un sensor lista para el almacén central: el id se prefija
+    con el sensor (los ids solo son únicos en su sede) y se anota su origen.
+    """
+    activity = dict(activity)
+    activity.pop('ts_epoch_ms', None)
+    activity['id'] = f"{sensor}:{activity.get('id')}"
+    activity['sensor'] = sensor
+    return activity
+
+class SensorClient:
+    """Cliente HTTP de un sensor (solo biblioteca estándar)"""
+
+    def __init__(self, name: str, url: str, token: Optional[str] = None, timeout: float = FEDERATION_TIMEOUT):
+        self.name = name
+        self.url = url
+        self.token = token
+        self.timeout = timeout
+
+    def _request(self, path: str, params: Optional[Dict[str, Any]] = None) -> Tuple[bytes, int, Dict[str, str]]:
+        """
+        GET al sensor: (cuerpo sin comprimir, bytes recibidos, cabeceras).
+        Los errores de red y HTTP (URLError/HTTPError) son OSError.
+        """
+        url = f"{self.url}{path}"
+        if params:
+            url += '?' + urlencode({key: value for key, value in params.items() if value is not None})
+        req = urlrequest.Request(url, headers={'Accept-Encoding': 'gzip', 'Accept': 'application/json'})
+        if self.token:
+            req.add_header(TOKEN_HEADER, self.token)
+        with urlrequest.urlopen(req, timeout=self.timeout) as response:
+            body = response.read()
+            headers = dict(response.headers.items())
+        received = len(body)
+        if headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        return body, received, headers
+
+    def get_json(self, path: str, params: Optional[Dict[str, Any]] = None) -> Any:
+        body, _, _ = self._request(path, params)
+        return json.loads(body)
+
+    def fetch_changes(self, after_id: int, limit: int = FEDERATION_PAGE_ROWS) -> Tuple[Dict[str, Any], int, int]:
+        """Página de cambios tras after_id: (cambios, bytes recibidos, bytes sin comprimir)"""
+        body, received, _ = self._request('/api/federation/changes', {'after': after_id, 'limit': limit})
+        return json.loads(body), received, len(body)
+
+class FederationAggregator:
+    """
+    Sincroniza los sensores en el motor local y reparte consultas entre ellos.
+    Cada ronda sincroniza todos los sensores en paralelo; los de un mismo
+    sensor van en orden, página a página, esperando el commit de cada una.
+    """
+
+    def __init__(self, manager, sensors: Dict[str, str], token: Optional[str] = None,
+                 interval: float = FEDERATION_PULL_INTERVAL):
+        self.manager = manager
+        self.clients = {name: SensorClient(name, url, token) for name, url in sensors.items()}
+        self.interval = interval
+        workers = min(FAN_OUT_WORKERS, max(1, len(sensors)))
+        # Ejecutores separados: una ronda de sincronización larga no retrasa las consultas
+        self._sync_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="FederationSync")
+        self._query_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="FederationQuery")
+        self._stop = threading.Event()
+        self._thread = None
+        self.metrics = {
+            name: {'rows': 0, 'pages': 0, 'bytes_received': 0, 'bytes_raw': 0, 'errors': 0,
+                   'resets': 0, 'last_sync': None, 'last_sync_ms': None, 'last_error': None}
+            for name in sensors
+        }
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True, name="FederationSync")
+            self._thread.start()
+            logger.info(f"Federation aggregator started with {len(self.clients)} sensors")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + FEDERATION_TIMEOUT)
+        self._sync_executor.shutdown(wait=False)
+        self._query_executor.shutdown(wait=False)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.sync_all()
+            self._stop.wait(self.interval)
+
+    def sync_all(self) -> Dict[str, int]:
+        """Una ronda de sincronización de todos los sensores en paralelo: {sensor: filas nuevas}"""
+        futures = {name: self._sync_executor.submit(self.sync_sensor, name) for name in self.clients}
+        return {name: future.result() for name, future in futures.items()}
+
+    def sync_sensor(self, name: str) -> int:
+        """Traer y fusionar las páginas pendientes de un sensor. Devuelve las filas fusionadas."""
+        client = self.clients[name]
+        metrics = self.metrics[name]
+        started = time.perf_counter()
+        merged = 0
+        try:
+            state = self.manager.get_federation_cursors().get(name, {})
+            after_id = state.get('last_id', 0)
+            for _ in range(FEDERATION_MAX_PAGES):
+                changes, received, raw = client.fetch_changes(after_id)
+                metrics['pages'] += 1
+                metrics['bytes_received'] += received
+                metrics['bytes_raw'] += raw
+
+                if changes['max_id'] < after_id:
+                    # Base de datos del sensor reemplazada: empezar de nuevo (los repetidos se ignoran)
+                    logger.warning(f"Sensor {name} rowids went back ({changes['max_id']} < {after_id}), resyncing")
+                    metrics['resets'] += 1
+                    after_id = 0
+                    continue
+
+                activities = [remote_activity(name, activity) for activity in changes['activities']]
+                if activities:
+                    committed = self.manager.merge_remote_activities(
+                        name, activities, changes['next_after'], changes['last_ts_epoch_ms']
+                    )
+                    confirmed = self.manager.get_federation_cursors().get(name, {}).get('last_id', 0)
+                    if not committed or confirmed != changes['next_after']:
+                        raise RuntimeError(f"merge of {len(activities)} activities was not committed")
+                    merged += len(activities)
+                    after_id = changes['next_after']
+                if not changes['more']:
+                    break
+
+            metrics['rows'] += merged
+            metrics['last_sync'] = int(time.time())
+            metrics['last_sync_ms'] = round((time.perf_counter() - started) * 1000, 1)
+            if merged:
+                logger.info(f"Merged {merged} activities from sensor {name}")
+        except (OSError, ValueError, KeyError, RuntimeError) as e:
+            metrics['errors'] += 1
+            metrics['last_error'] = {'error': str(e), 'at': int(time.time())}
+            logger.warning(f"Federation sync with sensor {name} failed: {e}")
+        return merged
+
+    def fan_out(self, path: str, params: Optional[Dict[str, Any]] = None,
+                timeout: float = FEDERATION_TIMEOUT) -> Dict[str, Dict[str, Any]]:
+        """
+        Hacer la misma consulta GET a todos los sensores en paralelo.
+        Devuelve {sensor: {'ok', 'data' o 'error', 'ms'}}; un sensor caído no
+        impide responder con los demás.
+        """
+        def call(client: SensorClient):
+            started = time.perf_counter()
+            try:
+                data = client.get_json(path, params)
+                result = {'ok': True, 'data': data}
+            except (OSError, ValueError) as e:
+                result = {'ok': False, 'error': str(e)}
+            result['ms'] = round((time.perf_counter() - started) * 1000, 1)
+            return result
+
+        futures = {name: self._query_executor.submit(call, client) for name, client in self.clients.items()}
+        deadline = time.monotonic() + timeout + 1
+        results = {}
+        for name, future in futures.items():
+            try:
+                results[name] = future.result(timeout=max(0.0, deadline - time.monotonic()))
+            except Exception as e:
+                results[name] = {'ok': False, 'error': str(e) or type(e).__name__}
+        return results
+
+    def get_status(self) -> Dict[str, Any]:
+        """Cursores confirmados y métricas de transferencia por sensor"""
+        cursors = self.manager.get_federation_cursors()
+        sensors = {}
+        for name, client in self.clients.items():
+            metrics = self.metrics[name]
+            cursor = cursors.get(name, {})
+            last_ts = cursor.get('last_ts_epoch_ms')
+            sensors[name] = {
+                'url': client.url,
+                'cursor': cursor,
+                'lag_seconds': round(time.time() - last_ts / 1000, 1) if last_ts else None,
+                'compression_ratio': round(metrics['bytes_raw'] / metrics['bytes_received'], 2)
+                if metrics['bytes_received'] else None,
+                **metrics
+            }
+        return {'interval_seconds': self.interval, 'sensors': sensors}
@@ -0,0 +1,76 @@
+"""
+Direcciones IP como claves ordenables y filtros CIDR.
+Cada dirección se guarda como un BLOB de 16 bytes en orden de red (las
+IPv4 como IPv4-mapped, ::ffff:a.b.c.d), así que SQLite las compara byte a
+byte en el mismo orden que los números: una red CIDR es un rango
+[primera, última] que se resuelve con un índice en lugar de LIKE o de un
+recorrido completo. También centraliza la comprobación de IPs locales.
+"""
+import ipaddress
+from typing import Optional, Tuple, Union
+
+IPNetwork = Union[ipaddress.IPv4Network, ipaddress.IPv6Network]
+
+IP_KEY_BYTES = 16
+_IPV4_MAPPED_PREFIX = b'\x00' * 10 + b'\xff\xff'
+
+# Rangos que no salen de la red local (loopback, privados, link-local, multicast)
+LOCAL_NETWORKS = tuple(ipaddress.ip_network(network) for network in (
+    '0.0.0.0/8', '10.0.0.0/8', '127.0.0.0/8', '169.254.0.0/16', '172.16.0.0/12',
+    '192.168.0.0/16', '224.0.0.0/4', '::1/128', 'fc00::/7', 'fe80::/10', 'ff00::/8'
+))
+
+def _address_key(address: Union[ipaddress.IPv4Address, ipaddress.IPv6Address]) -> bytes:
+    if address.version == 4:
+        return _IPV4_MAPPED_PREFIX + address.packed
+    return address.packed
+
+def ip_key(value: Optional[str]) -> Optional[bytes]:
+    """Clave de 16 bytes de una IP, o None si el valor no es una IP"""
+    if not value:
+        return None
+    try:
+        address = ipaddress.ip_address(str(value).strip())
+    except ValueError:
+        return None
+    if address.version == 6 and address.ipv4_mapped:
+        address = address.ipv4_mapped
+    return _address_key(address)
+
+def key_to_ip(key: Optional[bytes]) -> Optional[str]:
+    """Texto de una clave de ip_key()"""
+    if not key:
+        return None
+    key = bytes(key)
+    if key.startswith(_IPV4_MAPPED_PREFIX):
+        return str(ipaddress.IPv4Address(key[12:]))
+    return str(ipaddress.IPv6Address(key))
+
+def parse_network(value: str) -> IPNetwork:
+    """Red de un filtro: una IP suelta es una red /32 (o /128). ValueError si no es válida."""
+    return ipaddress.ip_network(str(value).strip(), strict=False)
+
+def network_range(network: IPNetwork) -> Tuple[bytes, bytes]:
+    """Primera y última clave de una red (ambas incluidas)"""
+    return _address_key(network.network_address), _address_key(network.broadcast_address)
+
+def is_single_address(network: IPNetwork) -> bool:
+    return network.num_addresses == 1
+
+def in_network(value: Optional[str], network: IPNetwork) -> bool:
+    """Comprobar si una IP en texto pertenece a una red"""
+    key = ip_key(value)
+    if key is None:
+        return False
+    low, high = network_range(network)
+    return low <= key <= high
+
+def is_local_ip(value: Optional[str], default: bool = False) -> bool:
+    """IP local o privada; default si el valor no es una IP"""
+    try:
+        address = ipaddress.ip_address(str(value).strip())
+    except ValueError:
+        return default
+    if address.version == 6 and address.ipv4_mapped:
+        address = address.ipv4_mapped
+    return any(address in network for network in LOCAL_NETWORKS)
@@ -8,6 +8,8 @@ import logging
 from datetime import datetime
 from typing import List, Dict, Any, Callable
 
+from modules.time_utils import TIMEZONE
+
 logger = logging.getLogger(__name__)
 
 # Lista de actividades simuladas para pruebas
@@ -33,7 +35,7 @@ def generate_simulated_activity():
     return {
         'id': int(time.time() * 1000) + random.randint(1, 1000),
         'message': f"{random.choice(messages)} from {random.randint(1,254)}.{random.randint(1,254)}.{random.randint(1,254)}.{random.randint(1,254)}",
-        'timestamp': datetime.now().isoformat(),
+        'timestamp': datetime.now(TIMEZONE).isoformat(),
         'source': 'simulator',
         'threat_score': 0.9 if status == 'high' else 0.5 if status == 'medium' else 0.2,
         'status': status,
@@ -11,6 +11,8 @@ from datetime import datetime, timedelta
 from typing import Dict, List, Any
 import psutil
 
+from modules.time_utils import TIMEZONE
+
 logger = logging.getLogger(__name__)
 
 # Configuración de rutas de logs
@@ -93,14 +95,13 @@ def parse_fortigate_log(line: str, timezone=None) -> Dict[str, Any]:
             message = line[:200]
         
         # Obtener timestamp
-        current_time = datetime.now(timezone) if timezone else datetime.now()
+        current_time = datetime.now(timezone or TIMEZONE)
         log_time = current_time
         if 'date' in fields and 'time' in fields:
             try:
                 timestamp_str = f"{fields['date']} {fields['time']}"
                 log_time = datetime.strptime(timestamp_str, "%Y-%m-%d %H:%M:%S")
-                if timezone:
-                    log_time = log_time.replace(tzinfo=timezone)
+                log_time = log_time.replace(tzinfo=timezone or TIMEZONE)
             except Exception as e:
                 logger.warning(f"Error parsing timestamp: {e}")
         
@@ -142,7 +143,7 @@ def parse_log_entry(line: str, timezone=None) -> Dict[str, Any]:
                 return fortigate_result
         
         # Si no es Fortigate o falló el parsing, generar un log genérico simple
-        current_time = datetime.now(timezone) if timezone else datetime.now()
+        current_time = datetime.now(timezone or TIMEZONE)
         
         # Extraer IPs si están presentes
         ip_pattern = r'(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})'
@@ -198,7 +199,7 @@ def process_log_files(timezone=None) -> List[Dict[str, Any]]:
     if not log_files:
         logger.info("No log files found, using minimal system monitoring data")
         # Generar menos actividades y más variadas
-        current_time = datetime.now(timezone) if timezone else datetime.now()
+        current_time = datetime.now(timezone or TIMEZONE)
         
         # Solo 2-3 actividades básicas con diferentes niveles
         activities = [
@@ -0,0 +1,66 @@
+"""
+Columnas de baja cardinalidad codificadas con una tabla de valores.
+source, status, alert_level, service, action y device_type se guardan en
+activities como enteros pequeños (<campo>_id) que apuntan a value_lookups,
+en lugar de repetir el texto en cada fila y en cada entrada de índice.
+El hilo escritor asigna los códigos al insertar; las lecturas decodifican
+y filtran en el propio SQL (value_sql / filter_sql), así cualquier
+conexión ve los mismos valores sin cachés que invalidar.
+"""
+from typing import Dict, Optional, Tuple
+
+LOOKUP_FIELDS = ('source', 'status', 'alert_level', 'service', 'action', 'device_type')
+
+def value_sql(field: str, alias: str = '') -> str:
+    """Expresión SQL con el texto de un campo codificado"""
+    return f"(SELECT value FROM value_lookups WHERE id = {alias}{field}_id)"
+
+def code_sql(field: str, value: Optional[str] = None) -> str:
+    """Expresión SQL con el código de un valor (un literal o el parámetro ?); NULL si no existe"""
+    operand = '?' if value is None else "'" + value.replace("'", "''") + "'"
+    return f"(SELECT id FROM value_lookups WHERE field = '{field}' AND value = {operand})"
+
+def filter_sql(field: str, alias: str = '') -> str:
+    """Condición de igualdad sobre un campo codificado (parámetro ?: el texto)"""
+    return f"{alias}{field}_id = {code_sql(field)}"
+
+def select_sql(column: str, alias: str = '') -> str:
+    """Columna de activities para un SELECT: los campos codificados se decodifican"""
+    if column in LOOKUP_FIELDS:
+        return f"{value_sql(column, alias)} AS {column}"
+    return f"{alias}{column}"
+
+def is_stored_in_column(field: str, value) -> bool:
+    """El campo se guarda solo en su columna codificada (no hace falta en json_data)"""
+    return field in LOOKUP_FIELDS and isinstance(value, str)
+
+def restore(activity: Dict, values) -> Dict:
+    """Devolver a una actividad leída de json_data los campos codificados (en el orden de LOOKUP_FIELDS)"""
+    for field, value in zip(LOOKUP_FIELDS, values):
+        if value is not None:
+            activity.setdefault(field, value)
+    return activity
+
+class LookupEncoder:
+    """Códigos de los valores ya vistos (solo desde el hilo escritor)"""
+
+    def __init__(self):
+        self._codes: Dict[Tuple[str, str], int] = {}
+
+    def reset(self):
+        """Olvidar los códigos (tras un lote fallido sus filas nuevas se deshicieron)"""
+        self._codes.clear()
+
+    def encode(self, cursor, field: str, value) -> Optional[int]:
+        """Código de un valor, creándolo en value_lookups la primera vez"""
+        if value is None:
+            return None
+        key = (field, str(value))
+        code = self._codes.get(key)
+        if code is None:
+            cursor.execute("INSERT OR IGNORE INTO value_lookups (field, value) VALUES (?, ?)", key)
+            code = cursor.execute(
+                "SELECT id FROM value_lookups WHERE field = ? AND value = ?", key
+            ).fetchone()[0]
+            self._codes[key] = code
+        return code
@@ -0,0 +1,219 @@
+"""
+Compresión del texto de los mensajes con un diccionario zlib entrenado.
+Los mensajes de un mismo origen se repiten mucho ("accept from X to Y
+(HTTPS)"), así que un diccionario preestablecido construido con nuestro
+propio corpus deja cada mensaje en unos pocos bytes. Los diccionarios se
+guardan versionados en la tabla message_dictionaries y cada valor
+comprimido lleva la versión con la que se codificó. Los mensajes cortos o
+que no ganan nada se guardan como TEXT, así que las filas antiguas siguen
+siendo válidas sin migrar.
+"""
+import re
+import time
+import zlib
+import logging
+import sqlite3
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Iterable, Union
+
+logger = logging.getLogger(__name__)
+
+DICTIONARY_SIZE = 8 * 1024     # zlib admite hasta 32 KB; más no mejora mensajes cortos
+CODEC_MIN_LENGTH = 16          # Mensajes más cortos se guardan como texto
+TRAINING_SAMPLE = 20000        # Mensajes recientes usados para entrenar
+TRAINING_MIN_MESSAGES = 200    # Mínimo de mensajes para entrenar un diccionario
+MAX_NGRAM_TOKENS = 6
+MAX_VERSION = 255              # La versión ocupa un byte en cada valor
+
+# Palabras, números y separadores como tokens (los separadores forman parte de los n-gramas)
+_TOKEN_RE = re.compile(r'\w+|[^\w]')
+
+def train_dictionary(messages: Iterable[str], size: int = DICTIONARY_SIZE) -> bytes:
+    """
+    Construir un diccionario a partir de los n-gramas de tokens más rentables
+    (frecuencia × longitud). Los más rentables van al final: deflate codifica
+    con menos bits las distancias cortas.
+    """
+    counts: Counter = Counter()
+    for message in messages:
+        tokens = _TOKEN_RE.findall(message)
+        # Un mismo n-grama cuenta una vez por mensaje
+        grams = set()
+        for n in range(1, MAX_NGRAM_TOKENS + 1):
+            for i in range(len(tokens) - n + 1):
+                grams.add(''.join(tokens[i:i + n]))
+        counts.update(gram for gram in grams if len(gram) > 2)
+
+    chosen: List[str] = []
+    chosen_text = ''
+    used = 0
+    for gram, count in sorted(counts.items(), key=lambda item: item[1] * len(item[0]), reverse=True):
+        if count < 2:
+            break
+        if gram in chosen_text:
+            continue
+        if used + len(gram) > size:
+            continue
+        chosen.append(gram)
+        chosen_text += '\0' + gram
+        used += len(gram.encode('utf-8'))
+
+    return ''.join(reversed(chosen)).encode('utf-8')[-size:]
+
+class MessageCodec:
+    """Codificador de mensajes con diccionarios versionados"""
+
+    def __init__(self):
+        self.version: Optional[int] = None
+        self._dictionaries: Dict[int, bytes] = {}
+        # Objetos zlib ya inicializados con el diccionario: copy() evita re-procesarlo
+        self._compressor = None
+        self._decompressors: Dict[int, object] = {}
+        self._lock = threading.Lock()
+        self.metrics = {'encoded': 0, 'encoded_bytes_in': 0, 'encoded_bytes_out': 0, 'decoded': 0}
+
+    def register(self, conn: sqlite3.Connection):
+        """Registrar message_text() en una conexión (lo usa el trigger de borrado del FTS)"""
+        conn.create_function('message_text', 1, self.decode, deterministic=True)
+
+    def load(self, conn: sqlite3.Connection):
+        """Cargar todas las versiones guardadas y activar la más reciente"""
+        rows = conn.execute("SELECT version, dictionary FROM message_dictionaries ORDER BY version").fetchall()
+        with self._lock:
+            for version, dictionary in rows:
+                self._dictionaries[version] = bytes(dictionary)
+            if rows:
+                self._activate(rows[-1][0])
+
+    def _activate(self, version: int):
+        dictionary = self._dictionaries[version]
+        self._compressor = zlib.compressobj(9, zlib.DEFLATED, -15, 9, zlib.Z_DEFAULT_STRATEGY, dictionary)
+        self.version = version
+
+    def _decompressor(self, version: int):
+        decompressor = self._decompressors.get(version)
+        if decompressor is None:
+            dictionary = self._dictionaries.get(version)
+            if dictionary is None:
+                return None
+            decompressor = self._decompressors[version] = zlib.decompressobj(-15, dictionary)
+        return decompressor
+
+    def encode(self, text: str) -> Union[str, bytes]:
+        """Comprimir un mensaje; devuelve el texto tal cual si no compensa"""
+        compressor = self._compressor
+        if compressor is None or len(text) < CODEC_MIN_LENGTH:
+            return text
+
+        raw = text.encode('utf-8')
+        worker = compressor.copy()
+        packed = bytes((self.version,)) + worker.compress(raw) + worker.flush()
+        if len(packed) >= len(raw):
+            return text
+
+        self.metrics['encoded'] += 1
+        self.metrics['encoded_bytes_in'] += len(raw)
+        self.metrics['encoded_bytes_out'] += len(packed)
+        return packed
+
+    def decode(self, value: Union[str, bytes, None]) -> Optional[str]:
+        """Texto de un mensaje guardado (TEXT sin comprimir o BLOB comprimido)"""
+        if not isinstance(value, (bytes, memoryview)):
+            return value
+        value = bytes(value)
+        decompressor = self._decompressor(value[0])
+        if decompressor is None:
+            logger.warning(f"Unknown message dictionary version {value[0]}")
+            return ''
+        self.metrics['decoded'] += 1
+        return decompressor.copy().decompress(value[1:]).decode('utf-8', errors='replace')
+
+    def ratio(self, messages: List[str], dictionary: bytes) -> float:
+        """Relación de compresión (bytes originales / guardados) de una muestra"""
+        compressor = zlib.compressobj(9, zlib.DEFLATED, -15, 9, zlib.Z_DEFAULT_STRATEGY, dictionary)
+        original = stored = 0
+        for message in messages:
+            raw = message.encode('utf-8')
+            original += len(raw)
+            if len(message) < CODEC_MIN_LENGTH:
+                stored += len(raw)
+                continue
+            worker = compressor.copy()
+            stored += min(len(raw), 1 + len(worker.compress(raw) + worker.flush()))
+        return round(original / stored, 2) if stored else 1.0
+
+    def build(self, conn: sqlite3.Connection, sample_size: int = TRAINING_SAMPLE) -> Optional[Dict[str, object]]:
+        """
+        Entrenar un diccionario con los mensajes más recientes, sin escribir
+        nada (basta una conexión de lectura; es la parte lenta y no debe
+        ejecutarse con la transacción de escritura abierta).
+        Devuelve {'dictionary', 'sample_size', 'ratio'}, o None si no hay
+        mensajes suficientes.
+        """
+        if (self.version or 0) >= MAX_VERSION:
+            logger.warning("Message dictionary version limit reached, keeping current dictionary")
+            return None
+
+        rows = conn.execute(
+            "SELECT message FROM activities ORDER BY id DESC LIMIT ?", (sample_size,)
+        ).fetchall()
+        messages = [self.decode(message) for (message,) in rows if message]
+        if len(messages) < TRAINING_MIN_MESSAGES:
+            return None
+
+        # La mitad entrena y la otra mitad mide (sin sobreajustar a la muestra)
+        dictionary = train_dictionary(messages[1::2])
+        return {'dictionary': dictionary, 'sample_size': len(messages), 'ratio': self.ratio(messages[::2], dictionary)}
+
+    def store(self, conn, trained: Dict[str, object]) -> Optional[int]:
+        """
+        Guardar un diccionario de build() como versión nueva, dentro de la
+        transacción de quien llama. No lo activa: hay que llamar a activate()
+        después del commit, o las filas nuevas usarían una versión que no
+        existe en disco si la transacción se deshace.
+        Devuelve la versión, o None si se alcanzó MAX_VERSION.
+        """
+        with self._lock:
+            version = max(self._dictionaries, default=0) + 1
+        if version > MAX_VERSION:
+            logger.warning("Message dictionary version limit reached, keeping current dictionary")
+            return None
+        conn.execute(
+            "INSERT INTO message_dictionaries (version, dictionary, sample_size, ratio, created_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (version, trained['dictionary'], trained['sample_size'], trained['ratio'], int(time.time() * 1000))
+        )
+        return version
+
+    def activate(self, version: int, trained: Dict[str, object]):
+        """Usar una versión ya confirmada en disco para los mensajes nuevos"""
+        with self._lock:
+            self._dictionaries[version] = trained['dictionary']
+            self._activate(version)
+        logger.info(f"Trained message dictionary v{version} "
+                    f"({len(trained['dictionary'])} bytes, {trained['ratio']}x on sample)")
+
+    def train(self, conn: sqlite3.Connection, sample_size: int = TRAINING_SAMPLE) -> Optional[int]:
+        """
+        Entrenar, guardar y confirmar una versión nueva en una conexión propia
+        (migraciones). Las filas ya guardadas conservan su versión.
+        Devuelve la versión nueva, o None si no hay mensajes suficientes.
+        """
+        trained = self.build(conn, sample_size)
+        if trained is None:
+            return None
+        version = self.store(conn, trained)
+        if version is None:
+            return None
+        conn.commit()
+        self.activate(version, trained)
+        return version
+
+    def get_metrics(self) -> Dict[str, object]:
+        """Versión activa y relación de compresión de lo codificado desde el arranque"""
+        metrics = dict(self.metrics)
+        metrics['version'] = self.version
+        metrics['ratio'] = round(metrics['encoded_bytes_in'] / metrics['encoded_bytes_out'], 2) \
+            if metrics['encoded_bytes_out'] else None
+        return metrics
@@ -10,6 +10,9 @@ from collections import defaultdict, deque
 from datetime import datetime, timedelta
 from typing import Dict, List, Any
 
+from modules.time_utils import TIMEZONE
+from modules.ip_utils import is_local_ip
+
 logger = logging.getLogger(__name__)
 
 # Contadores globales para detección de ataques
@@ -116,37 +119,9 @@ class NetworkAttackDetector:
             logger.debug(f"Error checking connections: {e}")
 
     def _is_local_ip(self, ip: str) -> bool:
-        """Verificar si una IP es local/privada MEJORADO"""
-        try:
-            # Lista completa de rangos privados/locales
-            local_ranges = [
-                '127.',      # Loopback
-                '10.',       # Clase A privada
-                '172.16.',   # Clase B privada (inicio)
-                '172.17.',   # Docker
-                '172.18.',   # Docker
-                '172.19.',   # Docker
-                '172.20.',   # Clase B privada
-                '172.21.',   # Clase B privada
-                '172.22.',   # Clase B privada
-                '172.23.',   # Clase B privada
-                '172.24.',   # Clase B privada
-                '172.25.',   # Clase B privada
-                '172.26.',   # Clase B privada
-                '172.27.',   # Clase B privada
-                '172.28.',   # Clase B privada
-                '172.29.',   # Clase B privada
-                '172.30.',   # Clase B privada
-                '172.31.',   # Clase B privada (final)
-                '192.168.',  # Clase C privada
-                '169.254.',  # Link-local
-                '224.',      # Multicast
-                '0.',        # Red local
-            ]
-            
-            return any(ip.startswith(prefix) for prefix in local_ranges)
-        except:
-            return True  # Si hay error, asumir que es local por seguridad
+        """Verificar si una IP es local/privada (rangos de ip_utils.LOCAL_NETWORKS)"""
+        # Si no es una IP válida, asumir que es local por seguridad
+        return is_local_ip(ip, default=True)
 
     def _is_suspicious_pattern(self, ip: str, recent_connections: list) -> bool:
         """Determinar si el patrón de conexiones es sospechoso"""
@@ -356,7 +331,7 @@ class NetworkAttackDetector:
         alert = {
             'id': int(time.time() * 1000000),  # Microsegundos para evitar duplicados
             'message': message,
-            'timestamp': datetime.now().isoformat(),
+            'timestamp': datetime.now(TIMEZONE).isoformat(),
             'source': 'network_detector',
             'threat_score': threat_score,
             'status': status,
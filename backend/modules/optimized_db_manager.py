@@ -1,6 +1,10 @@
 """
-Módulo optimizado para gestión de base de datos en Raspberry Pi.
-Diseñado para minimizar el uso de recursos y evitar bloqueos.
+Motor único de almacenamiento para Raspberry Pi.
+Un solo hilo escritor con su propia conexión procesa operaciones en lote
+y un pool de conexiones de solo lectura atiende las consultas, de forma
+que las escrituras nunca compiten entre sí por el lock de SQLite.
+Las actividades entran por un spool en disco (modules.spool), así que las
+ráfagas no se descartan y lo pendiente se reproduce al arrancar.
 """
 import os
 import sqlite3
@@ -8,101 +12,297 @@ import logging
 import time
 import threading
 import random
-from datetime import datetime, timedelta
 from typing import Dict, List, Any, Optional, Tuple
 from contextlib import contextmanager
-from queue import Queue, Empty
+from queue import Queue, Empty, Full
+from collections import deque
 import json
 
+from modules import schema, rollups, search, ip_utils, lookups, backup
+from modules.spool import WriteSpool, SpoolFull
+from modules.message_codec import MessageCodec, TRAINING_SAMPLE
+from modules.query_pool import ReaderPool, QUERY_PROGRESS_STEPS, current_query
+from modules.query_stats import QueryStats, TimedConnection, current_timing, timed_query
+
+from modules.time_utils import now_iso, to_epoch_ms, now_epoch_ms, days_ago_epoch_ms, epoch_ms_to_date, local_date_days_ago
+
 logger = logging.getLogger(__name__)
 
 # Configuración optimizada para Raspberry Pi
-DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'shield.db')
-os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+# SHIELD_DB_PATH permite varias instancias en una máquina (p. ej. sensores de prueba)
+DB_PATH = os.environ.get('SHIELD_DB_PATH') or os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'shield.db')
 
 # Configuración de límites para evitar sobrecarga
-MAX_BATCH_SIZE = 50
 MAX_QUEUE_SIZE = 200
 DB_TIMEOUT = 10  # segundos
 VACUUM_INTERVAL = 3600  # 1 hora
+MAX_MESSAGE_LENGTH = 500
+
+# Tamaño de lote adaptativo (operaciones por transacción): crece con carga
+# mientras el commit cumple el objetivo y se reduce si lo supera o en reposo
+INITIAL_BATCH_SIZE = 50
+MIN_BATCH_SIZE = 8
+MAX_BATCH_SIZE = 512
+TARGET_COMMIT_SECONDS = 0.05   # Latencia objetivo de la transacción de un lote
+BATCH_LINGER_SECONDS = 0.02    # Espera a más operaciones antes de confirmar un lote incompleto
+MAX_BATCH_DELAY = 1.0          # Espera máxima de la primera operación de un lote
+THROUGHPUT_WINDOW = 10.0       # Ventana en segundos de filas/s
+
+# Configuración del motor de retención (borrado por bloques sin picos de latencia)
+RETENTION_CHUNK_SIZE = 500         # Rango inicial de rowids por bloque
+RETENTION_MIN_CHUNK_SIZE = 50
+RETENTION_MAX_CHUNK_SIZE = 5000
+RETENTION_CHUNK_BUDGET = 0.05      # Segundos máximos por bloque de borrado
+RETENTION_STATS_DAYS = 365         # Días de daily_stats a conservar
+RETENTION_VACUUM_PAGES = 1000      # Páginas liberadas por paso de incremental_vacuum
+AUTO_VACUUM_CONVERT_MAX_BYTES = 64 * 1024 * 1024  # VACUUM único solo en archivos pequeños
+
+# Planificador de checkpoints del WAL (el autocheckpoint de SQLite se desactiva)
+WAL_PASSIVE_BYTES = 4 * 1024 * 1024      # A partir de aquí checkpoint PASSIVE
+WAL_TRUNCATE_BYTES = 16 * 1024 * 1024    # Con lectores inactivos, TRUNCATE
+WAL_HARD_LIMIT_BYTES = 64 * 1024 * 1024  # TRUNCATE aunque haya lectores
+CHECKPOINT_INTERVAL = 60                 # Segundos máximos entre checkpoints con WAL pendiente
+READER_IDLE_SECONDS = 0.5                # Lectores "inactivos" tras este tiempo sin lecturas
+CHECKPOINT_BUSY_TIMEOUT_MS = 250         # Espera máxima de TRUNCATE a los lectores
+
+# Almacenamiento en frío: lo que sale de la ventana caliente pasa a segmentos columnares
+COLD_RETENTION_DAYS = 365    # Días de historial que se conservan en frío
+COLD_SEGMENT_ROWS = 5000     # Filas máximas por segmento (una transacción de tiering)
+
+# Copias de seguridad en caliente (modules.backup)
+BACKUP_INTERVAL = 24 * 3600   # Segundos entre copias programadas
 
-# Cola para operaciones de escritura asíncronas
-write_queue = Queue(maxsize=MAX_QUEUE_SIZE)
+# Compresión de mensajes con diccionario entrenado
+MESSAGE_TRAIN_ROWS = 5000   # Filas insertadas sin diccionario antes de entrenar el primero
+
+# Spool de escritura en disco
+SPOOL_NAME = 'activities'   # Fila de spool_state con la posición confirmada
+SPOOL_MAX_RETRIES = 3       # Lotes del spool que fallan más veces se descartan
+SPOOL_SIGNAL = {'type': 'spool'}  # Aviso al hilo escritor: hay registros nuevos
+
+# Exportación en streaming: filas por lectura (cada bloque es una transacción corta)
+EXPORT_CHUNK_ROWS = 1000
+EXPORT_COLUMNS = "id, ts_epoch_ms, json_data, activity_id, timestamp, message_text(message), " + ', '.join(
+    lookups.select_sql(column) for column in ('source', 'status', 'alert_level', 'threat_score', 'src_ip',
+                                              'dst_ip', 'service', 'action', 'device_name', 'device_type')
+)
+
+# Replicación hacia un nodo agregador (modules.federation)
+FEDERATION_MAX_ROWS = 5000   # Filas máximas por página de cambios
+
+# Campos codificados decodificados en los SELECT y conteos por estado sobre los
+# códigos enteros (el código de cada estado se resuelve una vez por consulta)
+ACTIVITY_LOOKUP_COLUMNS = ', '.join(lookups.select_sql(field) for field in lookups.LOOKUP_FIELDS)
+STATUS_SUMS = ', '.join(
+    f"SUM(CASE WHEN status_id = {lookups.code_sql('status', status)} THEN 1 ELSE 0 END)"
+    for status in ('high', 'medium', 'low')
+)
+
+# Pool de hilos lectores para consultas con futuros (submit_query)
+QUERY_TIMEOUT = 10.0        # Plazo por defecto de una consulta, incluida la espera en cola
+SLOW_QUERY_MS = float(os.environ.get('SHIELD_SLOW_QUERY_MS', 250))  # Umbral del registro de consultas lentas
+MAX_PENDING_QUERIES = 32    # Consultas en cola antes de rechazar con QueryRejected
+
+# Lock del pool de conexiones de lectura
 db_lock = threading.RLock()
 
+def _open_cold_store(path: str):
+    """
+    Almacén en frío del motor. cold_storage se importa aquí y no al cargar el
+    módulo porque NumPy es la mayor parte del tiempo de importación.
+    """
+    try:
+        from modules import cold_storage
+    except ImportError:
+        # Sin NumPy no hay almacenamiento en frío: la retención borra como antes
+        return None
+    return cold_storage.ColdStore(path)
+
 class OptimizedDBManager:
-    """Gestor de base de datos optimizado para Raspberry Pi"""
-    
-    def __init__(self):
+    """Motor de almacenamiento: un escritor dedicado y lectores de solo lectura"""
+
+    def __init__(self, db_path: str = DB_PATH):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
         self.connection_pool = []
         self.pool_size = 3  # Reducido para Raspberry Pi
+        self.write_queue = Queue(maxsize=MAX_QUEUE_SIZE)
+        self.reader_pool = ReaderPool(self.pool_size, MAX_PENDING_QUERIES)
+        self.query_stats = QueryStats(SLOW_QUERY_MS, explain=self._explain_statements)
         self.last_vacuum = 0
+        self.last_retention_report = {}
         self.writer_thread = None
         self.shutdown_flag = threading.Event()
+        self._write_conn = None
+        self.write_generation = 0
+        # Conexión de lectura propia para PRAGMA data_version (es por conexión)
+        self._version_conn = None
+        self._version_lock = threading.Lock()
+        self._data_version = None
+        self._external_generation = 0
+        self.spool = WriteSpool(f"{db_path}-spool")
+        self.cold_store = _open_cold_store(f"{db_path}-cold")
+        self.backup_dir = f"{db_path}-backups"
+        self._backup_lock = threading.Lock()
+        self.backup_metrics = {'count': 0, 'failures': 0, 'running': False, 'last': None, 'last_error': None}
+        self._cold_end_ms = None
+        self._spool_signal = threading.Event()
+        self._spool_failures = 0
+        self.message_codec = MessageCodec()
+        self.heavy_hitters = rollups.HeavyHitters()
+        self.lookups = lookups.LookupEncoder()
+        self._untrained_rows = 0
+        self._training = threading.Lock()  # Tomado mientras se entrena un diccionario
+        self.batch_size = INITIAL_BATCH_SIZE
+        self._committed_rows = deque()  # (instante, filas) de los lotes recientes
+        self.writer_metrics = {
+            'batches': 0,
+            'rows': 0,
+            'last_batch_operations': 0,
+            'last_batch_rows': 0,
+            'last_commit_ms': 0.0,
+            'avg_commit_ms': 0.0,
+            'resizes': {'grow': 0, 'shrink': 0}
+        }
+        self._active_readers = 0
+        self._last_read_end = 0.0
+        self._last_checkpoint = time.time()
+        self.checkpoint_metrics = {
+            'count': {'PASSIVE': 0, 'TRUNCATE': 0},
+            'total_seconds': 0.0,
+            'last': None
+        }
         self._init_connection_pool()
         self._start_writer_thread()
-    
+
     def _init_connection_pool(self):
-        """Inicializar pool de conexiones limitado"""
+        """Inicializar pool de conexiones de lectura limitado"""
         try:
             for _ in range(self.pool_size):
-                conn = self._create_optimized_connection()
+                conn = self._create_read_connection()
                 self.connection_pool.append(conn)
             logger.info(f"Database connection pool initialized with {self.pool_size} connections")
         except Exception as e:
-            logger.error(f"Failed to initialize connection pool: {e}")
-    
+            # La BD aún no existe: las conexiones se crean al primer uso
+            logger.debug(f"Read pool deferred until first use: {e}")
+
     def _create_optimized_connection(self):
-        """Crear conexión optimizada para Raspberry Pi"""
+        """Crear la conexión de escritura optimizada para Raspberry Pi"""
         conn = sqlite3.connect(
-            DB_PATH,
+            self.db_path,
             timeout=DB_TIMEOUT,
             check_same_thread=False
         )
-        
+
         # Optimizaciones críticas para Raspberry Pi
+        # (page_size y auto_vacuum deben fijarse antes de activar WAL)
+        conn.execute("PRAGMA page_size = 4096")
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
         conn.execute("PRAGMA synchronous = NORMAL")
         conn.execute("PRAGMA journal_mode = WAL")
         conn.execute("PRAGMA temp_store = MEMORY")
         conn.execute("PRAGMA cache_size = -1000")  # 1MB cache
         conn.execute("PRAGMA mmap_size = 10000000")  # 10MB mmap
-        conn.execute("PRAGMA page_size = 4096")
-        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
-        
+        # Los checkpoints los decide el planificador del hilo escritor
+        conn.execute("PRAGMA wal_autocheckpoint = 0")
+        conn.execute(f"PRAGMA journal_size_limit = {WAL_TRUNCATE_BYTES}")
+        # message_text() la usa el trigger de borrado del índice de texto
+        self.message_codec.register(conn)
+
         return conn
-    
+
+    def _create_read_connection(self):
+        """Crear conexión de solo lectura (las escrituras pasan por el hilo escritor)"""
+        conn = sqlite3.connect(
+            f"file:{self.db_path}?mode=ro",
+            uri=True,
+            timeout=DB_TIMEOUT,
+            check_same_thread=False
+        )
+        conn.execute("PRAGMA query_only = 1")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        conn.execute("PRAGMA cache_size = -1000")
+        conn.execute("PRAGMA mmap_size = 10000000")
+        self.message_codec.register(conn)
+        return conn
+
     @contextmanager
-    def get_connection(self, readonly=True):
-        """Context manager para obtener conexión del pool"""
+    def get_connection(self):
+        """
+        Context manager para obtener una conexión de lectura del pool.
+        La transacción de lectura da una instantánea coherente (conteo + página)
+        y se registra como lector activo para el planificador de checkpoints.
+        Dentro del pool de lectores la conexión comprueba el plazo y la
+        cancelación de la consulta en curso. Dentro de una consulta etiquetada
+        (@timed_query) se mide la espera por la conexión y cada sentencia.
+        """
         conn = None
+        query = current_query()
+        timing = current_timing()
+        started = time.perf_counter()
         try:
             with db_lock:
                 if self.connection_pool:
                     conn = self.connection_pool.pop()
-                else:
-                    conn = self._create_optimized_connection()
-            
-            if readonly:
-                conn.execute("BEGIN DEFERRED")
+                self._active_readers += 1
+            if conn is None:
+                conn = self._create_read_connection()
+            if query is not None:
+                conn.set_progress_handler(query.progress, QUERY_PROGRESS_STEPS)
+
+            conn.execute("BEGIN DEFERRED")
+            if timing is not None:
+                timing.lock_wait += time.perf_counter() - started
+                yield TimedConnection(conn, timing)
             else:
-                conn.execute("BEGIN IMMEDIATE")
-                
-            yield conn
+                yield conn
             conn.commit()
-            
+
         except Exception as e:
             if conn:
                 conn.rollback()
-            logger.error(f"Database operation failed: {e}")
+            if query is not None and query.interrupted:
+                # Plazo vencido o cancelación: lo notifica el futuro de la consulta
+                logger.debug(f"Query interrupted: {e}")
+            else:
+                logger.error(f"Database operation failed: {e}")
             raise
         finally:
-            if conn:
-                with db_lock:
+            released = time.perf_counter()
+            with db_lock:
+                if timing is not None:
+                    timing.lock_wait += time.perf_counter() - released
+                self._active_readers -= 1
+                self._last_read_end = time.time()
+                if conn:
+                    if query is not None:
+                        conn.set_progress_handler(None, 0)
                     if len(self.connection_pool) < self.pool_size:
                         self.connection_pool.append(conn)
                     else:
                         conn.close()
-    
+
+    @contextmanager
+    def _write_transaction(self):
+        """
+        Transacción sobre la conexión de escritura (solo desde el hilo escritor).
+        Cada commit que modifica filas incrementa write_generation.
+        """
+        if self._write_conn is None:
+            self._write_conn = self._create_optimized_connection()
+        conn = self._write_conn
+        changes = conn.total_changes
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.commit()
+            # Después del commit: quien lea la generación nueva ve ya los datos
+            if conn.total_changes != changes:
+                self.write_generation += 1
+        except Exception:
+            conn.rollback()
+            raise
+
     def _start_writer_thread(self):
         """Iniciar hilo de escritura asíncrona"""
         if self.writer_thread is None or not self.writer_thread.is_alive():
@@ -113,98 +313,393 @@ class OptimizedDBManager:
             )
             self.writer_thread.start()
             logger.info("Database writer thread started")
-    
+
     def _process_write_queue(self):
-        """Procesar cola de escritura en lotes"""
+        """
+        Procesar cola de escritura en lotes.
+        Un lote se confirma al llegar a batch_size, cuando alguien espera su
+        commit, tras BATCH_LINGER_SECONDS sin operaciones nuevas o tras
+        MAX_BATCH_DELAY desde la primera: un goteo constante se agrupa en
+        lugar de hacer una transacción por operación.
+        """
         batch = []
-        last_flush = time.time()
-        
+        batch_started = 0.0
+
         while not self.shutdown_flag.is_set():
             try:
                 # Obtener elementos de la cola
-                timeout = 1.0 if batch else 5.0
-                item = write_queue.get(timeout=timeout)
-                batch.append(item)
-                
-                # Procesar lote si está lleno o ha pasado tiempo
+                timeout = BATCH_LINGER_SECONDS if batch else 5.0
+                item = self._next_write_item(timeout)
+                if item is None:
+                    # Señal de parada
+                    continue
+                if not batch:
+                    batch_started = time.time()
+                if item is not SPOOL_SIGNAL:
+                    batch.append(item)
+                batch.extend(self._read_spool(self.batch_size - len(batch)))
+
                 should_flush = (
-                    len(batch) >= MAX_BATCH_SIZE or
-                    time.time() - last_flush > 5.0 or
-                    write_queue.empty()
+                    len(batch) >= self.batch_size or
+                    item.get('done') is not None or
+                    time.time() - batch_started > MAX_BATCH_DELAY
                 )
-                
+
                 if should_flush and batch:
                     self._flush_batch(batch)
                     batch.clear()
-                    last_flush = time.time()
-                    
+
                     # Vacuum periódico
                     if time.time() - self.last_vacuum > VACUUM_INTERVAL:
                         self._incremental_vacuum()
-                
+
+                    self._maybe_checkpoint()
+
             except Empty:
                 if batch:
                     self._flush_batch(batch)
                     batch.clear()
-                    last_flush = time.time()
+                self._maybe_checkpoint()
             except Exception as e:
                 logger.error(f"Error in write queue processor: {e}")
                 batch.clear()
-    
+
+        if batch:
+            self._flush_batch(batch)
+
+    def _next_write_item(self, timeout: float):
+        """Siguiente operación de la cola; sin esperar si el spool tiene registros sin leer"""
+        if self.spool.has_unread():
+            try:
+                return self.write_queue.get_nowait()
+            except Empty:
+                return SPOOL_SIGNAL
+        return self.write_queue.get(timeout=timeout)
+
+    def _read_spool(self, limit: int) -> List[Dict]:
+        """Convertir registros del spool en operaciones de inserción"""
+        if limit <= 0 or not self.spool.is_open:
+            return []
+        self._spool_signal.clear()
+        # fsync agrupado de lo añadido desde el último lote
+        self.spool.sync()
+        return [
+            {'type': 'insert_activity', 'data': activities, 'timestamp': appended_ms / 1000,
+             'spool_position': position}
+            for position, appended_ms, activities in self.spool.read(limit)
+        ]
+
+    def _notify_spool(self):
+        """Despertar al hilo escritor si no tiene ya un aviso pendiente"""
+        if self._spool_signal.is_set():
+            return
+        self._spool_signal.set()
+        try:
+            self.write_queue.put_nowait(SPOOL_SIGNAL)
+        except Full:
+            # La cola está llena: el escritor está activo y lee el spool en cada vuelta
+            pass
+
+    def _save_spool_position(self, cursor, position: Tuple[int, int]):
+        """Guardar la posición confirmada del spool dentro de la transacción del lote"""
+        cursor.execute("""
+        INSERT INTO spool_state (name, segment, byte_offset) VALUES (?, ?, ?)
+        ON CONFLICT(name) DO UPDATE SET segment = excluded.segment, byte_offset = excluded.byte_offset
+        """, (SPOOL_NAME, position[0], position[1]))
+
+    def _save_federation_cursor(self, cursor, state: Dict[str, Any]):
+        """Avanzar el cursor de un sensor remoto dentro de la transacción de sus filas"""
+        cursor.execute("""
+        INSERT INTO federation_cursors (sensor, last_id, last_ts_epoch_ms, rows_merged, updated_at)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(sensor) DO UPDATE SET
+            last_id = excluded.last_id,
+            last_ts_epoch_ms = COALESCE(excluded.last_ts_epoch_ms, last_ts_epoch_ms),
+            rows_merged = rows_merged + excluded.rows_merged,
+            updated_at = excluded.updated_at
+        """, (state['sensor'], state['last_id'], state.get('last_ts_epoch_ms'), state.get('rows', 0), now_iso()))
+
+    def _spool_batch_failed(self, position: Tuple[int, int], records: int):
+        """Reintentar los registros del spool o descartarlos tras varios fallos seguidos"""
+        self._spool_failures += 1
+        if self._spool_failures < SPOOL_MAX_RETRIES:
+            self.spool.rewind()
+            return
+
+        logger.error(f"Discarding {records} spooled activity batches after {self._spool_failures} failed attempts")
+        try:
+            with self._write_transaction() as conn:
+                self._save_spool_position(conn.cursor(), position)
+            self.spool.commit(position)
+            self.spool.metrics['discarded'] += records
+        except Exception as e:
+            logger.error(f"Failed to skip spooled records: {e}")
+            self.spool.rewind()
+        self._spool_failures = 0
+
+    def open_spool(self, conn: sqlite3.Connection):
+        """Abrir el spool desde la posición confirmada y reproducir lo pendiente"""
+        row = conn.execute(
+            "SELECT segment, byte_offset FROM spool_state WHERE name = ?", (SPOOL_NAME,)
+        ).fetchone()
+        try:
+            self.spool.open(tuple(row) if row else (0, 0))
+        except OSError as e:
+            logger.error(f"Could not open write spool, using in-memory queue: {e}")
+            return
+        self._notify_spool()
+
     def _flush_batch(self, batch: List[Dict]):
         """Procesar lote de escrituras"""
         if not batch:
             return
-            
-        try:
-            with self.get_connection(readonly=False) as conn:
-                cursor = conn.cursor()
-                
-                for operation in batch:
-                    op_type = operation.get('type')
-                    
-                    if op_type == 'insert_activity':
-                        self._insert_activity_batch(cursor, operation['data'])
-                    elif op_type == 'update_stats':
-                        self._update_daily_stats_batch(cursor, operation['data'])
-                        
-                logger.debug(f"Processed batch of {len(batch)} operations")
-                
-        except Exception as e:
-            logger.error(f"Failed to flush batch: {e}")
-    
-    def _insert_activity_batch(self, cursor, activities: List[Dict]):
-        """Insertar actividades en lote"""
+
+        # La limpieza se ejecuta fuera de la transacción del lote
+        cleanup_ops = [op for op in batch if op.get('type') == 'cleanup']
+        write_ops = [op for op in batch if op.get('type') != 'cleanup']
+        spool_positions = [op['spool_position'] for op in write_ops if op.get('spool_position')]
+        spool_position = max(spool_positions) if spool_positions else None
+
+        if write_ops:
+            started = time.perf_counter()
+            try:
+                with self._write_transaction() as conn:
+                    cursor = conn.cursor()
+                    inserted = []
+                    dictionaries = []
+
+                    for operation in write_ops:
+                        op_type = operation.get('type')
+
+                        if op_type == 'insert_activity':
+                            inserted.extend(self._insert_activity_batch(cursor, operation['data']))
+                        elif op_type == 'federation_merge':
+                            # Las filas de un sensor y su cursor se confirman juntos
+                            inserted.extend(self._insert_activity_batch(cursor, operation['data']))
+                            self._save_federation_cursor(cursor, operation['cursor'])
+                        elif op_type == 'update_stats':
+                            self._update_daily_stats_batch(cursor, operation['data'])
+                        elif op_type == 'message_dictionary':
+                            # Entrenado fuera del escritor: aquí solo se guarda
+                            version = self.message_codec.store(cursor, operation['data'])
+                            if version is not None:
+                                dictionaries.append((operation, version))
+
+                    # Tablas derivadas en la misma transacción que las filas nuevas
+                    self._update_derived_tables(cursor, inserted)
+                    if self.message_codec.version is None:
+                        self._untrained_rows += len(inserted)
+
+                    # Las filas y la posición del spool se confirman juntas
+                    if spool_position:
+                        self._save_spool_position(cursor, spool_position)
+
+                    logger.debug(f"Processed batch of {len(write_ops)} operations")
+
+                # Confirmado en disco: ya se puede codificar con la versión nueva
+                for operation, version in dictionaries:
+                    self.message_codec.activate(version, operation['data'])
+                    operation['version'] = version
+
+                if spool_position:
+                    self.spool.commit(spool_position)
+                    self._spool_failures = 0
+
+                self._record_batch(len(write_ops), len(inserted), time.perf_counter() - started)
+
+            except Exception as e:
+                logger.error(f"Failed to flush batch: {e}")
+                # Los resúmenes en memoria incluían el lote deshecho
+                self.heavy_hitters.reset()
+                self.lookups.reset()
+                if spool_position:
+                    self._spool_batch_failed(spool_position, len(spool_positions))
+
+        for operation in cleanup_ops:
+            self._run_retention(operation['data'])
+
+        if self.message_codec.version is None and self._untrained_rows >= MESSAGE_TRAIN_ROWS:
+            self._untrained_rows = 0
+            self.train_message_dictionary()
+
+        # Avisar a quien espera la confirmación de sus operaciones
+        for operation in batch:
+            done = operation.get('done')
+            if done is not None:
+                done.set()
+
+    def _record_batch(self, operations: int, rows: int, seconds: float):
+        """Registrar la latencia de un lote y ajustar el tamaño del siguiente"""
+        now = time.time()
+        metrics = self.writer_metrics
+        metrics['batches'] += 1
+        metrics['rows'] += rows
+        metrics['last_batch_operations'] = operations
+        metrics['last_batch_rows'] = rows
+        metrics['last_commit_ms'] = round(seconds * 1000, 2)
+        # Media móvil exponencial: sigue los cambios sin saltar con un lote aislado
+        metrics['avg_commit_ms'] = round(0.8 * metrics['avg_commit_ms'] + 0.2 * seconds * 1000, 2)
+
+        self._committed_rows.append((now, rows))
+        while self._committed_rows and self._committed_rows[0][0] < now - THROUGHPUT_WINDOW:
+            self._committed_rows.popleft()
+
+        backlog = not self.write_queue.empty() or self.spool.has_unread()
+        if seconds > TARGET_COMMIT_SECONDS and self.batch_size > MIN_BATCH_SIZE:
+            # Reducción proporcional al exceso sobre el objetivo
+            self.batch_size = max(MIN_BATCH_SIZE, int(self.batch_size * TARGET_COMMIT_SECONDS / seconds))
+            metrics['resizes']['shrink'] += 1
+        elif backlog and operations >= self.batch_size and seconds < TARGET_COMMIT_SECONDS / 2:
+            self.batch_size = min(MAX_BATCH_SIZE, self.batch_size * 2)
+            metrics['resizes']['grow'] += 1
+        elif not backlog and operations < self.batch_size // 4 and self.batch_size > INITIAL_BATCH_SIZE:
+            # En reposo se vuelve poco a poco al tamaño inicial
+            self.batch_size = max(INITIAL_BATCH_SIZE, self.batch_size * 3 // 4)
+            metrics['resizes']['shrink'] += 1
+
+    def get_writer_metrics(self) -> Dict[str, Any]:
+        """Tamaño de lote actual, latencia de commit y filas/s de la última ventana"""
+        now = time.time()
+        recent = sum(rows for at, rows in list(self._committed_rows) if at >= now - THROUGHPUT_WINDOW)
+        return {
+            'batch_size': self.batch_size,
+            'target_commit_ms': TARGET_COMMIT_SECONDS * 1000,
+            'rows_per_second': round(recent / THROUGHPUT_WINDOW, 1),
+            **self.writer_metrics,
+            'resizes': dict(self.writer_metrics['resizes'])
+        }
+
+    def _activity_row(self, activity: Dict, created_at: str) -> Tuple:
+        """
+        Normalizar una actividad a la fila de la tabla activities.
+        El mensaje se guarda solo en su columna; json_data lo conserva únicamente
+        si la columna lo recorta (MAX_MESSAGE_LENGTH). Los campos codificados con
+        texto tampoco se repiten en json_data (lookups.restore los devuelve).
+        """
+        timestamp = activity.get('timestamp') or created_at
+        message = activity.get('message') or ''
+        keep_message = len(message) > MAX_MESSAGE_LENGTH
+        stored = {key: value for key, value in activity.items()
+                  if not (key == 'message' and not keep_message) and not lookups.is_stored_in_column(key, value)}
+        return (
+            str(activity.get('id', int(time.time() * 1000))),
+            timestamp,
+            to_epoch_ms(timestamp, default=now_epoch_ms()),
+            message[:MAX_MESSAGE_LENGTH],
+            activity.get('source', 'unknown'),
+            activity.get('status', 'low'),
+            activity.get('alert_level', 'LOW'),
+            activity.get('threat_score', 0.0),
+            activity.get('src_ip'),
+            activity.get('dst_ip'),
+            activity.get('service'),
+            activity.get('action'),
+            activity.get('device_name'),
+            activity.get('device_type'),
+            json.dumps(stored, separators=(',', ':'), default=str),  # JSON compacto
+            created_at,
+            ip_utils.ip_key(activity.get('src_ip')),
+            ip_utils.ip_key(activity.get('dst_ip'))
+        )
+
+    def _insert_activity_batch(self, cursor, activities: List[Dict]) -> List[Tuple[int, Tuple, Dict]]:
+        """Insertar actividades en lote. Devuelve (rowid, fila, actividad) de las filas nuevas."""
         insert_sql = """
         INSERT OR IGNORE INTO activities (
-            activity_id, timestamp, message, source, status, alert_level,
-            threat_score, src_ip, dst_ip, service, action, device_name,
-            device_type, json_data, created_at
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            activity_id, timestamp, ts_epoch_ms, message, source_id, status_id, alert_level_id,
+            threat_score, src_ip, dst_ip, service_id, action_id, device_name,
+            device_type_id, json_data, created_at, src_ip_key, dst_ip_key
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         """
-        
-        data_batch = []
+
+        created_at = now_iso()
+        inserted = []
         for activity in activities:
-            data_batch.append((
-                activity.get('id', ''),
-                activity.get('timestamp', ''),
-                activity.get('message', '')[:500],  # Limitar longitud
-                activity.get('source', ''),
-                activity.get('status', ''),
-                activity.get('alert_level', ''),
-                activity.get('threat_score', 0.0),
-                activity.get('src_ip', ''),
-                activity.get('dst_ip', ''),
-                activity.get('service', ''),
-                activity.get('action', ''),
-                activity.get('device_name', ''),
-                activity.get('device_type', ''),
-                json.dumps(activity, separators=(',', ':'))[:1000],  # JSON compacto
-                datetime.now().isoformat()
-            ))
-        
-        cursor.executemany(insert_sql, data_batch)
-    
+            try:
+                row = self._activity_row(activity, created_at)
+                # La fila en memoria conserva el texto para el índice FTS
+                cursor.execute(insert_sql, self._encode_row(cursor, row))
+
+                # Los duplicados ignorados no cuentan en las tablas derivadas
+                if cursor.rowcount == 1:
+                    inserted.append((cursor.lastrowid, row, activity))
+            except Exception as e:
+                logger.error(f"Error saving individual activity: {e}")
+        return inserted
+
+    def _encode_row(self, cursor, row: Tuple) -> Tuple:
+        """Fila a guardar: mensaje comprimido y códigos de value_lookups"""
+        encode = self.lookups.encode
+        return (
+            *row[:3],
+            self.message_codec.encode(row[3]),
+            encode(cursor, 'source', row[4]),
+            encode(cursor, 'status', row[5]),
+            encode(cursor, 'alert_level', row[6]),
+            row[7], row[8], row[9],
+            encode(cursor, 'service', row[10]),
+            encode(cursor, 'action', row[11]),
+            row[12],
+            encode(cursor, 'device_type', row[13]),
+            *row[14:]
+        )
+
+    def _update_derived_tables(self, cursor, inserted: List[Tuple[int, Tuple, Dict]]):
+        """Actualizar daily_stats, rollups e índice de texto con las filas nuevas del lote"""
+        if not inserted:
+            return
+
+        # Incrementos de daily_stats de todo el lote: {fecha: [high, medium, low, total]}
+        stats_deltas = {}
+        rollup_deltas = {}
+        heavy_hitter_deltas = {}
+        fts_rows = []
+
+        for rowid, row, activity in inserted:
+            delta = stats_deltas.setdefault(epoch_ms_to_date(row[2]), [0, 0, 0, 0])
+            status = row[5]
+            if status == 'high':
+                delta[0] += 1
+            elif status == 'medium':
+                delta[1] += 1
+            else:
+                delta[2] += 1
+            delta[3] += 1
+
+            rollups.add_activity(rollup_deltas, row[2], activity)
+            rollups.add_heavy_hitters(heavy_hitter_deltas, row[2], activity)
+            fts_rows.append(search.fts_row(rowid, row))
+
+        self._apply_daily_stats_deltas(cursor, stats_deltas)
+        rollups.apply_deltas(cursor, rollup_deltas)
+        self.heavy_hitters.apply(cursor, heavy_hitter_deltas)
+        cursor.executemany(f"""
+        INSERT INTO activities_fts(rowid, {', '.join(search.FTS_COLUMNS)})
+        VALUES (?, {', '.join('?' * len(search.FTS_COLUMNS))})
+        """, fts_rows)
+
+    def _apply_daily_stats_deltas(self, cursor, stats_deltas: Dict[str, List[int]]):
+        """Aplicar los incrementos con un UPSERT por día afectado"""
+        if not stats_deltas:
+            return
+
+        cursor.executemany("""
+        INSERT INTO daily_stats (date, high_threats, medium_threats, low_threats, total_logs, json_data)
+        VALUES (?1, ?2, ?3, ?4, ?5, json_object(
+            'date', ?1, 'high_threats', ?2, 'medium_threats', ?3, 'low_threats', ?4, 'total_logs', ?5))
+        ON CONFLICT(date) DO UPDATE SET
+            high_threats = high_threats + excluded.high_threats,
+            medium_threats = medium_threats + excluded.medium_threats,
+            low_threats = low_threats + excluded.low_threats,
+            total_logs = total_logs + excluded.total_logs,
+            json_data = json_object(
+                'date', date,
+                'high_threats', high_threats + excluded.high_threats,
+                'medium_threats', medium_threats + excluded.medium_threats,
+                'low_threats', low_threats + excluded.low_threats,
+                'total_logs', total_logs + excluded.total_logs)
+        """, [(date, *delta) for date, delta in stats_deltas.items()])
+
     def _update_daily_stats_batch(self, cursor, stats_data: List[Dict]):
         """Actualizar estadísticas diarias en lote"""
         for stats in stats_data:
@@ -220,86 +715,604 @@ class OptimizedDBManager:
                 stats.get('total_logs', 0),
                 json.dumps(stats, separators=(',', ':'))
             ))
-    
+
+    def _yield_to_writer(self):
+        """Procesar escrituras pendientes entre bloques de retención"""
+        pending = []
+        while len(pending) < self.batch_size:
+            try:
+                operation = self.write_queue.get_nowait()
+            except Empty:
+                break
+            if operation is None:
+                continue
+            if operation.get('type') == 'cleanup':
+                # Una limpieza ya está en curso, no encadenar otra
+                if operation.get('done') is not None:
+                    operation['done'].set()
+                continue
+            if operation is not SPOOL_SIGNAL:
+                pending.append(operation)
+        pending.extend(self._read_spool(self.batch_size - len(pending)))
+
+        if pending:
+            self._flush_batch(pending)
+        else:
+            # Dejar pasar a los lectores aunque no haya escrituras
+            time.sleep(0.001)
+
+    def _page_stats(self) -> Dict[str, int]:
+        """Obtener estadísticas de páginas del archivo de base de datos"""
+        with self._write_transaction() as conn:
+            page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+            page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+            freelist = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            auto_vacuum = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+        return {
+            'page_size': page_size,
+            'page_count': page_count,
+            'freelist_count': freelist,
+            'auto_vacuum': auto_vacuum
+        }
+
+    def _run_retention(self, options: Dict) -> Dict:
+        """
+        Borrar datos antiguos por bloques ordenados por rowid.
+        Cada bloque es una transacción corta con presupuesto de tiempo; entre
+        bloques se ceden las escrituras pendientes y al final se ejecuta
+        incremental_vacuum para devolver el espacio al sistema de archivos.
+        """
+        started = time.time()
+        cutoff_ms = options['cutoff_epoch_ms']
+        stats_cutoff = options.get('stats_cutoff')
+        report = {
+            'cutoff_epoch_ms': cutoff_ms,
+            'deleted_activities': 0,
+            'deleted_daily_stats': 0,
+            'chunks': 0,
+            'max_chunk_seconds': 0.0,
+            'freed_pages': 0,
+            'reclaimed_bytes': 0,
+            'duration_seconds': 0.0,
+            'completed': False
+        }
+
+        try:
+            before = self._page_stats()
+
+            # Las actividades que salen de la ventana caliente se archivan antes de borrar
+            if self.cold_store is not None and options.get('archive'):
+                self._archive_to_cold(cutoff_ms, report)
+
+            with self._write_transaction() as conn:
+                min_id, max_id = conn.execute(
+                    "SELECT MIN(id), MAX(id) FROM activities WHERE ts_epoch_ms < ?",
+                    (cutoff_ms,)
+                ).fetchone()
+
+            chunk_size = RETENTION_CHUNK_SIZE
+            lower = min_id
+            while min_id is not None and lower <= max_id:
+                if self.shutdown_flag.is_set():
+                    break
+
+                upper = lower + chunk_size
+                chunk_start = time.time()
+                with self._write_transaction() as conn:
+                    cursor = conn.execute(
+                        "DELETE FROM activities WHERE id >= ? AND id < ? AND ts_epoch_ms < ?",
+                        (lower, upper, cutoff_ms)
+                    )
+                    report['deleted_activities'] += max(cursor.rowcount, 0)
+                chunk_elapsed = time.time() - chunk_start
+
+                report['chunks'] += 1
+                report['max_chunk_seconds'] = max(report['max_chunk_seconds'], chunk_elapsed)
+                lower = upper
+
+                # Ajustar tamaño del bloque al presupuesto de tiempo
+                if chunk_elapsed > RETENTION_CHUNK_BUDGET:
+                    chunk_size = max(RETENTION_MIN_CHUNK_SIZE, chunk_size // 2)
+                elif chunk_elapsed < RETENTION_CHUNK_BUDGET / 2:
+                    chunk_size = min(RETENTION_MAX_CHUNK_SIZE, chunk_size * 2)
+
+                self._yield_to_writer()
+
+            if stats_cutoff:
+                with self._write_transaction() as conn:
+                    cursor = conn.execute("DELETE FROM daily_stats WHERE date < ?", (stats_cutoff,))
+                    report['deleted_daily_stats'] = max(cursor.rowcount, 0)
+
+            # Cada granularidad de rollups tiene su propia ventana
+            report['deleted_rollups'] = 0
+            for granularity, keep_days in rollups.ROLLUP_RETENTION_DAYS.items():
+                with self._write_transaction() as conn:
+                    cursor = conn.execute(
+                        "DELETE FROM activity_rollups WHERE granularity = ? AND bucket_ms < ?",
+                        (granularity, days_ago_epoch_ms(keep_days))
+                    )
+                    report['deleted_rollups'] += max(cursor.rowcount, 0)
+                    conn.execute(
+                        "DELETE FROM activity_heavy_hitters WHERE granularity = ? AND bucket_ms < ?",
+                        (granularity, days_ago_epoch_ms(keep_days))
+                    )
+                self._yield_to_writer()
+
+            if self.cold_store is not None and options.get('cold_cutoff_epoch_ms'):
+                self._drop_cold_segments(options['cold_cutoff_epoch_ms'], report)
+
+            # Devolver páginas libres por pasos para no bloquear al escritor
+            if before['auto_vacuum'] == 2:
+                while not self.shutdown_flag.is_set():
+                    freelist = self._page_stats()['freelist_count']
+                    if freelist == 0:
+                        break
+                    with self._write_transaction() as conn:
+                        conn.execute(f"PRAGMA incremental_vacuum({RETENTION_VACUUM_PAGES})")
+                    if self._page_stats()['freelist_count'] >= freelist:
+                        break
+                    self._yield_to_writer()
+                self.last_vacuum = time.time()
+            else:
+                logger.warning("auto_vacuum is not INCREMENTAL; freed pages stay in the file until a full VACUUM")
+
+            after = self._page_stats()
+            report['freed_pages'] = max(before['page_count'] - after['page_count'], 0)
+            report['reclaimed_bytes'] = report['freed_pages'] * after['page_size']
+            report['completed'] = not self.shutdown_flag.is_set()
+
+        except Exception as e:
+            logger.error(f"Retention run failed: {e}")
+            report['error'] = str(e)
+
+        report['duration_seconds'] = round(time.time() - started, 3)
+        report['max_chunk_seconds'] = round(report['max_chunk_seconds'], 4)
+        report['finished_at'] = int(time.time())
+        self.last_retention_report = report
+
+        logger.info(
+            f"Retention archived {report.get('archived_activities', 0)} activities to cold storage, "
+            f"removed {report['deleted_activities']} activities and "
+            f"{report['deleted_daily_stats']} daily stats in {report['chunks']} chunks, "
+            f"reclaimed {report['reclaimed_bytes']} bytes"
+        )
+        return report
+
+    def _archive_to_cold(self, cutoff_ms: int, report: Dict):
+        """
+        Mover a segmentos columnares las actividades anteriores al corte, día a día.
+        Cada segmento (hasta COLD_SEGMENT_ROWS filas de un mismo día local) se
+        escribe en disco y después, en una sola transacción, se borran sus filas
+        y se registra en cold_segments: un lector ve cada fila en caliente o en
+        frío, nunca en los dos sitios.
+        """
+        from modules import cold_storage
+        report.update({'archived_activities': 0, 'cold_segments_written': 0, 'cold_bytes_written': 0})
+        # Los segmentos guardan el texto del mensaje (tienen su propio diccionario)
+        # y el json_data de la fila como columna extra
+        columns = ', '.join(
+            'message_text(message)' if column == 'message'
+            else 'json_data' if column == 'extra'
+            else lookups.select_sql(column)
+            for column in cold_storage.SEGMENT_COLUMNS
+        )
+
+        while not self.shutdown_flag.is_set():
+            with self._write_transaction() as conn:
+                first_ms = conn.execute(
+                    "SELECT MIN(ts_epoch_ms) FROM activities WHERE ts_epoch_ms < ?", (cutoff_ms,)
+                ).fetchone()[0]
+                if first_ms is None:
+                    break
+
+                day_start = rollups.bucket_start(first_ms, 'day')
+                # Siguiente medianoche local (36 h cubre los cambios de horario)
+                day_end = min(rollups.bucket_start(day_start + 36 * 3600 * 1000, 'day'), cutoff_ms)
+                rows = conn.execute(f"""
+                SELECT id, {columns} FROM activities
+                WHERE ts_epoch_ms >= ? AND ts_epoch_ms < ?
+                ORDER BY ts_epoch_ms
+                LIMIT ?
+                """, (first_ms, day_end, COLD_SEGMENT_ROWS)).fetchall()
+
+                name = cold_storage.segment_name(day_start, rows[0][0])
+                size = self.cold_store.write_segment(name, cold_storage.segment_columns([row[1:] for row in rows]))
+                try:
+                    conn.executemany("DELETE FROM activities WHERE id = ?", ((row[0],) for row in rows))
+                    conn.execute(
+                        "INSERT INTO cold_segments (name, start_ms, end_ms, rows, bytes, created_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        (name, rows[0][1], rows[-1][1], len(rows), size, now_epoch_ms())
+                    )
+                except Exception:
+                    self.cold_store.remove(name)
+                    raise
+
+            self._cold_end_ms = max(self._cold_end_ms or 0, rows[-1][1])
+            report['archived_activities'] += len(rows)
+            report['cold_segments_written'] += 1
+            report['cold_bytes_written'] += size
+            self._yield_to_writer()
+
+    def _drop_cold_segments(self, cutoff_ms: int, report: Dict):
+        """Borrar los segmentos en frío que terminan antes del corte"""
+        with self._write_transaction() as conn:
+            names = [name for (name,) in conn.execute(
+                "SELECT name FROM cold_segments WHERE end_ms < ?", (cutoff_ms,)
+            )]
+            conn.execute("DELETE FROM cold_segments WHERE end_ms < ?", (cutoff_ms,))
+        # Los archivos se borran después del commit (los lectores en curso los saltan)
+        for name in names:
+            self.cold_store.remove(name)
+        report['cold_segments_dropped'] = len(names)
+
+    def open_cold_store(self, conn: sqlite3.Connection):
+        """Cargar el horizonte del almacenamiento en frío y limpiar segmentos huérfanos"""
+        if self.cold_store is None:
+            return
+        names = [name for (name,) in conn.execute("SELECT name FROM cold_segments")]
+        removed = self.cold_store.remove_orphans(names)
+        if removed:
+            logger.info(f"Removed {removed} orphaned cold segment files")
+        self._cold_end_ms = conn.execute("SELECT MAX(end_ms) FROM cold_segments").fetchone()[0]
+
+    def _cold_segments(self, conn, start_ms: int, end_ms: int) -> List[str]:
+        """Segmentos en frío que solapan el rango, del más reciente al más antiguo"""
+        if self.cold_store is None or self._cold_end_ms is None or start_ms > self._cold_end_ms:
+            return []
+        return [name for (name,) in conn.execute(
+            "SELECT name FROM cold_segments WHERE end_ms >= ? AND start_ms <= ? ORDER BY end_ms DESC",
+            (start_ms, end_ms)
+        )]
+
+    def _cold_page(self, conn, start_ms: int, end_ms: int, filters: Dict[str, Optional[str]],
+                   limit: int, offset: int) -> List[Dict]:
+        """
+        Filas en frío que completan una página de la tabla: las archivadas son
+        siempre más antiguas que las de la tabla, así que la página sigue con
+        ellas y offset cuenta solo las archivadas que se saltan.
+        """
+        if limit <= 0:
+            return []
+        segments = self._cold_segments(conn, start_ms, end_ms)
+        if not segments:
+            return []
+        return self.cold_store.select(segments, start_ms, end_ms, filters, limit, offset)
+
+    def _train_message_codec(self, sample_size: int) -> bool:
+        """
+        Entrenar un diccionario leyendo la muestra por una conexión del pool
+        de lectura (sin bloquear al escritor, que sigue insertando) y encolar
+        solo su INSERT como una operación de escritura corta. Devuelve si la
+        versión nueva quedó confirmada y activa.
+        """
+        try:
+            with self.get_connection() as conn:
+                trained = self.message_codec.build(conn, sample_size)
+            if trained is None:
+                return False
+            operation = {'type': 'message_dictionary', 'data': trained, 'timestamp': time.time()}
+            return self._enqueue(operation, wait=True) and 'version' in operation
+        except Exception as e:
+            logger.error(f"Message dictionary training failed: {e}")
+            return False
+        finally:
+            self._training.release()
+
+    def train_message_dictionary(self, sample_size: int = TRAINING_SAMPLE, wait: bool = False) -> bool:
+        """
+        Entrenar un diccionario nuevo con los mensajes más recientes en un
+        hilo propio (o en el que llama con wait=True). Las filas nuevas usan
+        la versión nueva en cuanto se confirma; las anteriores conservan la
+        suya. Devuelve False si ya hay un entrenamiento en curso.
+        """
+        if not self._training.acquire(blocking=False):
+            return False
+        if wait:
+            return self._train_message_codec(sample_size)
+        threading.Thread(target=self._train_message_codec, args=(sample_size,),
+                         daemon=True, name="MessageTraining").start()
+        return True
+
+    def _wal_size(self) -> int:
+        """Tamaño actual del archivo -wal en bytes"""
+        try:
+            return os.path.getsize(self.db_path + '-wal')
+        except OSError:
+            return 0
+
+    def _readers_idle(self) -> bool:
+        """Sin lecturas en curso ni recientes"""
+        with db_lock:
+            return self._active_readers == 0 and time.time() - self._last_read_end > READER_IDLE_SECONDS
+
+    def _maybe_checkpoint(self):
+        """
+        Decidir el checkpoint según el tamaño del WAL y la actividad de lectura.
+        PASSIVE nunca espera a los lectores; TRUNCATE deja el WAL a cero pero
+        espera a que terminen, por eso solo se usa con lectores inactivos o
+        cuando el WAL supera el límite duro.
+        """
+        if self._write_conn is None:
+            return
+
+        wal_bytes = self._wal_size()
+        if wal_bytes == 0:
+            return
+
+        if wal_bytes >= WAL_HARD_LIMIT_BYTES or (wal_bytes >= WAL_TRUNCATE_BYTES and self._readers_idle()):
+            mode = 'TRUNCATE'
+        elif wal_bytes >= WAL_PASSIVE_BYTES or time.time() - self._last_checkpoint > CHECKPOINT_INTERVAL:
+            mode = 'PASSIVE'
+        else:
+            return
+
+        self._checkpoint(mode, wal_bytes)
+
+    def _checkpoint(self, mode: str, wal_bytes: int):
+        """Ejecutar un checkpoint y registrar sus métricas"""
+        started = time.time()
+        try:
+            # TRUNCATE espera a los lectores con el busy handler: acotar la espera
+            # para no bloquear el hilo escritor (si no lo logra, queda como PASSIVE)
+            if mode == 'TRUNCATE':
+                self._write_conn.execute(f"PRAGMA busy_timeout = {CHECKPOINT_BUSY_TIMEOUT_MS}")
+            busy, log_frames, checkpointed = self._write_conn.execute(
+                f"PRAGMA wal_checkpoint({mode})"
+            ).fetchone()
+        except Exception as e:
+            logger.error(f"WAL checkpoint ({mode}) failed: {e}")
+            return
+        finally:
+            if mode == 'TRUNCATE':
+                self._write_conn.execute(f"PRAGMA busy_timeout = {DB_TIMEOUT * 1000}")
+        duration = time.time() - started
+
+        self._last_checkpoint = time.time()
+        self.checkpoint_metrics['count'][mode] += 1
+        self.checkpoint_metrics['total_seconds'] += duration
+        self.checkpoint_metrics['last'] = {
+            'mode': mode,
+            'duration_ms': round(duration * 1000, 2),
+            'wal_bytes_before': wal_bytes,
+            'wal_bytes_after': self._wal_size(),
+            'log_frames': log_frames,
+            'checkpointed_frames': checkpointed,
+            'busy': bool(busy),
+            'at': int(self._last_checkpoint)
+        }
+        logger.debug(f"WAL checkpoint {mode}: {checkpointed}/{log_frames} frames in {duration * 1000:.1f} ms")
+
+    def get_storage_metrics(self) -> Dict[str, Any]:
+        """Métricas del motor de almacenamiento (WAL, checkpoints, lectores)"""
+        with db_lock:
+            active_readers = self._active_readers
+        checkpoints = self.checkpoint_metrics
+        total = sum(checkpoints['count'].values())
+        return {
+            'wal_bytes': self._wal_size(),
+            'active_readers': active_readers,
+            'checkpoints': {
+                'count': dict(checkpoints['count']),
+                'avg_duration_ms': round(checkpoints['total_seconds'] * 1000 / total, 2) if total else 0.0,
+                'last': checkpoints['last']
+            },
+            'write_queue_depth': self.write_queue.qsize(),
+            'writer': self.get_writer_metrics(),
+            'reader_pool': self.reader_pool.get_metrics(),
+            'spool': self.spool.get_metrics(),
+            'cold_storage': self.get_cold_storage_stats(),
+            'message_codec': self.message_codec.get_metrics(),
+            'backups': self.get_backup_status()
+        }
+
+    def _explain_statements(self, statements: List[Dict]) -> List[List[str]]:
+        """Plan de cada sentencia de una consulta lenta (para su registro)"""
+        with self.get_connection() as conn:
+            return [
+                [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {statement['sql']}", statement['params'])]
+                for statement in statements
+            ]
+
+    def get_query_stats(self) -> Dict[str, Any]:
+        """Histogramas de tiempos por consulta y fase"""
+        return self.query_stats.get_metrics()
+
+    def get_slow_queries(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """Últimas consultas que superaron SLOW_QUERY_MS, con parámetros y planes"""
+        return self.query_stats.get_slow_queries(limit)
+
+    def _copy_snapshot(self, dest_path: str) -> Dict[str, Any]:
+        """
+        Copiar la base de datos con una conexión de lectura del pool.
+        get_connection() abre la transacción de lectura y registra la copia
+        como lector activo, así el planificador de checkpoints no intenta
+        TRUNCATE mientras dura (el WAL crece y se recorta al terminar).
+        """
+        with self.get_connection() as conn:
+            return backup.copy_database(conn, dest_path)
+
+    def backup(self, compress: bool = True, verify: bool = True, keep: int = backup.BACKUP_KEEP) -> Dict[str, Any]:
+        """
+        Copia de seguridad en caliente (en el hilo que llama, nunca en el escritor).
+        Devuelve el informe de modules.backup.run_backup; RuntimeError si ya hay una en curso.
+        """
+        if not self._backup_lock.acquire(blocking=False):
+            raise RuntimeError("A backup is already running")
+        self.backup_metrics['running'] = True
+        try:
+            report = backup.run_backup(self._copy_snapshot, self.backup_dir, compress=compress,
+                                       verify=verify, keep=keep)
+        except Exception as e:
+            self.backup_metrics['failures'] += 1
+            self.backup_metrics['last_error'] = {'error': str(e), 'at': int(time.time())}
+            logger.error(f"Database backup failed: {e}")
+            raise
+        finally:
+            self.backup_metrics['running'] = False
+            self._backup_lock.release()
+
+        self.backup_metrics['count'] += 1
+        self.backup_metrics['last'] = report
+        logger.info(
+            f"Database backup {os.path.basename(report['path'])}: {report['database_bytes'] / 1048576:.1f} MB "
+            f"in {report['duration_seconds']:.1f} s (copy {report['copy_mb_per_s']} MB/s)"
+        )
+        return report
+
+    def start_backup(self, force: bool = False, **options) -> bool:
+        """
+        Lanzar una copia en un hilo propio si toca (la última tiene más de
+        BACKUP_INTERVAL) o si se fuerza. Devuelve si se lanzó.
+        """
+        if self.backup_metrics['running']:
+            return False
+        if not force:
+            existing = backup.list_backups(self.backup_dir)
+            if existing and time.time() - existing[-1]['created_at'] < BACKUP_INTERVAL:
+                return False
+
+        def run():
+            try:
+                self.backup(**options)
+            except Exception:
+                pass  # El fallo ya queda en backup_metrics y en el log
+
+        threading.Thread(target=run, daemon=True, name="DatabaseBackup").start()
+        return True
+
+    def get_backup_status(self) -> Dict[str, Any]:
+        """Estado de las copias: la última ejecución y las copias disponibles"""
+        return {
+            'directory': self.backup_dir,
+            'interval_seconds': BACKUP_INTERVAL,
+            **self.backup_metrics,
+            'available': backup.list_backups(self.backup_dir)
+        }
+
     def _incremental_vacuum(self):
         """Realizar vacuum incremental para liberar espacio"""
         try:
-            with self.get_connection(readonly=False) as conn:
+            with self._write_transaction() as conn:
                 conn.execute("PRAGMA incremental_vacuum(100)")
                 self.last_vacuum = time.time()
                 logger.debug("Incremental vacuum completed")
         except Exception as e:
             logger.error(f"Vacuum failed: {e}")
-    
-    def queue_activity_insert(self, activities: List[Dict]):
-        """Encolar inserción de actividades"""
-        if not activities:
-            return
-            
+
+    def _enqueue(self, operation: Dict, wait: bool = False, timeout: float = DB_TIMEOUT) -> bool:
+        """Encolar una operación para el hilo escritor (opcionalmente esperar su commit)"""
+        if wait:
+            operation['done'] = threading.Event()
         try:
-            operation = {
-                'type': 'insert_activity',
-                'data': activities,
-                'timestamp': time.time()
-            }
-            write_queue.put_nowait(operation)
-        except:
+            self.write_queue.put_nowait(operation)
+        except Full:
+            return False
+        if wait:
+            return operation['done'].wait(timeout)
+        return True
+
+    def queue_activity_insert(self, activities: List[Dict], wait: bool = False) -> bool:
+        """
+        Encolar inserción de actividades.
+        Con el spool abierto se añaden al disco y nunca se descartan; sin él
+        (antes de inicializar la BD o si el disco falla) se usa la cola en memoria.
+        Con el spool lleno (el escritor no avanza) se rechazan: devuelve False.
+        """
+        if not activities:
+            return True
+
+        if self.spool.is_open:
+            try:
+                position = self.spool.append(activities)
+            except SpoolFull as e:
+                logger.warning(f"{e}, rejecting activities")
+                return False
+            except (OSError, ValueError) as e:
+                logger.error(f"Write spool append failed, falling back to memory queue: {e}")
+            else:
+                self._notify_spool()
+                if wait:
+                    return self.spool.wait_committed(position, DB_TIMEOUT)
+                return True
+
+        operation = {
+            'type': 'insert_activity',
+            'data': activities,
+            'timestamp': time.time()
+        }
+        if not self._enqueue(operation, wait=wait):
             logger.warning("Write queue full, dropping activities")
-    
+            return False
+        return True
+
+    def flush(self, timeout: float = DB_TIMEOUT) -> bool:
+        """Esperar a que se confirmen las escrituras encoladas hasta ahora"""
+        started = time.time()
+        spool_tail = self.spool.tail() if self.spool.is_open else None
+        operation = {'type': 'barrier', 'data': None, 'timestamp': started}
+        if not self._enqueue(operation, wait=True, timeout=timeout):
+            return False
+        if spool_tail is not None:
+            return self.spool.wait_committed(spool_tail, max(0.0, timeout - (time.time() - started)))
+        return True
+
+    @timed_query('activities_paginated')
     def get_activities_paginated(
-        self, 
-        page: int = 1, 
-        limit: int = 10, 
+        self,
+        page: int = 1,
+        limit: int = 10,
         days: int = 7,
         status_filter: Optional[str] = None,
-        source_filter: Optional[str] = None
+        source_filter: Optional[str] = None,
+        ip_filter: Optional[str] = None
     ) -> Tuple[List[Dict], int, int]:
-        """Obtener actividades paginadas de forma eficiente"""
+        """
+        Obtener actividades paginadas de forma eficiente. El total y las
+        páginas incluyen la parte del rango archivada en frío: las páginas
+        que pasan de las filas de la tabla siguen con las archivadas.
+        """
         try:
-            with self.get_connection(readonly=True) as conn:
+            with self.get_connection() as conn:
                 cursor = conn.cursor()
-                
-                # Calcular fecha límite
-                date_limit = (datetime.now() - timedelta(days=days)).isoformat()
-                
-                # Construir WHERE clause
-                where_conditions = ["timestamp >= ?"]
-                params = [date_limit]
-                
-                if status_filter:
-                    where_conditions.append("status = ?")
-                    params.append(status_filter)
-                
-                if source_filter:
-                    where_conditions.append("source = ?")
-                    params.append(source_filter)
-                
-                where_clause = " AND ".join(where_conditions)
-                
+
+                # Calcular límite temporal (entero, independiente de la zona horaria)
+                date_limit = days_ago_epoch_ms(days)
+                now_ms = now_epoch_ms()
+
+                # Construir WHERE clause (los mismos filtros para la tabla y el frío)
+                where, params, filters = self._activity_filters(status_filter, source_filter, ip_filter)
+                where_clause = f"ts_epoch_ms >= ?{where}"
+                params = [date_limit, *params]
+
                 # Contar total
                 count_sql = f"SELECT COUNT(*) FROM activities WHERE {where_clause}"
                 cursor.execute(count_sql, params)
-                total = cursor.fetchone()[0]
-                
+                hot_total = cursor.fetchone()[0]
+
+                segments = self._cold_segments(conn, date_limit, now_ms)
+                total = hot_total
+                if segments:
+                    total += self.cold_store.count(segments, date_limit, now_ms, filters)
+
                 # Obtener datos paginados
                 offset = (page - 1) * limit
                 data_sql = f"""
-                SELECT id, activity_id, timestamp, message, source, status, alert_level,
-                       threat_score, src_ip, dst_ip, service, action, device_name,
-                       device_type, json_data
-                FROM activities 
+                SELECT id, activity_id, timestamp, message_text(message) AS message, {ACTIVITY_LOOKUP_COLUMNS},
+                       threat_score, src_ip, dst_ip, device_name, json_data
+                FROM activities
                 WHERE {where_clause}
-                ORDER BY timestamp DESC 
+                ORDER BY ts_epoch_ms DESC
                 LIMIT ? OFFSET ?
                 """
-                
+
                 cursor.execute(data_sql, params + [limit, offset])
                 rows = cursor.fetchall()
-                
+
                 # Convertir a diccionarios
                 columns = [desc[0] for desc in cursor.description]
                 activities = []
-                
+
                 for row in rows:
                     activity = dict(zip(columns, row))
                     # Deserializar JSON data si existe
@@ -310,175 +1323,746 @@ class OptimizedDBManager:
                         except:
                             pass
                     activities.append(activity)
-                
+
+                if len(rows) < limit and segments:
+                    activities.extend(self.cold_store.select(
+                        segments, date_limit, now_ms, filters, limit - len(rows), max(0, offset - hot_total)
+                    ))
+
                 pages = (total + limit - 1) // limit
                 return activities, total, pages
-                
+
         except Exception as e:
             logger.error(f"Failed to get paginated activities: {e}")
             return [], 0, 0
-    
-    def get_activity_stats(self, days: int = 7) -> Dict:
-        """Obtener estadísticas de actividades"""
+
+    @timed_query('recent_activities')
+    def get_recent_activities(
+        self,
+        limit: int = 50,
+        offset: int = 0,
+        status_filter: Optional[str] = None,
+        source_filter: Optional[str] = None,
+        days: int = 7,
+        ip_filter: Optional[str] = None
+    ) -> List[Dict]:
+        """
+        Obtener actividades recientes tal como se guardaron (json_data),
+        siguiendo con las archivadas en frío si la tabla no llena el límite
+        """
         try:
-            with self.get_connection(readonly=True) as conn:
-                cursor = conn.cursor()
-                
-                date_limit = (datetime.now() - timedelta(days=days)).isoformat()
-                
-                # Estadísticas básicas
-                cursor.execute("""
-                SELECT 
-                    COUNT(*) as total,
-                    SUM(CASE WHEN status = 'high' THEN 1 ELSE 0 END) as high,
-                    SUM(CASE WHEN status = 'medium' THEN 1 ELSE 0 END) as medium,
-                    SUM(CASE WHEN status = 'low' THEN 1 ELSE 0 END) as low
-                FROM activities 
-                WHERE timestamp >= ?
-                """, (date_limit,))
-                
-                result = cursor.fetchone()
-                
-                # Estadísticas diarias
-                cursor.execute("""
+            with self.get_connection() as conn:
+                start_ms = days_ago_epoch_ms(days) if days > 0 else 0
+                where, params, filters = self._activity_filters(status_filter, source_filter, ip_filter)
+                params = [start_ms, *params]
+
+                rows = conn.execute(f"""
+                SELECT json_data, message_text(message), {ACTIVITY_LOOKUP_COLUMNS} FROM activities
+                WHERE ts_epoch_ms >= ?{where}
+                ORDER BY ts_epoch_ms DESC LIMIT ? OFFSET ?
+                """, [*params, limit, offset]).fetchall()
+                activities = self._decode_json_rows(rows)
+
+                if len(rows) < limit:
+                    # Filas de la tabla antes de esta página, para continuar el offset en frío
+                    if rows or not offset:
+                        hot_total = offset + len(rows)
+                    else:
+                        hot_total = conn.execute(
+                            f"SELECT COUNT(*) FROM activities WHERE ts_epoch_ms >= ?{where}", params
+                        ).fetchone()[0]
+                    activities.extend(self._cold_page(
+                        conn, start_ms, now_epoch_ms(), filters, limit - len(rows), max(0, offset - hot_total)
+                    ))
+                return activities
+
+        except Exception as e:
+            logger.error(f"Error retrieving activities from database: {e}")
+            return []
+
+    @timed_query('existing_ids')
+    def existing_activity_ids(self, activity_ids: List[str]) -> set:
+        """Los activity_id de la lista que ya están guardados (los inserts ignoran duplicados)"""
+        existing = set()
+        with self.get_connection() as conn:
+            for start in range(0, len(activity_ids), 500):
+                chunk = activity_ids[start:start + 500]
+                existing.update(activity_id for (activity_id,) in conn.execute(
+                    f"SELECT activity_id FROM activities WHERE activity_id IN ({','.join('?' * len(chunk))})",
+                    chunk
+                ))
+        return existing
+
+    @timed_query('activities_in_range')
+    def get_activities_in_range(self, start_ms: int, end_ms: int, limit: int = 200) -> List[Dict]:
+        """Obtener actividades entre dos instantes (milisegundos desde epoch), también en frío"""
+        try:
+            with self.get_connection() as conn:
+                rows = conn.execute(f"""
+                SELECT json_data, message_text(message), {ACTIVITY_LOOKUP_COLUMNS} FROM activities
+                WHERE ts_epoch_ms >= ? AND ts_epoch_ms <= ?
+                ORDER BY ts_epoch_ms DESC LIMIT ?
+                """, (start_ms, end_ms, limit)).fetchall()
+                activities = self._decode_json_rows(rows)
+                if len(rows) < limit:
+                    activities.extend(self._cold_page(conn, start_ms, end_ms, {}, limit - len(rows), 0))
+                return activities
+
+        except Exception as e:
+            logger.error(f"Error retrieving activities by range: {e}")
+            return []
+
+    def iter_activities(self, start_ms: int, end_ms: int,
+                        status_filter: Optional[str] = None,
+                        source_filter: Optional[str] = None,
+                        ip_filter: Optional[str] = None,
+                        include_archive: bool = True,
+                        chunk_size: int = EXPORT_CHUNK_ROWS):
+        """
+        Generador de actividades del rango en orden cronológico, para exportar.
+        Primero las del almacenamiento en frío y después las de la tabla, por
+        bloques de chunk_size. Cada bloque es una lectura corta que continúa
+        después del último instante leído, así que una exportación larga no
+        retiene una instantánea que impida los checkpoints del WAL. Las filas
+        que comparten el último instante de un bloque se leen juntas, así se
+        pagina solo por ts_epoch_ms y el orden lo da el índice sin ordenar
+        aparte.
+        """
+        # Los filtros de ambos lados salen de los mismos valores (y una IP no
+        # válida falla antes de empezar, no a mitad de la exportación)
+        where, params, filters = self._activity_filters(status_filter, source_filter, ip_filter)
+
+        if include_archive and self.cold_store is not None:
+            with self.get_connection() as conn:
+                segments = self._cold_segments(conn, start_ms, end_ms)
+            yield from self.cold_store.iter_rows(reversed(segments), start_ms, end_ms, filters, chunk_size)
+
+        columns = EXPORT_COLUMNS
+        lower = start_ms
+        while lower <= end_ms:
+            with self.get_connection() as conn:
+                rows = conn.execute(f"""
+                SELECT {columns} FROM activities
+                WHERE ts_epoch_ms >= ? AND ts_epoch_ms <= ?{where}
+                ORDER BY ts_epoch_ms
+                LIMIT ?
+                """, [lower, end_ms, *params, chunk_size]).fetchall()
+
+                if len(rows) == chunk_size:
+                    # Todas las filas del último instante, para continuar justo después
+                    last_ms = rows[-1][1]
+                    rows = [row for row in rows if row[1] < last_ms]
+                    rows.extend(conn.execute(f"""
+                    SELECT {columns} FROM activities
+                    WHERE ts_epoch_ms = ?{where}
+                    """, [last_ms, *params]).fetchall())
+                    lower = last_ms + 1
+                else:
+                    lower = end_ms + 1
+
+            for row in rows:
+                yield self._export_activity(row)
+
+    @classmethod
+    def _activity_filters(cls, status_filter: Optional[str], source_filter: Optional[str],
+                          ip_filter: Optional[str]) -> Tuple[str, List[Any], Dict[str, Optional[str]]]:
+        """
+        Filtros de estado, fuente e IP de origen para la tabla caliente
+        (condiciones AND y parámetros) y para el almacenamiento en frío
+        (columna -> valor), con la misma semántica: igualdad en estado y
+        fuente, IP o red CIDR sobre src_ip.
+        """
+        where = ""
+        params: List[Any] = []
+        for field, value in (('status', status_filter), ('source', source_filter)):
+            if value:
+                where += f" AND {lookups.filter_sql(field)}"
+                params.append(value)
+        if ip_filter:
+            condition, values = cls._ip_condition('src_ip', ip_filter)
+            where += f" AND {condition}"
+            params.extend(values)
+        filters = {'status': status_filter or None, 'source': source_filter or None, 'src_ip': ip_filter or None}
+        return where, params, filters
+
+    @staticmethod
+    def _ip_condition(column: str, value: str) -> Tuple[str, List[bytes]]:
+        """
+        Condición sobre la clave de una columna de IP para una IP o red CIDR
+        (ValueError si no es válida). Una IP suelta es una igualdad, así el
+        índice también da el orden por tiempo; una red es un rango del índice.
+        """
+        low, high = ip_utils.network_range(ip_utils.parse_network(value))
+        if low == high:
+            return f"{column}_key = ?", [low]
+        return f"{column}_key BETWEEN ? AND ?", [low, high]
+
+    @staticmethod
+    def _export_activity(row: Tuple) -> Dict:
+        """Actividad completa a partir de una fila de iter_activities"""
+        try:
+            activity = json.loads(row[2]) if row[2] else {}
+        except (json.JSONDecodeError, TypeError):
+            activity = {}
+        activity.update({
+            'id': row[3], 'timestamp': row[4], 'source': row[6], 'status': row[7],
+            'alert_level': row[8], 'threat_score': row[9], 'src_ip': row[10], 'dst_ip': row[11],
+            'service': row[12], 'action': row[13], 'device_name': row[14], 'device_type': row[15]
+        })
+        activity.setdefault('message', row[5])
+        return activity
+
+    def _decode_json_rows(self, rows) -> List[Dict]:
+        """Deserializar filas (json_data, mensaje, campos codificados) a diccionarios"""
+        activities = []
+        for json_data, message, *fields in rows:
+            try:
+                activity = json.loads(json_data)
+            except (json.JSONDecodeError, TypeError) as e:
+                logger.warning(f"Error decoding activity JSON: {e}")
+                continue
+            # El mensaje completo solo sigue en json_data si la columna lo recorta
+            activity.setdefault('message', message)
+            lookups.restore(activity, fields)
+            activities.append(activity)
+        return activities
+
+    @timed_query('count_activities')
+    def count_activities(self, status_filter: Optional[str] = None, days: int = 7) -> int:
+        """Contar actividades con filtros opcionales"""
+        try:
+            with self.get_connection() as conn:
+                query = "SELECT COUNT(*) FROM activities WHERE 1=1"
+                params = []
+
+                if days > 0:
+                    query += " AND ts_epoch_ms >= ?"
+                    params.append(days_ago_epoch_ms(days))
+
+                if status_filter:
+                    query += f" AND {lookups.filter_sql('status')}"
+                    params.append(status_filter)
+
+                total = conn.execute(query, params).fetchone()[0]
+
+                # Parte del rango que ya está en frío (misma instantánea que la tabla)
+                start_ms = days_ago_epoch_ms(days) if days > 0 else 0
+                segments = self._cold_segments(conn, start_ms, now_epoch_ms())
+                if segments:
+                    total += self.cold_store.count(segments, start_ms, now_epoch_ms(), {'status': status_filter})
+                return total
+
+        except Exception as e:
+            logger.error(f"Error counting activities: {e}")
+            return 0
+
+    @timed_query('count_by_status')
+    def count_activities_by_status(self, days: int = 7) -> Dict[str, int]:
+        """Contar actividades por estado en una sola consulta"""
+        try:
+            start_ms = days_ago_epoch_ms(days)
+            with self.get_connection() as conn:
+                # SUM(CASE) sobre el índice (ts_epoch_ms, status_id): sin GROUP BY ni B-tree temporal
+                total, high, medium, low = conn.execute(f"""
+                SELECT COUNT(*), {STATUS_SUMS}
+                FROM activities
+                WHERE ts_epoch_ms >= ?
+                """, (start_ms,)).fetchone()
+                counts = {'total': total, 'high': high or 0, 'medium': medium or 0, 'low': low or 0}
+
+                segments = self._cold_segments(conn, start_ms, now_epoch_ms())
+                if segments:
+                    cold = self.cold_store.count_by(segments, 'status', start_ms, now_epoch_ms(), {})
+                    counts['total'] += sum(cold.values())
+                    for status in ('high', 'medium', 'low'):
+                        counts[status] += cold.get(status, 0)
+
+            return counts
+
+        except Exception as e:
+            logger.error(f"Error counting activities by status: {e}")
+            return {'total': 0, 'high': 0, 'medium': 0, 'low': 0}
+
+    @timed_query('daily_stats')
+    def get_daily_stats(self, days: int = 30) -> List[Dict]:
+        """Obtener estadísticas diarias"""
+        try:
+            with self.get_connection() as conn:
+                rows = conn.execute("""
                 SELECT date, high_threats, medium_threats, low_threats, total_logs
-                FROM daily_stats 
-                WHERE date >= DATE(?)
+                FROM daily_stats
+                WHERE date >= ?
                 ORDER BY date DESC
-                """, (date_limit,))
-                
-                daily_stats = [
-                    {
-                        'date': row[0],
-                        'high_threats': row[1],
-                        'medium_threats': row[2],
-                        'low_threats': row[3],
-                        'total_logs': row[4]
-                    }
-                    for row in cursor.fetchall()
-                ]
-                
-                return {
-                    'total_activities': result[0],
-                    'status_distribution': {
-                        'high': result[1],
-                        'medium': result[2],
-                        'low': result[3]
-                    },
-                    'days_range': days,
-                    'daily_stats': daily_stats,
-                    'last_sync': int(time.time())
+                """, (local_date_days_ago(days),)).fetchall()
+
+            return [
+                {
+                    'date': row[0],
+                    'high_threats': row[1],
+                    'medium_threats': row[2],
+                    'low_threats': row[3],
+                    'total_logs': row[4]
                 }
-                
+                for row in rows
+            ]
+
         except Exception as e:
-            logger.error(f"Failed to get activity stats: {e}")
+            logger.error(f"Error retrieving daily stats: {e}")
+            return []
+
+    @timed_query('search')
+    def search_activities(self, text: str, start_ms: int, end_ms: int, limit: int = 50,
+                          cursor: Optional[str] = None, sort: str = 'rank',
+                          status_filter: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Búsqueda de texto completo con ranking, rango de tiempo y cursor.
+        Los segmentos en frío no tienen índice de texto: si el rango llega a
+        ellos, la respuesta lo indica con archive_excluded.
+        """
+        try:
+            with self.get_connection() as conn:
+                result = search.search(conn, text, start_ms, end_ms, limit, cursor, sort, status_filter)
+                result['archive_excluded'] = bool(self._cold_segments(conn, start_ms, end_ms))
+                return result
+        except Exception as e:
+            logger.error(f"Error searching activities: {e}")
+            return {'data': [], 'next_cursor': None, 'count': 0, 'error': str(e)}
+
+    @timed_query('rollup_totals')
+    def get_rollup_totals(self, granularity: str, start_ms: int, end_ms: int, dimension: str) -> Dict[str, int]:
+        """Totales de una dimensión de rollups en un rango"""
+        try:
+            with self.get_connection() as conn:
+                return rollups.get_totals(conn, granularity, start_ms, end_ms, dimension)
+        except Exception as e:
+            logger.error(f"Error reading rollup totals: {e}")
+            return {}
+
+    @timed_query('rollup_series')
+    def get_rollup_series(self, granularity: str, start_ms: int, end_ms: int,
+                          dimensions: Tuple[str, ...] = ('total', 'status')) -> Dict[int, Dict[str, Dict[str, int]]]:
+        """Serie temporal de rollups en un rango"""
+        try:
+            with self.get_connection() as conn:
+                return rollups.get_series(conn, granularity, start_ms, end_ms, dimensions)
+        except Exception as e:
+            logger.error(f"Error reading rollup series: {e}")
             return {}
-    
-    def cleanup_old_data(self, days_to_keep: int = 30):
-        """Limpiar datos antiguos para liberar espacio"""
+
+    @timed_query('network_summary')
+    def get_network_summary(self, network: str, start_ms: int, end_ms: int,
+                            direction: str = 'src', limit: int = 20) -> Dict[str, Any]:
+        """
+        Actividad de una red CIDR como origen o destino: total, conteo por
+        estado y direcciones con más actividad. Recorre solo el rango de la red
+        en el índice de la clave, sin leer la tabla, y suma la parte del rango
+        archivada en frío.
+        """
+        column = 'dst_ip' if direction == 'dst' else 'src_ip'
+        summary = {'network': network, 'direction': direction, 'total': 0, 'by_status': {},
+                   'distinct_addresses': 0, 'addresses': []}
+        try:
+            parsed = ip_utils.parse_network(network)
+            low, high = ip_utils.network_range(parsed)
+            with self.get_connection() as conn:
+                rows = conn.execute(f"""
+                SELECT {column}_key, COUNT(*),
+                       SUM(status_id = {lookups.code_sql('status')}), SUM(status_id = {lookups.code_sql('status')})
+                FROM activities
+                WHERE {column}_key BETWEEN ? AND ? AND ts_epoch_ms >= ? AND ts_epoch_ms <= ?
+                GROUP BY {column}_key
+                """, ('high', 'medium', low, high, start_ms, end_ms)).fetchall()
+                segments = self._cold_segments(conn, start_ms, end_ms)
+
+            if segments:
+                # Por dirección: [clave, total, high, medium], como las filas de la tabla
+                merged = {row[0]: list(row) for row in rows}
+                network_filter = {column: str(parsed)}
+                for index, status in ((1, None), (2, 'high'), (3, 'medium')):
+                    counts = self.cold_store.count_by(segments, column, start_ms, end_ms,
+                                                      {**network_filter, 'status': status})
+                    for address, count in counts.items():
+                        key = ip_utils.ip_key(address)
+                        merged.setdefault(key, [key, 0, 0, 0])[index] += count
+                rows = list(merged.values())
+        except Exception as e:
+            logger.error(f"Error reading network summary: {e}")
+            return {**summary, 'error': str(e)}
+
+        total = sum(row[1] for row in rows)
+        high = sum(row[2] for row in rows)
+        medium = sum(row[3] for row in rows)
+        top = sorted(rows, key=lambda row: row[1], reverse=True)[:limit]
+        summary.update({
+            'network': str(parsed),
+            'total': total,
+            'by_status': {'high': high, 'medium': medium, 'low': total - high - medium},
+            'distinct_addresses': len(rows),
+            'addresses': [{'ip': ip_utils.key_to_ip(key), 'count': count, 'high': high_count}
+                          for key, count, high_count, _ in top]
+        })
+        return summary
+
+    @timed_query('heavy_hitters')
+    def get_heavy_hitters(self, dimension: str, granularity: str, start_ms: int, end_ms: int,
+                          limit: int = 10) -> List[Dict[str, Any]]:
+        """Top-N de IPs de amenazas (threat_src/threat_dst) con su cota de error"""
+        try:
+            with self.get_connection() as conn:
+                return rollups.get_heavy_hitters(conn, granularity, start_ms, end_ms, dimension, limit)
+        except Exception as e:
+            logger.error(f"Error reading heavy hitters: {e}")
+            return []
+
+    @timed_query('top_threat_sources')
+    def get_top_threat_sources(self, days: int = 7, limit: int = 10,
+                               dimension: str = 'threat_src') -> Dict[str, int]:
+        """
+        IPs con más amenazas medium/high en los últimos X días (días locales
+        completos, como los rollups), leídas de los resúmenes por día.
+        """
+        now_ms = now_epoch_ms()
+        start_ms = rollups.bucket_start(now_ms - (days - 1) * rollups.GRANULARITIES['day'], 'day')
+        hitters = self.get_heavy_hitters(dimension, 'day', start_ms, now_ms, limit)
+        return {hitter['value']: hitter['count'] for hitter in hitters}
+
+    @timed_query('archive')
+    def query_archive(self, start_ms: int, end_ms: int,
+                      status_filter: Optional[str] = None,
+                      source_filter: Optional[str] = None,
+                      ip_filter: Optional[str] = None,
+                      limit: int = 100) -> Dict[str, Any]:
+        """Conteos por estado y filas del almacenamiento en frío que cumplen los filtros"""
+        empty = {'data': [], 'counts': {}, 'total': 0, 'segments': 0}
+        if self.cold_store is None:
+            return empty
+        try:
+            with self.get_connection() as conn:
+                segments = self._cold_segments(conn, start_ms, end_ms)
+            if not segments:
+                return empty
+
+            filters = self._activity_filters(status_filter, source_filter, ip_filter)[2]
+            counts = self.cold_store.count_by(segments, 'status', start_ms, end_ms, filters)
+            return {
+                'data': self.cold_store.select(segments, start_ms, end_ms, filters, limit),
+                'counts': counts,
+                'total': sum(counts.values()),
+                'segments': len(segments)
+            }
+
+        except Exception as e:
+            logger.error(f"Error querying cold storage: {e}")
+            return {**empty, 'error': str(e)}
+
+    def get_cold_storage_stats(self) -> Dict[str, Any]:
+        """Tamaño y alcance del almacenamiento en frío"""
+        if self.cold_store is None:
+            return {'enabled': False}
         try:
-            cutoff_date = (datetime.now() - timedelta(days=days_to_keep)).isoformat()
-            
-            operation = {
-                'type': 'cleanup',
-                'data': {'cutoff_date': cutoff_date},
-                'timestamp': time.time()
+            with self.get_connection() as conn:
+                segments, rows, size, oldest, newest = conn.execute(
+                    "SELECT COUNT(*), SUM(rows), SUM(bytes), MIN(start_ms), MAX(end_ms) FROM cold_segments"
+                ).fetchone()
+            return {
+                'enabled': True,
+                'segments': segments,
+                'rows': rows or 0,
+                'bytes': size or 0,
+                'bytes_per_row': round(size / rows, 1) if rows else 0.0,
+                'oldest_ms': oldest,
+                'newest_ms': newest
             }
-            write_queue.put_nowait(operation)
-            
-        except:
+        except Exception as e:
+            logger.error(f"Error reading cold storage stats: {e}")
+            return {'enabled': True, 'error': str(e)}
+
+    @timed_query('activity_stats')
+    def get_activity_stats(self, days: int = 7) -> Dict:
+        """Obtener estadísticas de actividades (con la parte archivada en frío)"""
+        try:
+            counts = self.count_activities_by_status(days)
+
+            return {
+                'total_activities': counts['total'],
+                'status_distribution': {
+                    'high': counts['high'],
+                    'medium': counts['medium'],
+                    'low': counts['low']
+                },
+                'days_range': days,
+                'daily_stats': self.get_daily_stats(days),
+                'last_sync': int(time.time())
+            }
+
+        except Exception as e:
+            logger.error(f"Failed to get activity stats: {e}")
+            return {}
+
+    def cleanup_old_data(self, days_to_keep: int = 30, stats_days_to_keep: int = RETENTION_STATS_DAYS,
+                         wait: bool = False, timeout: float = 300, archive: bool = True,
+                         cold_days_to_keep: int = COLD_RETENTION_DAYS) -> bool:
+        """
+        Encolar limpieza de datos antiguos (la ejecuta el hilo escritor).
+        Con archive=True las actividades de más de days_to_keep días pasan al
+        almacenamiento en frío, que conserva cold_days_to_keep días.
+        """
+        operation = {
+            'type': 'cleanup',
+            'data': {
+                'cutoff_epoch_ms': days_ago_epoch_ms(days_to_keep),
+                'stats_cutoff': local_date_days_ago(stats_days_to_keep),
+                'archive': archive,
+                'cold_cutoff_epoch_ms': days_ago_epoch_ms(cold_days_to_keep)
+            },
+            'timestamp': time.time()
+        }
+        if not self._enqueue(operation, wait=wait, timeout=timeout):
             logger.warning("Could not queue cleanup operation")
-    
+            return False
+        return True
+
+    def get_retention_report(self) -> Dict:
+        """Obtener el informe de la última ejecución de retención"""
+        return dict(self.last_retention_report)
+
+    @timed_query('federation_changes')
+    def get_changes(self, after_id: int = 0, limit: int = FEDERATION_MAX_ROWS) -> Dict[str, Any]:
+        """
+        Actividades con rowid mayor que after_id, en orden de inserción, para
+        que un nodo agregador las replique con un cursor incremental. max_id
+        permite detectar una base de datos reemplazada (max_id < after_id).
+        """
+        limit = max(1, min(limit, FEDERATION_MAX_ROWS))
+        with self.get_connection() as conn:
+            rows = conn.execute(f"""
+            SELECT {EXPORT_COLUMNS} FROM activities
+            WHERE id > ?
+            ORDER BY id
+            LIMIT ?
+            """, (after_id, limit)).fetchall()
+            max_id = conn.execute("SELECT MAX(id) FROM activities").fetchone()[0] or 0
+
+        activities = []
+        for row in rows:
+            activity = self._export_activity(row)
+            activity['ts_epoch_ms'] = row[1]
+            activities.append(activity)
+        return {
+            'activities': activities,
+            'next_after': rows[-1][0] if rows else after_id,
+            'last_ts_epoch_ms': rows[-1][1] if rows else None,
+            'max_id': max_id,
+            'more': bool(rows) and rows[-1][0] < max_id
+        }
+
+    def merge_remote_activities(self, sensor: str, activities: List[Dict], last_id: int,
+                                last_ts_epoch_ms: Optional[int] = None, timeout: float = DB_TIMEOUT) -> bool:
+        """
+        Fusionar una página de actividades de un sensor y avanzar su cursor en
+        la misma transacción (espera al commit). Las repetidas se ignoran por
+        activity_id, así que reintentar una página es seguro.
+        """
+        operation = {
+            'type': 'federation_merge',
+            'data': activities,
+            'cursor': {'sensor': sensor, 'last_id': last_id, 'last_ts_epoch_ms': last_ts_epoch_ms,
+                       'rows': len(activities)},
+            'timestamp': time.time()
+        }
+        return self._enqueue(operation, wait=True, timeout=timeout)
+
+    def get_federation_cursors(self) -> Dict[str, Dict[str, Any]]:
+        """Cursores confirmados de los sensores remotos"""
+        with self.get_connection() as conn:
+            rows = conn.execute(
+                "SELECT sensor, last_id, last_ts_epoch_ms, rows_merged, updated_at FROM federation_cursors"
+            ).fetchall()
+        return {
+            sensor: {'last_id': last_id, 'last_ts_epoch_ms': last_ts, 'rows_merged': merged, 'updated_at': updated}
+            for sensor, last_id, last_ts, merged, updated in rows
+        }
+
+    def get_write_generation(self) -> int:
+        """
+        Contador de commits con cambios. Suma los de este proceso y los que
+        PRAGMA data_version detecta desde otras conexiones (migraciones, CLI,
+        otro proceso con la misma BD). Un resultado calculado con la
+        generación N sigue siendo válido mientras la generación no cambie.
+        """
+        with self._version_lock:
+            try:
+                if self._version_conn is None:
+                    self._version_conn = self._create_read_connection()
+                version = self._version_conn.execute("PRAGMA data_version").fetchone()[0]
+            except sqlite3.Error as e:
+                # Sin poder comprobarlo, ningún resultado anterior es fiable
+                logger.debug(f"Could not read data_version: {e}")
+                self._data_version = None
+                self._external_generation += 1
+            else:
+                if version != self._data_version:
+                    self._data_version = version
+                    self._external_generation += 1
+            return self.write_generation + self._external_generation
+
+    def submit_query(self, fn, *args, timeout: Optional[float] = QUERY_TIMEOUT, **kwargs):
+        """
+        Ejecutar un método de lectura en el pool de lectores y devolver un
+        QueryFuture (result(), cancel(), asyncio.wrap_future). Ejemplo:
+        submit_query(manager.get_recent_activities, limit=50, timeout=2)
+        """
+        return self.reader_pool.submit(fn, *args, timeout=timeout, **kwargs)
+
+    async def query_async(self, fn, *args, timeout: Optional[float] = QUERY_TIMEOUT, **kwargs):
+        """Versión awaitable de submit_query para servidores asyncio"""
+        return await self.reader_pool.run_async(fn, *args, timeout=timeout, **kwargs)
+
     def shutdown(self):
         """Cerrar gestor de base de datos limpiamente"""
         logger.info("Shutting down database manager...")
         self.shutdown_flag.set()
-        
+        self.reader_pool.shutdown()
+
+        # Despertar al hilo escritor y esperar a que vacíe su lote actual
+        try:
+            self.write_queue.put_nowait(None)
+        except Full:
+            pass
+        if self.writer_thread and self.writer_thread.is_alive():
+            self.writer_thread.join(timeout=5)
+
         # Procesar cola restante
         remaining_operations = []
-        while not write_queue.empty():
+        while True:
             try:
-                remaining_operations.append(write_queue.get_nowait())
+                operation = self.write_queue.get_nowait()
             except Empty:
                 break
-        
+            if operation is not None and operation is not SPOOL_SIGNAL:
+                remaining_operations.append(operation)
+
         if remaining_operations:
             self._flush_batch(remaining_operations)
-        
+
+        # Lo que quede en el spool ya está en disco y se reproduce al arrancar
+        spool_depth = self.spool.get_metrics()['depth']
+        if spool_depth:
+            logger.info(f"{spool_depth} spooled activity batches will be replayed on next start")
+        self.spool.close()
+
         # Cerrar conexiones
         with db_lock:
             for conn in self.connection_pool:
                 conn.close()
             self.connection_pool.clear()
-        
-        if self.writer_thread and self.writer_thread.is_alive():
-            self.writer_thread.join(timeout=5)
-        
+
+        if self._write_conn is not None:
+            self._write_conn.close()
+            self._write_conn = None
+
+        with self._version_lock:
+            if self._version_conn is not None:
+                self._version_conn.close()
+                self._version_conn = None
+
         logger.info("Database manager shutdown complete")
 
-# Instancia global optimizada
-optimized_db = OptimizedDBManager()
+# Instancia global del motor de almacenamiento: se crea en el primer uso,
+# no al importar, para que herramientas y scripts no arranquen el escritor
+_default_manager: Optional[OptimizedDBManager] = None
+_default_initialized = False
+_default_lock = threading.Lock()
+
+def get_optimized_db() -> OptimizedDBManager:
+    """Motor global: la primera llamada lo crea y lo inicializa (esquema, spool, frío)"""
+    global _default_manager, _default_initialized
+    if _default_manager is None:
+        with _default_lock:
+            if _default_manager is None:
+                manager = OptimizedDBManager()
+                _default_initialized = init_optimized_database(manager)
+                _default_manager = manager
+    return _default_manager
 
-def init_optimized_database():
-    """Inicializar base de datos optimizada"""
+class _LazyOptimizedDB:
+    """
+    Referencia al motor global que lo crea en el primer acceso, para que
+    `from modules.optimized_db_manager import optimized_db` siga sirviendo
+    sin coste al importar.
+    """
+
+    def __getattr__(self, name):
+        return getattr(get_optimized_db(), name)
+
+    def __repr__(self):
+        return f"<lazy {_default_manager!r}>" if _default_manager is not None else "<lazy OptimizedDBManager (not started)>"
+
+optimized_db = _LazyOptimizedDB()
+
+def _enable_incremental_vacuum(db_path: str = DB_PATH):
+    """
+    Convertir bases de datos existentes a auto_vacuum INCREMENTAL.
+    Requiere un VACUUM completo, por lo que solo se hace una vez y si el
+    archivo es pequeño; en otro caso se deja para mantenimiento manual.
+    """
+    conn = None
     try:
-        with optimized_db.get_connection(readonly=False) as conn:
-            cursor = conn.cursor()
-            
-            # Tabla para actividades (optimizada)
-            cursor.execute('''
-            CREATE TABLE IF NOT EXISTS activities (
-                id INTEGER PRIMARY KEY,
-                activity_id TEXT UNIQUE,
-                timestamp TEXT NOT NULL,
-                message TEXT NOT NULL,
-                source TEXT,
-                status TEXT,
-                alert_level TEXT,
-                threat_score REAL,
-                src_ip TEXT,
-                dst_ip TEXT,
-                service TEXT,
-                action TEXT,
-                device_name TEXT,
-                device_type TEXT,
-                json_data TEXT,
-                created_at TEXT DEFAULT CURRENT_TIMESTAMP
-            )
-            ''')
-            
-            # Índices optimizados
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_timestamp_status ON activities(timestamp, status)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_source ON activities(source)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_activity_id ON activities(activity_id)')
-            
-            # Tabla para estadísticas diarias
-            cursor.execute('''
-            CREATE TABLE IF NOT EXISTS daily_stats (
-                id INTEGER PRIMARY KEY,
-                date TEXT UNIQUE,
-                high_threats INTEGER DEFAULT 0,
-                medium_threats INTEGER DEFAULT 0,
-                low_threats INTEGER DEFAULT 0,
-                total_logs INTEGER DEFAULT 0,
-                json_data TEXT,
-                created_at TEXT DEFAULT CURRENT_TIMESTAMP
-            )
-            ''')
-            
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_stats_date ON daily_stats(date)')
-            
+        conn = sqlite3.connect(db_path, timeout=DB_TIMEOUT)
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            return
+
+        if os.path.getsize(db_path) > AUTO_VACUUM_CONVERT_MAX_BYTES:
+            logger.warning("Database too large to enable incremental auto_vacuum automatically; run VACUUM manually")
+            return
+
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        logger.info("Enabled incremental auto_vacuum on existing database")
+    except Exception as e:
+        logger.warning(f"Could not enable incremental auto_vacuum: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+def init_optimized_database(manager: Optional[OptimizedDBManager] = None):
+    """
+    Inicializar base de datos optimizada.
+    Sin manager arranca el motor global (una sola vez) y devuelve su resultado.
+    """
+    if manager is None:
+        get_optimized_db()
+        return _default_initialized
+    conn = None
+    try:
+        # Conexión dedicada: las migraciones hacen commits por bloques
+        conn = manager._create_optimized_connection()
+        schema.ensure_schema(conn)
+        manager.message_codec.load(conn)
+        if not manager.spool.is_open:
+            manager.open_spool(conn)
+        manager.open_cold_store(conn)
+
+        _enable_incremental_vacuum(manager.db_path)
+
         logger.info("Optimized database initialized successfully")
         return True
-        
+
     except Exception as e:
         logger.error(f"Failed to initialize optimized database: {e}")
         return False
+    finally:
+        if conn:
+            conn.close()
 
 # Funciones de conveniencia
 def queue_activities(activities: List[Dict]):
     """Encolar actividades para inserción asíncrona"""
-    optimized_db.queue_activity_insert(activities)
+    return optimized_db.queue_activity_insert(activities)
+
+def existing_activity_ids(activity_ids: List[str]) -> set:
+    """activity_id ya guardados"""
+    return optimized_db.existing_activity_ids(activity_ids)
 
 def get_paginated_activities(page: int = 1, limit: int = 10, **filters):
     """Obtener actividades paginadas"""
@@ -492,6 +2076,63 @@ def cleanup_database(days_to_keep: int = 30):
     """Limpiar datos antiguos"""
     optimized_db.cleanup_old_data(days_to_keep)
 
+def search_activities(text: str, start_ms: int, end_ms: int, **options):
+    """Buscar actividades en el índice de texto completo"""
+    return optimized_db.search_activities(text, start_ms, end_ms, **options)
+
+def get_trends(granularity: str, start_ms: int, end_ms: int):
+    """Obtener serie de tendencias desde los rollups"""
+    return optimized_db.get_rollup_series(granularity, start_ms, end_ms)
+
+def query_archive(start_ms: int, end_ms: int, **filters):
+    """Consultar el almacenamiento en frío"""
+    return optimized_db.query_archive(start_ms, end_ms, **filters)
+
+def get_storage_metrics():
+    """Obtener métricas del motor de almacenamiento"""
+    return optimized_db.get_storage_metrics()
+
+def backup_database(force: bool = False, **options) -> bool:
+    """Lanzar una copia de seguridad en segundo plano si toca (o si se fuerza)"""
+    return optimized_db.start_backup(force=force, **options)
+
+def get_query_stats():
+    """Histogramas de tiempos de las consultas del motor"""
+    return optimized_db.get_query_stats()
+
+def get_slow_queries(limit: int = 20):
+    """Registro de consultas lentas"""
+    return optimized_db.get_slow_queries(limit)
+
+def get_backup_status():
+    """Estado de las copias de seguridad"""
+    return optimized_db.get_backup_status()
+
+def get_last_retention_report():
+    """Obtener informe de la última limpieza"""
+    return optimized_db.get_retention_report()
+
+def submit_query(fn, *args, timeout: Optional[float] = QUERY_TIMEOUT, **kwargs):
+    """Ejecutar una consulta en el pool de lectores (devuelve un futuro)"""
+    return optimized_db.submit_query(fn, *args, timeout=timeout, **kwargs)
+
+def get_network_summary(network: str, start_ms: int, end_ms: int, **options):
+    """Actividad de una red CIDR usando el motor optimizado"""
+    return optimized_db.get_network_summary(network, start_ms, end_ms, **options)
+
+def iter_activities(start_ms: int, end_ms: int, **filters):
+    """Generador de actividades de un rango (exportación en streaming)"""
+    return optimized_db.iter_activities(start_ms, end_ms, **filters)
+
+def get_changes(after_id: int = 0, limit: int = FEDERATION_MAX_ROWS):
+    """Página de actividades nuevas para un nodo agregador"""
+    return optimized_db.get_changes(after_id, limit)
+
+def get_write_generation() -> int:
+    """Generación de escritura actual (para invalidar cachés de resultados)"""
+    return optimized_db.get_write_generation()
+
 def shutdown_database():
-    """Cerrar base de datos limpiamente"""
-    optimized_db.shutdown()
+    """Cerrar base de datos limpiamente (si llegó a arrancarse)"""
+    if _default_manager is not None:
+        _default_manager.shutdown()
@@ -0,0 +1,161 @@
+"""
+Pool acotado de hilos lectores para consultas con futuros.
+Las consultas se encolan en un pool propio (no en los hilos del servidor
+web) y devuelven un QueryFuture que admite timeout y cancelación. Una
+consulta en curso se interrumpe desde el progress handler de SQLite, que
+comprueba el plazo y la cancelación cada cierto número de instrucciones
+de la máquina virtual. Sirve tanto para servidores con hilos
+(future.result()) como para asyncio (await pool.run_async(...)).
+"""
+import time
+import logging
+import threading
+from queue import Queue, Full
+from concurrent.futures import Future, CancelledError
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+QUERY_PROGRESS_STEPS = 1000   # Instrucciones de SQLite entre comprobaciones de plazo
+
+class QueryTimeout(TimeoutError):
+    """La consulta superó su plazo (en cola o en ejecución)"""
+
+class QueryRejected(RuntimeError):
+    """La cola del pool de lectores está llena"""
+
+# Consulta que ejecuta el hilo actual (la lee el progress handler de su conexión)
+_current = threading.local()
+
+def current_query() -> Optional['QueryFuture']:
+    """Futuro de la consulta del hilo actual, o None fuera del pool"""
+    return getattr(_current, 'future', None)
+
+class QueryFuture(Future):
+    """
+    Futuro de una consulta con plazo. cancel() sobre una consulta en curso
+    pide su interrupción: devuelve False, como Future, y el futuro termina
+    con CancelledError en cuanto SQLite atiende la petición.
+    """
+
+    def __init__(self, timeout: Optional[float]):
+        super().__init__()
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self.cancel_requested = False
+        self.interrupted = False
+        # Instantes (monotonic) de encolado y de inicio: la espera en cola
+        self.submitted_at = time.monotonic()
+        self.started_at: Optional[float] = None
+
+    def cancel(self) -> bool:
+        if super().cancel():
+            return True
+        if not self.done():
+            self.cancel_requested = True
+        return False
+
+    def expired(self) -> bool:
+        return self.deadline is not None and time.monotonic() > self.deadline
+
+    def progress(self) -> int:
+        """Progress handler de SQLite: un valor distinto de cero aborta la sentencia"""
+        if self.cancel_requested or self.expired():
+            self.interrupted = True
+            return 1
+        return 0
+
+class ReaderPool:
+    """Hilos lectores con una cola acotada de consultas pendientes"""
+
+    def __init__(self, workers: int, max_pending: int, name: str = "DBReader"):
+        self.workers = workers
+        self.name = name
+        self._queue = Queue(maxsize=max_pending)
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self.metrics = {'submitted': 0, 'completed': 0, 'failed': 0, 'timeouts': 0,
+                        'cancelled': 0, 'rejected': 0, 'busy': 0}
+
+    def _start(self):
+        """Arrancar los hilos en el primer envío"""
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._worker, daemon=True, name=f"{self.name}-{i}")
+                thread.start()
+                self._threads.append(thread)
+            logger.info(f"Reader pool started with {self.workers} threads")
+
+    def submit(self, fn: Callable, *args, timeout: Optional[float] = None, **kwargs) -> QueryFuture:
+        """Encolar una consulta. Con la cola llena el futuro falla con QueryRejected."""
+        self._start()
+        future = QueryFuture(timeout)
+        try:
+            self._queue.put_nowait((future, fn, args, kwargs))
+        except Full:
+            self.metrics['rejected'] += 1
+            future.set_exception(QueryRejected(f"Reader pool queue full ({self._queue.maxsize} pending)"))
+            return future
+        self.metrics['submitted'] += 1
+        return future
+
+    async def run_async(self, fn: Callable, *args, timeout: Optional[float] = None, **kwargs) -> Any:
+        """Versión awaitable: cancelar la tarea de asyncio interrumpe la consulta"""
+        import asyncio  # Solo lo necesitan los servidores asyncio y tarda en importarse
+        return await asyncio.wrap_future(self.submit(fn, *args, timeout=timeout, **kwargs))
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            future, fn, args, kwargs = item
+            if not future.set_running_or_notify_cancel():
+                self.metrics['cancelled'] += 1
+                continue
+            if future.expired():
+                # Caducó esperando en la cola: no llega a ejecutarse
+                self.metrics['timeouts'] += 1
+                future.set_exception(QueryTimeout("Query timed out while queued"))
+                continue
+
+            self.metrics['busy'] += 1
+            future.started_at = time.monotonic()
+            _current.future = future
+            try:
+                result = fn(*args, **kwargs)
+                error = None
+            except BaseException as e:
+                result, error = None, e
+            finally:
+                _current.future = None
+                self.metrics['busy'] -= 1
+
+            # Los métodos del motor registran el error y devuelven un valor vacío:
+            # una interrupción se detecta por el futuro, no por una excepción
+            if future.interrupted:
+                if future.cancel_requested:
+                    self.metrics['cancelled'] += 1
+                    future.set_exception(CancelledError())
+                else:
+                    self.metrics['timeouts'] += 1
+                    future.set_exception(QueryTimeout("Query interrupted after exceeding its timeout"))
+            elif error is not None:
+                self.metrics['failed'] += 1
+                future.set_exception(error)
+            else:
+                self.metrics['completed'] += 1
+                future.set_result(result)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        return {'workers': self.workers, 'pending': self._queue.qsize(), **self.metrics}
+
+    def shutdown(self, timeout: float = 5.0):
+        """Parar los hilos tras las consultas ya encoladas"""
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(None)
+        for thread in threads:
+            thread.join(timeout=timeout)
@@ -0,0 +1,294 @@
+"""
+Tiempos por consulta del motor de almacenamiento.
+Cada método de lectura se etiqueta con un nombre (@timed_query) y cada
+llamada se divide en fases: espera en la cola del pool de lectores, espera
+por una conexión (db_lock y el pool), ejecución de las sentencias (lo que
+tarda cursor.execute, es decir, preparar y obtener la primera fila) y
+lectura/decodificación (el resto: fetch, json_data y armado del resultado).
+Cada fase alimenta un histograma de cubetas fijas por consulta, y también
+la ejecución de cada sentencia por su posición dentro de la consulta (la 0
+del paginado es el COUNT(*), la 1 la página). Las llamadas que superan el
+umbral se guardan en un registro de consultas lentas con sus parámetros y
+el plan de cada sentencia.
+"""
+import time
+import logging
+import threading
+import functools
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+
+from modules.query_pool import current_query
+
+logger = logging.getLogger(__name__)
+
+# Límites superiores de las cubetas en milisegundos (la última recoge el resto)
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+PHASES = ('queue_wait', 'lock_wait', 'execute', 'fetch', 'total')
+MAX_TIMED_STATEMENTS = 8    # Posiciones de sentencia con histograma propio por consulta
+SLOW_QUERY_LOG_SIZE = 50    # Consultas lentas que se conservan para la API
+STATEMENT_LABEL_LENGTH = 80
+
+# Medición de la consulta que ejecuta el hilo actual
+_current = threading.local()
+
+def current_timing() -> Optional['QueryTiming']:
+    """Medición en curso del hilo actual, o None fuera de una consulta etiquetada"""
+    return getattr(_current, 'timing', None)
+
+def _jsonable(value: Any) -> Any:
+    """Parámetros en un formato que admite JSON (las claves de IP van en hexadecimal)"""
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).hex()
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(item) for item in value]
+    if isinstance(value, dict):
+        return {str(key): _jsonable(item) for key, item in value.items()}
+    return repr(value)
+
+def statement_label(sql: str) -> str:
+    """Sentencia en una línea y recortada, para identificarla en la API"""
+    label = ' '.join(sql.split())
+    return label if len(label) <= STATEMENT_LABEL_LENGTH else label[:STATEMENT_LABEL_LENGTH - 3] + '...'
+
+class Histogram:
+    """Histograma de latencias con cubetas fijas (LATENCY_BUCKETS_MS)"""
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.count = 0
+        self.sum_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, ms: float):
+        index = 0
+        while index < len(LATENCY_BUCKETS_MS) and ms > LATENCY_BUCKETS_MS[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.sum_ms += ms
+        if ms > self.max_ms:
+            self.max_ms = ms
+
+    def percentile(self, pct: float) -> float:
+        """Percentil aproximado: límite superior de la cubeta que lo contiene"""
+        if not self.count:
+            return 0.0
+        target = self.count * pct / 100
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target and count:
+                return float(LATENCY_BUCKETS_MS[index]) if index < len(LATENCY_BUCKETS_MS) else round(self.max_ms, 2)
+        return round(self.max_ms, 2)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'count': self.count,
+            'avg_ms': round(self.sum_ms / self.count, 3) if self.count else 0.0,
+            'max_ms': round(self.max_ms, 3),
+            'p50_ms': self.percentile(50),
+            'p95_ms': self.percentile(95),
+            'p99_ms': self.percentile(99),
+            'buckets': dict(zip([f"le_{bound}" for bound in LATENCY_BUCKETS_MS] + ['inf'], self.counts))
+        }
+
+class QueryTiming:
+    """Medición de una llamada: fases acumuladas y sentencias ejecutadas"""
+
+    def __init__(self, name: str, args: tuple, kwargs: Dict):
+        self.name = name
+        self.args = args
+        self.kwargs = kwargs
+        self.started = time.perf_counter()
+        self.queue_wait = 0.0
+        self.lock_wait = 0.0
+        self.execute = 0.0
+        self.total = 0.0
+        self.statements: List[Dict[str, Any]] = []
+
+        # En el pool de lectores: desde que se encoló hasta que empezó
+        future = current_query()
+        if future is not None and future.started_at is not None:
+            self.queue_wait = future.started_at - future.submitted_at
+
+    def add_statement(self, sql: str, params, seconds: float):
+        self.execute += seconds
+        self.statements.append({'sql': sql, 'params': params, 'seconds': seconds})
+
+    def finish(self):
+        self.total = time.perf_counter() - self.started
+
+    @property
+    def fetch(self) -> float:
+        return max(0.0, self.total - self.lock_wait - self.execute)
+
+    def phases_ms(self) -> Dict[str, float]:
+        return {phase: round(getattr(self, phase) * 1000, 3) for phase in PHASES}
+
+class TimedCursor:
+    """Cursor que mide lo que tarda cada execute()"""
+
+    def __init__(self, cursor, timing: QueryTiming):
+        self._cursor = cursor
+        self._timing = timing
+
+    def execute(self, sql: str, params=()):
+        started = time.perf_counter()
+        self._cursor.execute(sql, params)
+        self._timing.add_statement(sql, params, time.perf_counter() - started)
+        return self
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+class TimedConnection:
+    """Conexión de lectura que atribuye sus sentencias a la medición en curso"""
+
+    def __init__(self, conn, timing: QueryTiming):
+        self._conn = conn
+        self._timing = timing
+
+    def execute(self, sql: str, params=()):
+        return TimedCursor(self._conn.cursor(), self._timing).execute(sql, params)
+
+    def cursor(self):
+        return TimedCursor(self._conn.cursor(), self._timing)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+class QueryStats:
+    """
+    Histogramas por consulta y registro de consultas lentas.
+    explain(statements) devuelve el plan de cada sentencia; solo se llama
+    para las consultas lentas, después de devolver la conexión al pool.
+    """
+
+    def __init__(self, slow_threshold_ms: float, explain: Optional[Callable[[List[Dict]], List[List[str]]]] = None):
+        self.slow_threshold_ms = slow_threshold_ms
+        self._explain = explain
+        self._lock = threading.Lock()
+        self._queries: Dict[str, Dict[str, Any]] = {}
+        self.slow_queries = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+        self.slow_count = 0
+
+    def _query(self, name: str) -> Dict[str, Any]:
+        query = self._queries.get(name)
+        if query is None:
+            query = self._queries[name] = {
+                'phases': {phase: Histogram() for phase in PHASES},
+                'statements': {}
+            }
+        return query
+
+    def record(self, timing: QueryTiming):
+        """Añadir una llamada terminada a los histogramas (y al registro si fue lenta)"""
+        phases = timing.phases_ms()
+        with self._lock:
+            query = self._query(timing.name)
+            for phase, ms in phases.items():
+                query['phases'][phase].observe(ms)
+            for index, statement in enumerate(timing.statements[:MAX_TIMED_STATEMENTS]):
+                entry = query['statements'].get(index)
+                if entry is None:
+                    entry = query['statements'][index] = {'sql': statement_label(statement['sql']),
+                                                          'execute': Histogram()}
+                entry['execute'].observe(statement['seconds'] * 1000)
+
+        if phases['total'] >= self.slow_threshold_ms:
+            self._log_slow(timing, phases)
+
+    def _log_slow(self, timing: QueryTiming, phases: Dict[str, float]):
+        statements = timing.statements[:MAX_TIMED_STATEMENTS]
+        plans: List[List[str]] = [[] for _ in statements]
+        if self._explain is not None:
+            try:
+                plans = self._explain(statements)
+            except Exception as e:
+                logger.debug(f"Could not explain slow query {timing.name}: {e}")
+
+        entry = {
+            'query': timing.name,
+            'at': int(time.time()),
+            **{f"{phase}_ms": ms for phase, ms in phases.items()},
+            'args': _jsonable(list(timing.args)),
+            'kwargs': _jsonable(timing.kwargs),
+            'statements': [
+                {
+                    'sql': ' '.join(statement['sql'].split()),
+                    'params': _jsonable(statement['params']),
+                    'execute_ms': round(statement['seconds'] * 1000, 3),
+                    'plan': plan
+                }
+                for statement, plan in zip(statements, plans)
+            ]
+        }
+        with self._lock:
+            self.slow_queries.append(entry)
+            self.slow_count += 1
+
+        logger.warning(
+            f"Slow query {timing.name}: {phases['total']:.1f} ms "
+            f"(queue {phases['queue_wait']:.1f} / lock {phases['lock_wait']:.1f} / "
+            f"execute {phases['execute']:.1f} / fetch {phases['fetch']:.1f}) "
+            f"args={entry['args']} kwargs={entry['kwargs']} "
+            f"plans={[' | '.join(statement['plan']) for statement in entry['statements']]}"
+        )
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Histogramas por consulta, de la más costosa a la menos (tiempo total acumulado)"""
+        with self._lock:
+            queries = {
+                name: {
+                    'phases': {phase: histogram.to_dict() for phase, histogram in query['phases'].items()},
+                    'statements': [
+                        {'index': index, 'sql': entry['sql'], 'execute': entry['execute'].to_dict()}
+                        for index, entry in sorted(query['statements'].items())
+                    ]
+                }
+                for name, query in sorted(self._queries.items(),
+                                          key=lambda item: -item[1]['phases']['total'].sum_ms)
+            }
+            return {
+                'slow_threshold_ms': self.slow_threshold_ms,
+                'slow_count': self.slow_count,
+                'queries': queries
+            }
+
+    def get_slow_queries(self, limit: int = SLOW_QUERY_LOG_SIZE) -> List[Dict[str, Any]]:
+        """Últimas consultas lentas, la más reciente primero"""
+        with self._lock:
+            return list(reversed(self.slow_queries))[:limit]
+
+    def reset(self):
+        with self._lock:
+            self._queries.clear()
+            self.slow_queries.clear()
+            self.slow_count = 0
+
+def timed_query(name: str):
+    """
+    Decorador de los métodos de lectura del motor (que tienen self.query_stats).
+    Una consulta etiquetada que llama a otra se mide entera como la exterior.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if current_timing() is not None:
+                return method(self, *args, **kwargs)
+            timing = QueryTiming(name, args, kwargs)
+            _current.timing = timing
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                _current.timing = None
+                timing.finish()
+                self.query_stats.record(timing)
+        return wrapper
+    return decorator
@@ -0,0 +1,306 @@
+"""
+Agregados materializados de actividades por minuto, hora y día.
+El hilo escritor acumula incrementos por lote y los aplica con un UPSERT
+por fila de agregado, de modo que las tendencias se leen de decenas de
+filas en lugar de recorrer miles de actividades.
+Las IPs de origen y destino de las amenazas (demasiados valores para un
+agregado exacto) se resumen por bucket con Space-Saving: como mucho
+HEAVY_HITTER_CAPACITY valores por bucket, con una cota de error por valor.
+"""
+import json
+import logging
+import sqlite3
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Any, Iterable, Tuple
+
+from modules.time_utils import TIMEZONE
+
+logger = logging.getLogger(__name__)
+
+# Ancho de cada granularidad en milisegundos
+GRANULARITIES = {
+    'minute': 60 * 1000,
+    'hour': 60 * 60 * 1000,
+    'day': 24 * 60 * 60 * 1000
+}
+
+# Días que se conservan de cada granularidad
+ROLLUP_RETENTION_DAYS = {
+    'minute': 2,
+    'hour': 30,
+    'day': 365
+}
+
+# Dimensiones agregadas: total, estado, nivel de amenaza, protocolo y país
+DIMENSIONS = ('total', 'status', 'threat', 'protocol', 'country')
+
+# Clave de incremento: (granularidad, inicio del bucket, dimensión, valor)
+RollupKey = Tuple[str, int, str, str]
+
+# Space-Saving: valores conservados por bucket y dimensión
+HEAVY_HITTER_CAPACITY = 64
+HEAVY_HITTER_GRANULARITIES = ('hour', 'day')
+HEAVY_HITTER_CACHE = 256  # Resúmenes de buckets recientes en memoria del escritor
+
+# Dimensión -> campo de la actividad (solo actividades medium/high)
+HEAVY_HITTER_DIMENSIONS = {
+    'threat_src': 'src_ip',
+    'threat_dst': 'dst_ip'
+}
+
+# Clave de resumen: (granularidad, inicio del bucket, dimensión)
+SummaryKey = Tuple[str, int, str]
+
+def bucket_start(ts_epoch_ms: int, granularity: str) -> int:
+    """Inicio del bucket que contiene el instante (los días en hora local)"""
+    if granularity == 'day':
+        local = datetime.fromtimestamp(ts_epoch_ms / 1000, TIMEZONE)
+        midnight = local.replace(hour=0, minute=0, second=0, microsecond=0)
+        return int(midnight.timestamp() * 1000)
+    width = GRANULARITIES[granularity]
+    return ts_epoch_ms - ts_epoch_ms % width
+
+def threat_level(activity: Dict[str, Any]) -> str:
+    """Clasificar la actividad en low/medium/high combinando estado y alert_level"""
+    status = str(activity.get('status') or 'low').lower()
+    level = str(activity.get('alert_level') or 'LOW').lower()
+    if level in ('critical', 'high') or status == 'high':
+        return 'high'
+    if level in ('medium', 'warning') or status == 'medium':
+        return 'medium'
+    return 'low'
+
+def activity_dimensions(activity: Dict[str, Any]) -> List[Tuple[str, str]]:
+    """Pares (dimensión, valor) que aporta una actividad"""
+    dimensions = [
+        ('total', ''),
+        ('status', str(activity.get('status') or 'low').lower()),
+        ('threat', threat_level(activity))
+    ]
+
+    protocol = activity.get('protocol')
+    if protocol and protocol != 'Unknown':
+        dimensions.append(('protocol', str(protocol)))
+
+    country = activity.get('country', activity.get('dst_country'))
+    if country and country != 'Unknown':
+        dimensions.append(('country', str(country)))
+
+    return dimensions
+
+def add_activity(deltas: Dict[RollupKey, int], ts_epoch_ms: int, activity: Dict[str, Any]):
+    """Acumular en memoria los incrementos de una actividad nueva"""
+    dimensions = activity_dimensions(activity)
+    for granularity in GRANULARITIES:
+        bucket = bucket_start(ts_epoch_ms, granularity)
+        for dimension, value in dimensions:
+            key = (granularity, bucket, dimension, value)
+            deltas[key] = deltas.get(key, 0) + 1
+
+def apply_deltas(cursor, deltas: Dict[RollupKey, int]):
+    """Aplicar los incrementos acumulados con un UPSERT por fila"""
+    if not deltas:
+        return
+
+    cursor.executemany("""
+    INSERT INTO activity_rollups (granularity, bucket_ms, dimension, value, count)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(granularity, bucket_ms, dimension, value) DO UPDATE SET
+        count = count + excluded.count
+    """, [(*key, count) for key, count in deltas.items()])
+
+def get_totals(conn, granularity: str, start_ms: int, end_ms: int, dimension: str) -> Dict[str, int]:
+    """Sumar una dimensión en un rango de buckets: {valor: total}"""
+    rows = conn.execute("""
+    SELECT value, SUM(count) FROM activity_rollups
+    WHERE granularity = ? AND bucket_ms >= ? AND bucket_ms <= ? AND dimension = ?
+    GROUP BY value
+    """, (granularity, start_ms, end_ms, dimension)).fetchall()
+    return {value: total for value, total in rows}
+
+def get_series(conn, granularity: str, start_ms: int, end_ms: int,
+               dimensions: Iterable[str] = ('total', 'status')) -> Dict[int, Dict[str, Dict[str, int]]]:
+    """Serie temporal: {bucket_ms: {dimensión: {valor: total}}} en orden cronológico"""
+    dimensions = list(dimensions)
+    placeholders = ','.join('?' * len(dimensions))
+    rows = conn.execute(f"""
+    SELECT bucket_ms, dimension, value, count FROM activity_rollups
+    WHERE granularity = ? AND bucket_ms >= ? AND bucket_ms <= ? AND dimension IN ({placeholders})
+    ORDER BY bucket_ms
+    """, (granularity, start_ms, end_ms, *dimensions)).fetchall()
+
+    series = {}
+    for bucket, dimension, value, count in rows:
+        series.setdefault(bucket, {}).setdefault(dimension, {})[value] = count
+    return series
+
+def backfill(conn: sqlite3.Connection, chunk_size: int = 5000) -> int:
+    """Reconstruir los agregados desde la tabla activities (por bloques de rowid)"""
+    max_id = conn.execute("SELECT MAX(id) FROM activities").fetchone()[0] or 0
+    lower = 0
+    processed = 0
+    while lower <= max_id:
+        rows = conn.execute(
+            "SELECT ts_epoch_ms, json_data FROM activities "
+            "WHERE id > ? AND id <= ? AND ts_epoch_ms IS NOT NULL",
+            (lower, lower + chunk_size)
+        ).fetchall()
+
+        deltas = {}
+        for ts_epoch_ms, json_data in rows:
+            try:
+                activity = json.loads(json_data) if json_data else {}
+            except (json.JSONDecodeError, TypeError):
+                activity = {}
+            add_activity(deltas, ts_epoch_ms, activity)
+        apply_deltas(conn, deltas)
+        conn.commit()
+
+        processed += len(rows)
+        lower += chunk_size
+    return processed
+
+def add_heavy_hitters(deltas: Dict[SummaryKey, Dict[str, int]], ts_epoch_ms: int, activity: Dict[str, Any]):
+    """Acumular en memoria las apariciones de IPs de una amenaza nueva"""
+    if threat_level(activity) == 'low':
+        return
+    for dimension, field in HEAVY_HITTER_DIMENSIONS.items():
+        value = activity.get(field)
+        if not value:
+            continue
+        for granularity in HEAVY_HITTER_GRANULARITIES:
+            counts = deltas.setdefault((granularity, bucket_start(ts_epoch_ms, granularity), dimension), {})
+            counts[value] = counts.get(value, 0) + 1
+
+def space_saving_merge(summary: Dict[str, List[int]], counts: Dict[str, int],
+                       capacity: int = HEAVY_HITTER_CAPACITY) -> Tuple[set, set]:
+    """
+    Añadir conteos a un resumen {valor: [conteo, error]} con Space-Saving.
+    Un valor nuevo con el resumen lleno sustituye al de menor conteo y hereda
+    ese conteo como error. Devuelve (valores modificados, valores expulsados).
+    """
+    changed, evicted = set(), set()
+    # Los más frecuentes primero: expulsan menos valores relevantes
+    for value, count in sorted(counts.items(), key=lambda item: item[1], reverse=True):
+        entry = summary.get(value)
+        if entry is not None:
+            entry[0] += count
+        elif len(summary) < capacity:
+            summary[value] = [count, 0]
+        else:
+            victim = min(summary, key=lambda v: summary[v][0])
+            floor = summary.pop(victim)[0]
+            changed.discard(victim)
+            evicted.add(victim)
+            summary[value] = [floor + count, floor]
+        evicted.discard(value)
+        changed.add(value)
+    return changed, evicted
+
+class HeavyHitters:
+    """Resúmenes Space-Saving de los buckets recientes (solo desde el hilo escritor)"""
+
+    def __init__(self, capacity: int = HEAVY_HITTER_CAPACITY):
+        self.capacity = capacity
+        self._summaries: OrderedDict = OrderedDict()
+
+    def reset(self):
+        """Olvidar la caché (tras un lote fallido la BD manda)"""
+        self._summaries.clear()
+
+    def _summary(self, cursor, key: SummaryKey) -> Dict[str, List[int]]:
+        summary = self._summaries.get(key)
+        if summary is None:
+            summary = {value: [count, error] for value, count, error in cursor.execute("""
+            SELECT value, count, error FROM activity_heavy_hitters
+            WHERE granularity = ? AND bucket_ms = ? AND dimension = ?
+            """, key)}
+            self._summaries[key] = summary
+            while len(self._summaries) > HEAVY_HITTER_CACHE:
+                self._summaries.popitem(last=False)
+        else:
+            self._summaries.move_to_end(key)
+        return summary
+
+    def apply(self, cursor, deltas: Dict[SummaryKey, Dict[str, int]]):
+        """Fusionar los conteos del lote y guardar solo las filas que cambian"""
+        upserts, deletes = [], []
+        for key, counts in deltas.items():
+            summary = self._summary(cursor, key)
+            changed, evicted = space_saving_merge(summary, counts, self.capacity)
+            upserts.extend((*key, value, *summary[value]) for value in changed)
+            deletes.extend((*key, value) for value in evicted)
+
+        if deletes:
+            cursor.executemany("""
+            DELETE FROM activity_heavy_hitters
+            WHERE granularity = ? AND bucket_ms = ? AND dimension = ? AND value = ?
+            """, deletes)
+        if upserts:
+            cursor.executemany("""
+            INSERT INTO activity_heavy_hitters (granularity, bucket_ms, dimension, value, count, error)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(granularity, bucket_ms, dimension, value) DO UPDATE SET
+                count = excluded.count, error = excluded.error
+            """, upserts)
+
+def get_heavy_hitters(conn, granularity: str, start_ms: int, end_ms: int, dimension: str,
+                      limit: int = 10, capacity: int = HEAVY_HITTER_CAPACITY) -> List[Dict[str, Any]]:
+    """
+    Top-N de una dimensión en un rango de buckets: [{value, count, error}].
+    count es una cota superior y count - error una inferior del conteo real;
+    con error 0 el conteo es exacto (ningún bucket se llenó).
+    """
+    rows = conn.execute("""
+    SELECT bucket_ms, value, count, error FROM activity_heavy_hitters
+    WHERE granularity = ? AND bucket_ms >= ? AND bucket_ms <= ? AND dimension = ?
+    """, (granularity, start_ms, end_ms, dimension)).fetchall()
+
+    buckets: Dict[int, Dict[str, Tuple[int, int]]] = {}
+    for bucket, value, count, error in rows:
+        buckets.setdefault(bucket, {})[value] = (count, error)
+
+    totals: Dict[str, List[int]] = {}
+    absent_floor = 0  # Cota de cualquier valor ausente: el mínimo de cada bucket lleno
+    for summary in buckets.values():
+        floor = min(count for count, _ in summary.values()) if len(summary) >= capacity else 0
+        absent_floor += floor
+        for value, (count, error) in summary.items():
+            entry = totals.setdefault(value, [0, 0, 0])
+            entry[0] += count
+            entry[1] += error
+            entry[2] += floor
+
+    results = []
+    for value, (count, error, present_floor) in totals.items():
+        # En los buckets llenos donde no aparece pudo tener hasta su mínimo
+        missing = absent_floor - present_floor
+        results.append({'value': value, 'count': count + missing, 'error': error + missing})
+    results.sort(key=lambda item: item['count'], reverse=True)
+    return results[:limit]
+
+def backfill_heavy_hitters(conn: sqlite3.Connection, since_ms: int, chunk_size: int = 5000) -> int:
+    """Reconstruir los resúmenes desde la tabla activities (por bloques de rowid)"""
+    tracker = HeavyHitters()
+    max_id = conn.execute("SELECT MAX(id) FROM activities").fetchone()[0] or 0
+    lower = 0
+    processed = 0
+    while lower <= max_id:
+        rows = conn.execute(
+            "SELECT ts_epoch_ms, status, alert_level, src_ip, dst_ip FROM activities "
+            "WHERE id > ? AND id <= ? AND ts_epoch_ms >= ?",
+            (lower, lower + chunk_size, since_ms)
+        ).fetchall()
+
+        deltas = {}
+        for ts_epoch_ms, status, alert_level, src_ip, dst_ip in rows:
+            add_heavy_hitters(deltas, ts_epoch_ms, {
+                'status': status, 'alert_level': alert_level, 'src_ip': src_ip, 'dst_ip': dst_ip
+            })
+        tracker.apply(conn, deltas)
+        conn.commit()
+
+        processed += len(rows)
+        lower += chunk_size
+    return processed
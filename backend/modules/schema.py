@@ -0,0 +1,535 @@
+"""
+Esquema y migraciones de la base de datos compartida (shield.db).
+La versión aplicada se guarda en PRAGMA user_version para que cada
+migración se ejecute una sola vez, sin importar qué módulo abra la BD.
+"""
+import json
+import logging
+import sqlite3
+
+from modules import rollups, search, message_codec, ip_utils, lookups
+from modules.time_utils import to_epoch_ms, now_epoch_ms, epoch_ms_to_date
+
+logger = logging.getLogger(__name__)
+
+# Tamaño de bloque para migraciones de datos (commits cortos)
+MIGRATION_CHUNK_SIZE = 5000
+
+ACTIVITIES_TABLE = '''
+CREATE TABLE IF NOT EXISTS activities (
+    id INTEGER PRIMARY KEY,
+    activity_id TEXT UNIQUE,
+    timestamp TEXT NOT NULL,
+    ts_epoch_ms INTEGER,
+    message TEXT NOT NULL,
+    source TEXT,
+    status TEXT,
+    alert_level TEXT,
+    threat_score REAL,
+    src_ip TEXT,
+    dst_ip TEXT,
+    service TEXT,
+    action TEXT,
+    device_name TEXT,
+    device_type TEXT,
+    json_data TEXT,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    src_ip_key BLOB,
+    dst_ip_key BLOB,
+    source_id INTEGER,
+    status_id INTEGER,
+    alert_level_id INTEGER,
+    service_id INTEGER,
+    action_id INTEGER,
+    device_type_id INTEGER
+)
+'''
+
+DAILY_STATS_TABLE = '''
+CREATE TABLE IF NOT EXISTS daily_stats (
+    id INTEGER PRIMARY KEY,
+    date TEXT UNIQUE,
+    high_threats INTEGER DEFAULT 0,
+    medium_threats INTEGER DEFAULT 0,
+    low_threats INTEGER DEFAULT 0,
+    total_logs INTEGER DEFAULT 0,
+    json_data TEXT,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+)
+'''
+
+ROLLUPS_TABLE = '''
+CREATE TABLE IF NOT EXISTS activity_rollups (
+    granularity TEXT NOT NULL,
+    bucket_ms INTEGER NOT NULL,
+    dimension TEXT NOT NULL,
+    value TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (granularity, bucket_ms, dimension, value)
+) WITHOUT ROWID
+'''
+
+# Resúmenes Space-Saving de IPs de amenazas por bucket (count es cota superior)
+HEAVY_HITTERS_TABLE = '''
+CREATE TABLE IF NOT EXISTS activity_heavy_hitters (
+    granularity TEXT NOT NULL,
+    bucket_ms INTEGER NOT NULL,
+    dimension TEXT NOT NULL,
+    value TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    error INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (granularity, bucket_ms, dimension, value)
+) WITHOUT ROWID
+'''
+
+# Última posición del spool de escritura confirmada junto con las filas
+SPOOL_STATE_TABLE = '''
+CREATE TABLE IF NOT EXISTS spool_state (
+    name TEXT PRIMARY KEY,
+    segment INTEGER NOT NULL,
+    byte_offset INTEGER NOT NULL
+)
+'''
+
+# Manifiesto de segmentos columnares en frío (un archivo .npz por fila)
+COLD_SEGMENTS_TABLE = '''
+CREATE TABLE IF NOT EXISTS cold_segments (
+    name TEXT PRIMARY KEY,
+    start_ms INTEGER NOT NULL,
+    end_ms INTEGER NOT NULL,
+    rows INTEGER NOT NULL,
+    bytes INTEGER NOT NULL,
+    created_at INTEGER NOT NULL
+)
+'''
+
+def _fts_table(content: str) -> str:
+    """
+    Índice de texto completo con contenido externo.
+    tokenchars mantiene IPs y nombres de host como un solo token (192.168.1.5)
+    """
+    return f'''
+    CREATE VIRTUAL TABLE IF NOT EXISTS activities_fts USING fts5(
+        {', '.join(search.FTS_COLUMNS)},
+        content='{content}',
+        content_rowid='id',
+        tokenize="unicode61 remove_diacritics 2 tokenchars '.-_'"
+    )
+    '''
+
+# v3-v9: contenido leído directamente de activities
+FTS_TABLE = _fts_table('activities')
+
+# Los borrados (retención por bloques) se reflejan en el índice con un trigger.
+# message puede estar comprimido: message_text() (MessageCodec.register) devuelve
+# el texto indexado, así que los borrados deben hacerse desde conexiones del motor
+FTS_DELETE_TRIGGER = f'''
+CREATE TRIGGER IF NOT EXISTS activities_fts_delete AFTER DELETE ON activities BEGIN
+    INSERT INTO activities_fts(activities_fts, rowid, {', '.join(search.FTS_COLUMNS)})
+    VALUES ('delete', old.id, {', '.join(
+        'message_text(old.message)' if c == 'message' else 'old.' + c for c in search.FTS_COLUMNS
+    )});
+END
+'''
+
+# Valores de las columnas de baja cardinalidad (ver lookups.py)
+VALUE_LOOKUPS_TABLE = '''
+CREATE TABLE IF NOT EXISTS value_lookups (
+    id INTEGER PRIMARY KEY,
+    field TEXT NOT NULL,
+    value TEXT NOT NULL,
+    UNIQUE (field, value)
+)
+'''
+
+# Desde v10 el índice lee su contenido de esta vista: el texto de los campos
+# codificados y el mensaje descomprimido (message_text)
+ACTIVITIES_TEXT_VIEW = f'''
+CREATE VIEW IF NOT EXISTS activities_text AS
+SELECT id, {', '.join(
+    'message_text(message) AS message' if c == 'message' else lookups.select_sql(c) for c in search.FTS_COLUMNS
+)}
+FROM activities
+'''
+
+FTS_VIEW_TABLE = _fts_table('activities_text')
+
+FTS_LOOKUP_DELETE_TRIGGER = f'''
+CREATE TRIGGER IF NOT EXISTS activities_fts_delete AFTER DELETE ON activities BEGIN
+    INSERT INTO activities_fts(activities_fts, rowid, {', '.join(search.FTS_COLUMNS)})
+    VALUES ('delete', old.id, {', '.join(
+        'message_text(old.message)' if c == 'message'
+        else lookups.value_sql(c, 'old.') if c in lookups.LOOKUP_FIELDS
+        else 'old.' + c for c in search.FTS_COLUMNS
+    )});
+END
+'''
+
+# Diccionarios zlib de los mensajes; cada valor comprimido lleva su versión
+MESSAGE_DICTIONARIES_TABLE = '''
+CREATE TABLE IF NOT EXISTS message_dictionaries (
+    version INTEGER PRIMARY KEY,
+    dictionary BLOB NOT NULL,
+    sample_size INTEGER NOT NULL,
+    ratio REAL,
+    created_at INTEGER NOT NULL
+)
+'''
+
+# Posición de cada sensor remoto ya fusionada en el nodo agregador
+FEDERATION_CURSORS_TABLE = '''
+CREATE TABLE IF NOT EXISTS federation_cursors (
+    sensor TEXT PRIMARY KEY,
+    last_id INTEGER NOT NULL DEFAULT 0,
+    last_ts_epoch_ms INTEGER,
+    rows_merged INTEGER NOT NULL DEFAULT 0,
+    updated_at TEXT
+)
+'''
+
+def _column_exists(conn: sqlite3.Connection, table: str, column: str) -> bool:
+    """Comprobar si una columna existe en una tabla"""
+    return any(row[1] == column for row in conn.execute(f"PRAGMA table_info({table})"))
+
+def _migration_epoch_timestamps(conn: sqlite3.Connection):
+    """v1: columna INTEGER ts_epoch_ms indexada y rellenada desde timestamp"""
+    if not _column_exists(conn, 'activities', 'ts_epoch_ms'):
+        conn.execute("ALTER TABLE activities ADD COLUMN ts_epoch_ms INTEGER")
+        conn.commit()
+
+    # Rellenar por bloques de rowid para no retener el lock de escritura
+    conn.create_function('to_epoch_ms', 1, to_epoch_ms, deterministic=True)
+    max_id = conn.execute("SELECT MAX(id) FROM activities").fetchone()[0] or 0
+    lower = 0
+    updated = 0
+    while lower <= max_id:
+        cursor = conn.execute(
+            "UPDATE activities SET ts_epoch_ms = to_epoch_ms(timestamp) "
+            "WHERE id > ? AND id <= ? AND ts_epoch_ms IS NULL",
+            (lower, lower + MIGRATION_CHUNK_SIZE)
+        )
+        conn.commit()
+        updated += max(cursor.rowcount, 0)
+        lower += MIGRATION_CHUNK_SIZE
+
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_ts_epoch_status ON activities(ts_epoch_ms, status)")
+    # Los índices sobre timestamp TEXT ya no se usan en filtros de rango
+    conn.execute("DROP INDEX IF EXISTS idx_timestamp")
+    conn.execute("DROP INDEX IF EXISTS idx_timestamp_status")
+    conn.commit()
+
+    if updated:
+        logger.info(f"Backfilled ts_epoch_ms for {updated} activities")
+
+def _migration_rollups(conn: sqlite3.Connection):
+    """v2: agregados por minuto/hora/día mantenidos al escribir"""
+    conn.execute(ROLLUPS_TABLE)
+    conn.execute("DELETE FROM activity_rollups")
+    conn.commit()
+
+    processed = rollups.backfill(conn, MIGRATION_CHUNK_SIZE)
+    if processed:
+        logger.info(f"Built rollups from {processed} existing activities")
+
+def _migration_fulltext(conn: sqlite3.Connection):
+    """v3: índice FTS5 sobre message y campos de texto clave"""
+    conn.execute(FTS_TABLE)
+    conn.execute(FTS_DELETE_TRIGGER)
+    conn.execute("INSERT INTO activities_fts(activities_fts) VALUES ('rebuild')")
+    conn.commit()
+
+# Índices derivados de las consultas reales del motor (ver check_query_plans.py):
+# rango de tiempo, estado/origen/IP + tiempo. La igualdad va delante de ts_epoch_ms
+# para servir ORDER BY ts_epoch_ms DESC sin B-tree temporal; las columnas finales
+# hacen que los conteos por origen y el top de IPs no toquen la tabla
+QUERY_INDEXES = {
+    'idx_ts_epoch_status': 'activities(ts_epoch_ms, status)',
+    'idx_status_ts': 'activities(status, ts_epoch_ms)',
+    'idx_source_ts_status': 'activities(source, ts_epoch_ms, status)',
+    'idx_src_ip_ts_status': 'activities(src_ip, ts_epoch_ms, status)',
+}
+
+def _migration_query_indexes(conn: sqlite3.Connection):
+    """v4: índices compuestos por forma de consulta, sin duplicados"""
+    for name, definition in QUERY_INDEXES.items():
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {definition}")
+    # Cubiertos por los compuestos (prefijo) o por las restricciones UNIQUE
+    conn.execute("DROP INDEX IF EXISTS idx_status")
+    conn.execute("DROP INDEX IF EXISTS idx_source")
+    conn.execute("DROP INDEX IF EXISTS idx_activity_id")
+    conn.execute("DROP INDEX IF EXISTS idx_stats_date")
+    conn.commit()
+    # Estadísticas para que el planificador elija entre índices con filtros combinados
+    conn.execute("PRAGMA optimize")
+
+def _migration_spool_state(conn: sqlite3.Connection):
+    """v5: posición confirmada del spool de escritura en disco"""
+    conn.execute(SPOOL_STATE_TABLE)
+    conn.commit()
+
+def _migration_cold_segments(conn: sqlite3.Connection):
+    """v6: manifiesto de segmentos columnares de actividades antiguas"""
+    conn.execute(COLD_SEGMENTS_TABLE)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_cold_segments_end ON cold_segments(end_ms)")
+    conn.commit()
+
+def _migration_message_codec(conn: sqlite3.Connection):
+    """v7: message comprimido con diccionario zlib versionado, sin copia en json_data"""
+    conn.execute(MESSAGE_DICTIONARIES_TABLE)
+    codec = message_codec.MessageCodec()
+    codec.register(conn)
+    conn.execute("DROP TRIGGER IF EXISTS activities_fts_delete")
+    conn.execute(FTS_DELETE_TRIGGER)
+    codec.load(conn)
+    conn.commit()
+
+    # Con pocos mensajes el motor entrena el diccionario más adelante
+    if codec.version is None and codec.train(conn) is None:
+        conn.commit()
+        return
+    conn.commit()
+
+    # Recomprimir por bloques de rowid y quitar el mensaje duplicado de json_data
+    max_id = conn.execute("SELECT MAX(id) FROM activities").fetchone()[0] or 0
+    lower = 0
+    while lower <= max_id:
+        rows = conn.execute(
+            "SELECT id, message, json_data FROM activities WHERE id > ? AND id <= ?",
+            (lower, lower + MIGRATION_CHUNK_SIZE)
+        ).fetchall()
+
+        updates = []
+        for row_id, message, json_data in rows:
+            try:
+                data = json.loads(json_data) if json_data else None
+            except (json.JSONDecodeError, TypeError):
+                data = None
+            if isinstance(data, dict) and 'message' in data:
+                del data['message']
+                json_data = json.dumps(data, separators=(',', ':'), default=str)
+            updates.append((codec.encode(codec.decode(message) or ''), json_data, row_id))
+
+        conn.executemany("UPDATE activities SET message = ?, json_data = ? WHERE id = ?", updates)
+        conn.commit()
+        lower += MIGRATION_CHUNK_SIZE
+
+    metrics = codec.get_metrics()
+    if metrics['encoded']:
+        logger.info(f"Compressed {metrics['encoded']} stored messages ({metrics['ratio']}x)")
+
+def _migration_heavy_hitters(conn: sqlite3.Connection):
+    """v8: top-K de IPs de origen y destino de amenazas por hora y día"""
+    conn.execute(HEAVY_HITTERS_TABLE)
+    conn.execute("DELETE FROM activity_heavy_hitters")
+    conn.commit()
+
+    since_ms = now_epoch_ms() - rollups.ROLLUP_RETENTION_DAYS['day'] * rollups.GRANULARITIES['day']
+    processed = rollups.backfill_heavy_hitters(conn, since_ms, MIGRATION_CHUNK_SIZE)
+    if processed:
+        logger.info(f"Backfilled threat heavy hitters from {processed} activities")
+
+# Rangos CIDR sobre las claves de ip_utils; ts_epoch_ms y status detrás, como en
+# los demás índices, para ordenar una IP concreta por tiempo y contar sin la tabla
+IP_KEY_INDEXES = {
+    'idx_src_ip_key_ts_status': 'activities(src_ip_key, ts_epoch_ms, status)',
+    'idx_dst_ip_key_ts_status': 'activities(dst_ip_key, ts_epoch_ms, status)',
+}
+
+def _migration_ip_keys(conn: sqlite3.Connection):
+    """v9: IPs de origen y destino como claves BLOB ordenables e indexadas"""
+    for column in ('src_ip_key', 'dst_ip_key'):
+        if not _column_exists(conn, 'activities', column):
+            conn.execute(f"ALTER TABLE activities ADD COLUMN {column} BLOB")
+    conn.commit()
+
+    conn.create_function('ip_key', 1, ip_utils.ip_key, deterministic=True)
+    max_id = conn.execute("SELECT MAX(id) FROM activities").fetchone()[0] or 0
+    lower = 0
+    while lower <= max_id:
+        conn.execute(
+            "UPDATE activities SET src_ip_key = ip_key(src_ip), dst_ip_key = ip_key(dst_ip) "
+            "WHERE id > ? AND id <= ?",
+            (lower, lower + MIGRATION_CHUNK_SIZE)
+        )
+        conn.commit()
+        lower += MIGRATION_CHUNK_SIZE
+
+    for name, definition in IP_KEY_INDEXES.items():
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {definition}")
+    # La igualdad de IP se resuelve ahora con la clave
+    conn.execute("DROP INDEX IF EXISTS idx_src_ip_ts_status")
+    conn.commit()
+    conn.execute("PRAGMA optimize")
+
+# Mismos índices que v4/v9 sobre los códigos enteros
+LOOKUP_INDEXES = {
+    'idx_ts_status_id': 'activities(ts_epoch_ms, status_id)',
+    'idx_status_id_ts': 'activities(status_id, ts_epoch_ms)',
+    'idx_source_id_ts_status': 'activities(source_id, ts_epoch_ms, status_id)',
+    'idx_src_ip_key_ts_status_id': 'activities(src_ip_key, ts_epoch_ms, status_id)',
+    'idx_dst_ip_key_ts_status_id': 'activities(dst_ip_key, ts_epoch_ms, status_id)',
+}
+
+def _migration_lookup_columns(conn: sqlite3.Connection):
+    """v10: columnas de baja cardinalidad como códigos enteros de value_lookups"""
+    conn.execute(VALUE_LOOKUPS_TABLE)
+    for field in lookups.LOOKUP_FIELDS:
+        if not _column_exists(conn, 'activities', f"{field}_id"):
+            conn.execute(f"ALTER TABLE activities ADD COLUMN {field}_id INTEGER")
+    conn.commit()
+
+    # Alta de los valores y códigos de cada bloque de rowid
+    max_id = conn.execute("SELECT MAX(id) FROM activities").fetchone()[0] or 0
+    lower = 0
+    while lower <= max_id:
+        bounds = (lower, lower + MIGRATION_CHUNK_SIZE)
+        for field in lookups.LOOKUP_FIELDS:
+            conn.execute(f"""
+            INSERT OR IGNORE INTO value_lookups (field, value)
+            SELECT DISTINCT '{field}', {field} FROM activities
+            WHERE id > ? AND id <= ? AND {field} IS NOT NULL
+            """, bounds)
+        assignments = ', '.join(
+            f"{field}_id = (SELECT id FROM value_lookups WHERE field = '{field}' AND value = {field})"
+            for field in lookups.LOOKUP_FIELDS
+        )
+        conn.execute(f"UPDATE activities SET {assignments} WHERE id > ? AND id <= ?", bounds)
+
+        # json_data deja de repetir los valores que ya guarda la columna
+        updates = []
+        for row_id, json_data, *values in conn.execute(
+                f"SELECT id, json_data, {', '.join(lookups.LOOKUP_FIELDS)} FROM activities WHERE id > ? AND id <= ?",
+                bounds).fetchall():
+            try:
+                data = json.loads(json_data) if json_data else None
+            except (json.JSONDecodeError, TypeError):
+                data = None
+            if not isinstance(data, dict):
+                continue
+            columns = dict(zip(lookups.LOOKUP_FIELDS, values))
+            stripped = {key: value for key, value in data.items()
+                        if not (lookups.is_stored_in_column(key, value) and value == columns[key])}
+            if len(stripped) < len(data):
+                updates.append((json.dumps(stripped, separators=(',', ':'), default=str), row_id))
+        conn.executemany("UPDATE activities SET json_data = ? WHERE id = ?", updates)
+        conn.commit()
+        lower += MIGRATION_CHUNK_SIZE
+
+    for name, definition in LOOKUP_INDEXES.items():
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {definition}")
+    # Cualquier índice sobre las columnas de texto (DROP COLUMN no los admite)
+    for (name,) in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'activities' AND sql IS NOT NULL"
+    ).fetchall():
+        indexed = {row[2] for row in conn.execute(f"PRAGMA index_info({name})")}
+        if indexed & set(lookups.LOOKUP_FIELDS):
+            conn.execute(f"DROP INDEX {name}")
+    conn.commit()
+
+    # El índice de texto pasa a leer la vista (necesita message_text en la conexión)
+    codec = message_codec.MessageCodec()
+    codec.register(conn)
+    codec.load(conn)
+    conn.execute("DROP TRIGGER IF EXISTS activities_fts_delete")
+    conn.execute("DROP TABLE IF EXISTS activities_fts")
+    conn.execute(ACTIVITIES_TEXT_VIEW)
+    conn.execute(FTS_VIEW_TABLE)
+    conn.execute(FTS_LOOKUP_DELETE_TRIGGER)
+    conn.execute("INSERT INTO activities_fts(activities_fts) VALUES ('rebuild')")
+    conn.commit()
+
+    # Quitar las columnas de texto (reescribe la tabla); sin DROP COLUMN
+    # (SQLite < 3.35) se vacían y dejan de ocupar espacio en cada fila
+    if sqlite3.sqlite_version_info >= (3, 35, 0):
+        for field in lookups.LOOKUP_FIELDS:
+            conn.execute(f"ALTER TABLE activities DROP COLUMN {field}")
+    else:
+        conn.execute(f"UPDATE activities SET {', '.join(f'{field} = NULL' for field in lookups.LOOKUP_FIELDS)}")
+    conn.commit()
+    conn.execute("PRAGMA optimize")
+
+def _migration_federation_cursors(conn: sqlite3.Connection):
+    """v11: cursores incrementales de los sensores remotos del nodo agregador"""
+    conn.execute(FEDERATION_CURSORS_TABLE)
+    conn.commit()
+
+def _migration_daily_stats_backfill(conn: sqlite3.Connection):
+    """
+    v12: recalcular daily_stats desde activities. El escritor solo suma los
+    lotes nuevos, así que una BD anterior conservaba sus totales viejos (o
+    ninguno). Los días con actividades se reescriben con el conteo exacto,
+    agrupando por la fecha local del escritor (epoch_ms_to_date). Los días
+    ya archivados en frío, incluido el del corte, conservan su fila: sus
+    actividades ya no están todas en la tabla.
+    """
+    conn.create_function('local_date', 1, epoch_ms_to_date, deterministic=True)
+    cold_end = conn.execute("SELECT MAX(end_ms) FROM cold_segments").fetchone()[0]
+    after_date = epoch_ms_to_date(cold_end) if cold_end is not None else ''
+    conn.execute(f"""
+    INSERT INTO daily_stats (date, high_threats, medium_threats, low_threats, total_logs, json_data)
+    SELECT day, high, medium, total - high - medium, total, json_object(
+        'date', day, 'high_threats', high, 'medium_threats', medium,
+        'low_threats', total - high - medium, 'total_logs', total)
+    FROM (
+        SELECT local_date(ts_epoch_ms) AS day,
+               SUM(status_id = {lookups.code_sql('status', 'high')}) AS high,
+               SUM(status_id = {lookups.code_sql('status', 'medium')}) AS medium,
+               COUNT(*) AS total
+        FROM activities
+        WHERE ts_epoch_ms IS NOT NULL
+        GROUP BY day
+    )
+    WHERE day > ?
+    ON CONFLICT(date) DO UPDATE SET
+        high_threats = excluded.high_threats,
+        medium_threats = excluded.medium_threats,
+        low_threats = excluded.low_threats,
+        total_logs = excluded.total_logs,
+        json_data = excluded.json_data
+    """, (after_date,))
+    rebuilt = conn.execute("SELECT changes()").fetchone()[0]
+    conn.commit()
+    if rebuilt:
+        logger.info(f"Rebuilt daily stats for {rebuilt} days from existing activities")
+
+# Migraciones en orden: (versión, función)
+MIGRATIONS = [
+    (1, _migration_epoch_timestamps),
+    (2, _migration_rollups),
+    (3, _migration_fulltext),
+    (4, _migration_query_indexes),
+    (5, _migration_spool_state),
+    (6, _migration_cold_segments),
+    (7, _migration_message_codec),
+    (8, _migration_heavy_hitters),
+    (9, _migration_ip_keys),
+    (10, _migration_lookup_columns),
+    (11, _migration_federation_cursors),
+    (12, _migration_daily_stats_backfill),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def ensure_schema(conn: sqlite3.Connection, target_version: int = SCHEMA_VERSION) -> int:
+    """Crear tablas y aplicar migraciones pendientes. Devuelve la versión final."""
+    conn.execute(ACTIVITIES_TABLE)
+    conn.execute(DAILY_STATS_TABLE)
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version < 4:
+        # Índices base de las versiones anteriores (la v4 los sustituye)
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_status ON activities(status)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_source ON activities(source)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_activity_id ON activities(activity_id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_stats_date ON daily_stats(date)')
+    conn.commit()
+
+    for target, migration in MIGRATIONS:
+        if version >= target or target > target_version:
+            continue
+        logger.info(f"Applying database migration v{target}: {migration.__doc__}")
+        migration(conn)
+        conn.execute(f"PRAGMA user_version = {target}")
+        conn.commit()
+        version = target
+
+    return version
@@ -0,0 +1,182 @@
+"""
+Búsqueda de texto completo sobre el historial de actividades (SQLite FTS5).
+El índice activities_fts lee su contenido externo de la vista
+activities_text (texto de los campos codificados y mensaje descomprimido):
+el hilo escritor añade las filas nuevas dentro del mismo lote y un trigger
+retira las filas borradas por la retención. El mensaje puede estar
+comprimido: las conexiones deben tener registrada message_text().
+"""
+import re
+import json
+import base64
+import logging
+from typing import Dict, List, Any, Optional, Tuple
+
+from modules import lookups
+
+logger = logging.getLogger(__name__)
+
+# Columnas indexadas (mismo orden que la tabla virtual)
+FTS_COLUMNS = ('message', 'source', 'src_ip', 'dst_ip', 'service', 'action', 'device_name')
+
+# Pesos bm25 por columna: las IPs y el origen pesan más que el texto libre
+FTS_WEIGHTS = (1.0, 2.0, 3.0, 3.0, 1.5, 1.5, 1.5)
+
+# Prefijos de búsqueda "campo:valor" que apuntan a columnas del índice
+FIELD_COLUMNS = {
+    'source': ('source',),
+    'origen': ('source',),
+    'ip': ('src_ip', 'dst_ip'),
+    'srcip': ('src_ip',),
+    'dstip': ('dst_ip',),
+    'service': ('service',),
+    'action': ('action',),
+    'device': ('device_name',),
+}
+
+# Prefijos que filtran por estado en la tabla activities
+STATUS_FIELDS = ('severity', 'status')
+STATUS_VALUES = ('high', 'medium', 'low')
+
+SEARCH_MAX_LIMIT = 100
+
+_TERM_RE = re.compile(r'(?:(\w+):)?("[^"]*"|\S+)')
+
+def fts_row(rowid: int, row: Tuple) -> Tuple:
+    """Fila para activities_fts a partir de la fila normalizada de activities"""
+    # row: activity_id, timestamp, ts_epoch_ms, message, source, status, alert_level,
+    #      threat_score, src_ip, dst_ip, service, action, device_name, ...
+    return (rowid, row[3], row[4], row[8], row[9], row[10], row[11], row[12])
+
+def _quote(term: str) -> str:
+    """Término FTS5 entre comillas (sin operadores del usuario) con prefijo"""
+    term = term.strip('"').replace('"', '""')
+    return f'"{term}"*' if term else ''
+
+def _hours(value: str) -> Optional[float]:
+    """Convertir "1h", "7d" o "30" (horas) a horas"""
+    match = re.fullmatch(r'(\d+)([hd]?)', value.lower())
+    if not match:
+        return None
+    amount = int(match.group(1))
+    return amount * 24 if match.group(2) == 'd' else amount
+
+def parse_query(text: str) -> Tuple[str, Dict[str, Any]]:
+    """
+    Convertir la consulta del usuario en una expresión MATCH segura.
+    Admite "campo:valor" (source, ip, service, action, device),
+    severity/status:high|medium|low como filtro de estado y time:1h|7d.
+    Devuelve (expresión MATCH, filtros adicionales).
+    """
+    clauses = []
+    filters: Dict[str, Any] = {}
+
+    for field, value in _TERM_RE.findall(text or ''):
+        field = field.lower()
+        quoted = _quote(value)
+        if not quoted:
+            continue
+
+        if field in STATUS_FIELDS and value.lower() in STATUS_VALUES:
+            filters['status'] = value.lower()
+        elif field == 'time' and _hours(value):
+            filters['hours'] = _hours(value)
+        elif field in FIELD_COLUMNS:
+            columns = FIELD_COLUMNS[field]
+            column_set = columns[0] if len(columns) == 1 else '{' + ' '.join(columns) + '}'
+            clauses.append(f'{column_set} : {quoted}')
+        else:
+            # Sin prefijo o prefijo desconocido (protocol:icmp): término en cualquier columna
+            clauses.append(quoted)
+
+    return ' AND '.join(clauses), filters
+
+def encode_cursor(values: List[Any]) -> str:
+    """Cursor opaco para la siguiente página"""
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor: Optional[str]) -> Optional[List[Any]]:
+    """Decodificar un cursor (None si no es válido)"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return values if isinstance(values, list) and len(values) == 2 else None
+    except (ValueError, TypeError):
+        return None
+
+def search(conn, text: str, start_ms: int, end_ms: int, limit: int = 50,
+           cursor: Optional[str] = None, sort: str = 'rank',
+           status_filter: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Buscar actividades en un rango de tiempo.
+    sort='rank' ordena por relevancia bm25 y sort='time' por fecha descendente;
+    la paginación es por cursor (keyset), sin OFFSET. La puntuación bm25
+    depende del tamaño del índice, así que con sort='rank' las páginas
+    pueden desplazarse si entran filas nuevas entre peticiones.
+    """
+    match, filters = parse_query(text)
+    status_filter = status_filter or filters.get('status')
+    if 'hours' in filters:
+        start_ms = max(start_ms, end_ms - int(filters['hours'] * 3600 * 1000))
+    if not match:
+        return {'data': [], 'next_cursor': None, 'count': 0}
+
+    limit = max(1, min(limit, SEARCH_MAX_LIMIT))
+    weights = ', '.join(str(w) for w in FTS_WEIGHTS)
+
+    where = ["a.ts_epoch_ms >= ?", "a.ts_epoch_ms <= ?"]
+    params: List[Any] = [match, start_ms, end_ms]
+
+    if status_filter:
+        where.append(lookups.filter_sql('status', 'a.'))
+        params.append(status_filter)
+
+    position = decode_cursor(cursor)
+    if sort == 'time':
+        order_by = "a.ts_epoch_ms DESC, a.id DESC"
+        if position:
+            where.append("(a.ts_epoch_ms < ? OR (a.ts_epoch_ms = ? AND a.id < ?))")
+            params.extend([position[0], position[0], position[1]])
+    else:
+        order_by = "h.score, a.id"
+        if position:
+            where.append("(h.score > ? OR (h.score = ? AND a.id > ?))")
+            params.extend([position[0], position[0], position[1]])
+
+    params.append(limit + 1)
+    rows = conn.execute(f"""
+    WITH hits AS (
+        SELECT rowid AS id, bm25(activities_fts, {weights}) AS score
+        FROM activities_fts
+        WHERE activities_fts MATCH ?
+    )
+    SELECT a.id, a.ts_epoch_ms, h.score, a.json_data, message_text(a.message),
+           {', '.join(lookups.select_sql(field, 'a.') for field in lookups.LOOKUP_FIELDS)}
+    FROM hits h JOIN activities a ON a.id = h.id
+    WHERE {' AND '.join(where)}
+    ORDER BY {order_by}
+    LIMIT ?
+    """, params).fetchall()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    results = []
+    for row_id, ts_epoch_ms, score, json_data, message, *fields in rows:
+        try:
+            activity = json.loads(json_data)
+        except (json.JSONDecodeError, TypeError):
+            continue
+        activity.setdefault('message', message)
+        lookups.restore(activity, fields)
+        activity['score'] = round(-score, 4)
+        results.append(activity)
+
+    next_cursor = None
+    if has_more and rows:
+        last_id, last_ts, last_score = rows[-1][0], rows[-1][1], rows[-1][2]
+        next_cursor = encode_cursor([last_ts, last_id] if sort == 'time' else [last_score, last_id])
+
+    return {'data': results, 'next_cursor': next_cursor, 'count': len(results)}
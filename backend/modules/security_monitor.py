@@ -14,6 +14,9 @@ import hashlib
 import sqlite3
 from pathlib import Path
 
+from modules.time_utils import TIMEZONE, now_epoch_ms
+from modules.ip_utils import is_local_ip
+
 logger = logging.getLogger(__name__)
 
 class SecurityMonitor:
@@ -59,7 +62,7 @@ class SecurityMonitor:
     def get_country_from_ip(self, ip: str) -> str:
         """Obtener país de una IP usando un servicio gratuito"""
         try:
-            if ip.startswith('127.') or ip.startswith('192.168.') or ip.startswith('10.') or ip == '::1':
+            if is_local_ip(ip):
                 return 'Local'
             
             # Usar ipapi.co para geolocalización
@@ -165,8 +168,7 @@ class SecurityMonitor:
                     risk_level = 'LOW'
                     
                     # IPs externas no conocidas
-                    if not (remote_ip.startswith('192.168.') or remote_ip.startswith('10.') or 
-                           remote_ip.startswith('127.') or remote_ip.startswith('172.16.')):
+                    if not is_local_ip(remote_ip):
                         
                         # Puertos sospechosos
                         if remote_port in self.high_risk_ports or remote_port > 8000:
@@ -385,151 +387,93 @@ class SecurityMonitor:
             logger.error(f"Error blocking IP {ip}: {e}")
             return False
 
+    def _empty_log_analysis(self) -> Dict[str, Any]:
+        """Estructura vacía del análisis de logs"""
+        return {
+            'total_logs_today': 0,
+            'total_logs_week': 0,
+            'threat_distribution': {'low': 0, 'medium': 0, 'high': 0},
+            'protocol_analysis': {},
+            'denial_rate': 0.0,
+            'top_threat_sources': {},
+            'top_threat_destinations': {},
+            'hourly_trend': [],
+            'weekly_trend': [],
+            'geographic_threats': {},
+            'threat_escalation': 0.0
+        }
+
     def analyze_logs_for_security(self) -> Dict[str, Any]:
-        """Analizar logs reales del sistema para generar métricas de seguridad"""
+        """
+        Analizar logs reales del sistema para generar métricas de seguridad.
+        Lee los rollups materializados (decenas de filas) en lugar de recorrer
+        las actividades, por lo que los totales son exactos para toda la semana.
+        """
         try:
-            # Importar el gestor de DB para obtener actividades reales
-            from modules.optimized_db_manager import get_paginated_activities, get_activity_statistics
-            
-            # Obtener actividades de los últimos 7 días
-            week_result = get_paginated_activities(page=1, limit=1000)
-            
-            # Análisis de logs en tiempo real
-            analysis = {
-                'total_logs_today': 0,
-                'total_logs_week': 0,
-                'threat_distribution': {'low': 0, 'medium': 0, 'high': 0},
-                'protocol_analysis': {},
-                'denial_rate': 0.0,
-                'top_threat_sources': {},
-                'hourly_trend': [],
-                'weekly_trend': [],
-                'geographic_threats': {},
-                'threat_escalation': 0.0
-            }
-            
-            # week_result es una tupla (activities, total, page)
-            if week_result and len(week_result) > 0:
-                activities = week_result[0]  # Primer elemento es la lista de actividades
-                
-                # Contar logs por día y por threat level
-                from datetime import datetime, timedelta
-                now = datetime.now()
-                today = now.date()
-                
-                for activity in activities:
-                    try:
-                        # Clasificar por nivel de amenaza
-                        status = activity.get('status', 'low').lower()
-                        threat_level = activity.get('alert_level', 'LOW').lower()
-                        
-                        # Normalizar niveles de amenaza
-                        if threat_level in ['critical', 'high'] or status == 'high':
-                            analysis['threat_distribution']['high'] += 1
-                        elif threat_level in ['medium', 'warning'] or status == 'medium':
-                            analysis['threat_distribution']['medium'] += 1
-                        else:
-                            analysis['threat_distribution']['low'] += 1
-                        
-                        # Contar logs totales
-                        analysis['total_logs_week'] += 1
-                        
-                        # Verificar si es de hoy
-                        try:
-                            log_date = datetime.fromisoformat(activity.get('timestamp', '')).date()
-                            if log_date == today:
-                                analysis['total_logs_today'] += 1
-                        except:
-                            pass
-                        
-                        # Análisis geográfico
-                        country = activity.get('country', activity.get('dst_country', 'Unknown'))
-                        if country and country != 'Unknown':
-                            analysis['geographic_threats'][country] = analysis['geographic_threats'].get(country, 0) + 1
-                        
-                        # Análisis de protocolos
-                        protocol = activity.get('protocol', 'Unknown')
-                        if protocol and protocol != 'Unknown':
-                            analysis['protocol_analysis'][protocol] = analysis['protocol_analysis'].get(protocol, 0) + 1
-                        
-                        # Top threat sources
-                        src_ip = activity.get('src_ip', activity.get('ip_address', 'Unknown'))
-                        if src_ip and src_ip != 'Unknown' and status in ['medium', 'high']:
-                            analysis['top_threat_sources'][src_ip] = analysis['top_threat_sources'].get(src_ip, 0) + 1
-                            
-                    except Exception as e:
-                        continue
-                
-                # Generar tendencia horaria (últimas 24 horas)
-                hours_data = {}
-                for activity in activities:
-                    try:
-                        timestamp = datetime.fromisoformat(activity.get('timestamp', ''))
-                        if (now - timestamp).days == 0:  # Solo hoy
-                            hour = timestamp.hour
-                            status = activity.get('status', 'low').lower()
-                            
-                            if hour not in hours_data:
-                                hours_data[hour] = {'hour': hour, 'normal': 0, 'threats': 0, 'total': 0}
-                            
-                            hours_data[hour]['total'] += 1
-                            if status in ['medium', 'high']:
-                                hours_data[hour]['threats'] += 1
-                            else:
-                                hours_data[hour]['normal'] += 1
-                    except:
-                        continue
-                
-                analysis['hourly_trend'] = list(hours_data.values())
-                
-                # Generar tendencia semanal (últimos 7 días)
-                days_data = {}
-                for i in range(7):
-                    day = (now - timedelta(days=i)).date()
-                    days_data[day] = {'date': day.strftime('%m-%d'), 'normal': 0, 'threats': 0, 'total': 0}
-                
-                for activity in activities:
-                    try:
-                        timestamp = datetime.fromisoformat(activity.get('timestamp', ''))
-                        day = timestamp.date()
-                        
-                        if day in days_data:
-                            status = activity.get('status', 'low').lower()
-                            days_data[day]['total'] += 1
-                            
-                            if status in ['medium', 'high']:
-                                days_data[day]['threats'] += 1
-                            else:
-                                days_data[day]['normal'] += 1
-                    except:
-                        continue
-                
-                analysis['weekly_trend'] = list(days_data.values())
-                
-                # Calcular tasa de denegación y escalación
-                total_threats = analysis['threat_distribution']['medium'] + analysis['threat_distribution']['high']
-                total_logs = analysis['total_logs_week']
-                
-                if total_logs > 0:
-                    analysis['denial_rate'] = (total_threats / total_logs) * 100
-                    analysis['threat_escalation'] = (analysis['threat_distribution']['high'] / max(total_logs, 1)) * 100
-            
+            from modules.optimized_db_manager import optimized_db
+            from modules.rollups import bucket_start, GRANULARITIES
+
+            analysis = self._empty_log_analysis()
+
+            now_ms = now_epoch_ms()
+            today_ms = bucket_start(now_ms, 'day')
+            week_start_ms = bucket_start(now_ms - 6 * GRANULARITIES['day'], 'day')
+
+            # Totales de la semana y de hoy
+            analysis['total_logs_week'] = optimized_db.get_rollup_totals('day', week_start_ms, now_ms, 'total').get('', 0)
+            analysis['total_logs_today'] = optimized_db.get_rollup_totals('day', today_ms, now_ms, 'total').get('', 0)
+
+            threats = optimized_db.get_rollup_totals('day', week_start_ms, now_ms, 'threat')
+            for level in analysis['threat_distribution']:
+                analysis['threat_distribution'][level] = threats.get(level, 0)
+
+            analysis['protocol_analysis'] = optimized_db.get_rollup_totals('day', week_start_ms, now_ms, 'protocol')
+            analysis['geographic_threats'] = optimized_db.get_rollup_totals('day', week_start_ms, now_ms, 'country')
+            analysis['top_threat_sources'] = optimized_db.get_top_threat_sources(days=7)
+            analysis['top_threat_destinations'] = optimized_db.get_top_threat_sources(days=7, dimension='threat_dst')
+
+            # Tendencia horaria (últimas 24 horas, solo horas con datos)
+            hour_start_ms = bucket_start(now_ms - 23 * GRANULARITIES['hour'], 'hour')
+            for bucket_ms, dimensions in optimized_db.get_rollup_series('hour', hour_start_ms, now_ms).items():
+                total, threats_count = self._trend_counts(dimensions)
+                analysis['hourly_trend'].append({
+                    'hour': datetime.fromtimestamp(bucket_ms / 1000, TIMEZONE).hour,
+                    'normal': total - threats_count,
+                    'threats': threats_count,
+                    'total': total
+                })
+
+            # Tendencia semanal (últimos 7 días, del más reciente al más antiguo)
+            day_series = optimized_db.get_rollup_series('day', week_start_ms, now_ms)
+            for i in range(7):
+                day_ms = bucket_start(now_ms - i * GRANULARITIES['day'], 'day')
+                total, threats_count = self._trend_counts(day_series.get(day_ms, {}))
+                analysis['weekly_trend'].append({
+                    'date': datetime.fromtimestamp(day_ms / 1000, TIMEZONE).strftime('%m-%d'),
+                    'normal': total - threats_count,
+                    'threats': threats_count,
+                    'total': total
+                })
+
+            # Calcular tasa de denegación y escalación
+            total_threats = analysis['threat_distribution']['medium'] + analysis['threat_distribution']['high']
+            total_logs = analysis['total_logs_week']
+
+            if total_logs > 0:
+                analysis['denial_rate'] = (total_threats / total_logs) * 100
+                analysis['threat_escalation'] = (analysis['threat_distribution']['high'] / max(total_logs, 1)) * 100
+
             return analysis
-            
+
         except Exception as e:
             logger.error(f"Error analyzing logs for security: {e}")
-            return {
-                'total_logs_today': 0,
-                'total_logs_week': 0,
-                'threat_distribution': {'low': 0, 'medium': 0, 'high': 0},
-                'protocol_analysis': {},
-                'denial_rate': 0.0,
-                'top_threat_sources': {},
-                'hourly_trend': [],
-                'weekly_trend': [],
-                'geographic_threats': {},
-                'threat_escalation': 0.0
-            }
+            return self._empty_log_analysis()
+
+    def _trend_counts(self, dimensions: Dict[str, Dict[str, int]]) -> tuple[int, int]:
+        """Total y amenazas (estado medium/high) de un bucket de rollups"""
+        total = dimensions.get('total', {}).get('', 0)
+        statuses = dimensions.get('status', {})
+        return total, statuses.get('medium', 0) + statuses.get('high', 0)
 
     def get_security_metrics(self) -> Dict[str, Any]:
         """Obtener todas las métricas de seguridad"""
@@ -0,0 +1,351 @@
+"""
+Spool en disco delante del hilo escritor.
+Las actividades se añaden a segmentos de solo anexado con registros
+prefijados por longitud y CRC. El fsync se agrupa: lo hace el hilo escritor
+antes de leer cada lote y, con ráfagas largas, append() cada cierto número
+de registros. El hilo escritor lee del spool y guarda la posición
+confirmada en la misma transacción que las filas, de modo que al arrancar
+se reproduce exactamente lo que no llegó a la base de datos.
+Lo pendiente tiene un tope (SPOOL_MAX_BYTES): con el escritor parado el
+spool rechaza lotes nuevos en lugar de llenar la tarjeta.
+"""
+import os
+import json
+import time
+import zlib
+import struct
+import logging
+import threading
+from collections import deque
+from typing import Dict, List, Any, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Cabecera de registro: longitud, crc32 del contenido, instante de llegada (ms)
+HEADER = struct.Struct('>IIQ')
+
+SPOOL_SEGMENT_BYTES = 4 * 1024 * 1024  # Rotar el segmento a partir de este tamaño
+SPOOL_FSYNC_RECORDS = 256              # fsync en append() tras este número de registros
+SPOOL_READ_BYTES = 1024 * 1024         # Máximo leído por llamada a read()
+MAX_RECORD_BYTES = 64 * 1024 * 1024    # Longitudes mayores indican un registro corrupto
+SPOOL_MAX_BYTES = 1024 * 1024 * 1024   # Bytes sin confirmar antes de rechazar lotes nuevos
+
+# Posición en el spool: (número de segmento, desplazamiento en bytes)
+Position = Tuple[int, int]
+
+class SpoolFull(RuntimeError):
+    """El spool alcanzó su tope de bytes sin confirmar"""
+
+class WriteSpool:
+    """Cola persistente de lotes de actividades, en segmentos numerados"""
+
+    def __init__(self, directory: str, max_bytes: int = SPOOL_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.is_open = False
+        self._lock = threading.Lock()
+        self._committed_cond = threading.Condition(self._lock)
+
+        self._segments: List[int] = []
+        self._write_file = None
+        self._write_position: Position = (0, 0)
+        self._read_position: Position = (0, 0)
+        self._committed: Position = (0, 0)
+
+        # Registros aún no confirmados: (posición final, llegada ms, bytes)
+        self._pending = deque()
+        self._pending_bytes = 0
+        self._full = False  # Se rechazó un lote y aún no se ha confirmado nada
+
+        self._unsynced = 0
+        self.metrics = {'appended': 0, 'committed': 0, 'replayed': 0, 'fsyncs': 0, 'discarded': 0, 'rejected': 0}
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"spool-{segment:08d}.log")
+
+    def _sync_directory(self):
+        """Persistir la creación o borrado de segmentos"""
+        fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def open(self, committed: Position = (0, 0)):
+        """
+        Abrir el spool a partir de la última posición confirmada en la BD.
+        Borra los segmentos ya consumidos, recorre los pendientes para
+        reconstruir la profundidad y recorta un registro final incompleto.
+        Si el segmento confirmado falta o es más corto que la posición (spool
+        borrado o BD restaurada sin él), se continúa en un segmento nuevo
+        posterior: escribir detrás del cursor dejaría los registros sin leer.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        segments = sorted(
+            int(name[6:-4]) for name in os.listdir(self.directory)
+            if name.startswith('spool-') and name.endswith('.log')
+        )
+
+        if committed != (0, 0) and self._committed_lost(committed, segments):
+            logger.warning(f"Spool segment {committed[0]} is missing or shorter than the committed "
+                           f"offset {committed[1]}, continuing in a new segment")
+            later = [s for s in segments if s > committed[0]]
+            committed = (later[0] if later else committed[0] + 1, 0)
+
+        for segment in [s for s in segments if s < committed[0]]:
+            os.remove(self._segment_path(segment))
+        self._segments = [s for s in segments if s >= committed[0]]
+
+        for index, segment in enumerate(self._segments):
+            offset = committed[1] if segment == committed[0] else 0
+            end = self._scan_segment(segment, offset, last=index == len(self._segments) - 1)
+            if end is not None and index == len(self._segments) - 1:
+                # Registro a medio escribir en el último segmento: se descarta
+                with open(self._segment_path(segment), 'r+b') as f:
+                    f.truncate(end)
+                    os.fsync(f.fileno())
+                logger.warning(f"Truncated torn record at end of spool segment {segment}")
+
+        if not self._segments:
+            self._segments = [committed[0]]
+        write_segment = self._segments[-1]
+        self._write_file = open(self._segment_path(write_segment), 'ab')
+        self._write_position = (write_segment, self._write_file.tell())
+        self._sync_directory()
+
+        self._committed = committed
+        self._read_position = committed if committed[0] in self._segments else (self._segments[0], 0)
+        self.metrics['replayed'] = len(self._pending)
+        self.is_open = True
+
+        if self._pending:
+            logger.info(f"Replaying {len(self._pending)} spooled activity batches")
+
+    def _committed_lost(self, committed: Position, segments: List[int]) -> bool:
+        """El segmento de la posición confirmada ya no contiene esa posición"""
+        if committed[0] not in segments:
+            return True
+        return os.path.getsize(self._segment_path(committed[0])) < committed[1]
+
+    def _scan_segment(self, segment: int, offset: int, last: bool) -> Optional[int]:
+        """Registrar los registros pendientes de un segmento. Devuelve el desplazamiento de un registro inválido."""
+        with open(self._segment_path(segment), 'rb') as f:
+            f.seek(offset)
+            while True:
+                record = self._read_record(f)
+                if record is None:
+                    return None
+                if record is False:
+                    if not last:
+                        logger.error(f"Corrupt record in spool segment {segment} at offset {offset}, skipping rest")
+                        return None
+                    return offset
+                payload, appended_ms = record
+                offset += HEADER.size + len(payload)
+                self._pending.append(((segment, offset), appended_ms, HEADER.size + len(payload)))
+                self._pending_bytes += HEADER.size + len(payload)
+
+    @staticmethod
+    def _read_record(f):
+        """Leer un registro: (contenido, llegada ms), None al final o False si es inválido"""
+        header = f.read(HEADER.size)
+        if not header:
+            return None
+        if len(header) < HEADER.size:
+            return False
+        length, crc, appended_ms = HEADER.unpack(header)
+        if length > MAX_RECORD_BYTES:
+            return False
+        payload = f.read(length)
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            return False
+        return payload, appended_ms
+
+    def append(self, activities: List[Dict[str, Any]]) -> Position:
+        """
+        Añadir un lote de actividades. Devuelve la posición final del registro.
+        Lanza SpoolFull si superaría max_bytes sin confirmar.
+        """
+        payload = json.dumps(activities, separators=(',', ':'), default=str).encode('utf-8')
+        appended_ms = int(time.time() * 1000)
+        record = HEADER.pack(len(payload), zlib.crc32(payload), appended_ms) + payload
+
+        sync_fd = None
+        with self._lock:
+            if self._pending_bytes + len(record) > self.max_bytes:
+                self.metrics['rejected'] += 1
+                self._full = True
+                raise SpoolFull(f"Write spool full ({self._pending_bytes} of {self.max_bytes} bytes pending)")
+            if self._write_position[1] >= SPOOL_SEGMENT_BYTES:
+                self._rotate()
+            self._write_file.write(record)
+            self._write_file.flush()
+            segment, offset = self._write_position
+            self._write_position = (segment, offset + len(record))
+
+            self._pending.append((self._write_position, appended_ms, len(record)))
+            self._pending_bytes += len(record)
+            self.metrics['appended'] += 1
+
+            self._unsynced += 1
+            if self._unsynced >= SPOOL_FSYNC_RECORDS:
+                sync_fd = self._take_sync_fd()
+            position = self._write_position
+
+        if sync_fd is not None:
+            self._fsync_fd(sync_fd)
+        return position
+
+    def _rotate(self):
+        """Cerrar el segmento actual y empezar uno nuevo"""
+        self._fsync()
+        self._write_file.close()
+        segment = self._write_position[0] + 1
+        self._write_file = open(self._segment_path(segment), 'ab')
+        self._segments.append(segment)
+        self._write_position = (segment, 0)
+        self._sync_directory()
+
+    def _fsync(self):
+        if self._unsynced:
+            os.fsync(self._write_file.fileno())
+            self._unsynced = 0
+            self.metrics['fsyncs'] += 1
+
+    def _take_sync_fd(self) -> Optional[int]:
+        """Descriptor propio para hacer el fsync fuera del lock (llamar con el lock tomado)"""
+        if self._write_file is None or not self._unsynced:
+            return None
+        self._unsynced = 0
+        self.metrics['fsyncs'] += 1
+        return os.dup(self._write_file.fileno())
+
+    @staticmethod
+    def _fsync_fd(fd: int):
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def sync(self):
+        """Forzar el fsync de los registros añadidos desde el último"""
+        with self._lock:
+            fd = self._take_sync_fd()
+        if fd is not None:
+            self._fsync_fd(fd)
+
+    def has_unread(self) -> bool:
+        """Hay registros que el escritor todavía no ha leído"""
+        return self.is_open and self._read_position < self._write_position
+
+    def tail(self) -> Position:
+        """Posición final del último registro añadido"""
+        return self._write_position
+
+    def read(self, max_records: int) -> List[Tuple[Position, int, List[Dict[str, Any]]]]:
+        """Leer registros a partir del cursor: [(posición final, llegada ms, actividades)]"""
+        records = []
+        read_bytes = 0
+        with self._lock:
+            while len(records) < max_records and read_bytes < SPOOL_READ_BYTES:
+                segment, offset = self._read_position
+                if self._read_position >= self._write_position:
+                    break
+
+                end_of_segment = False
+                with open(self._segment_path(segment), 'rb') as f:
+                    f.seek(offset)
+                    while len(records) < max_records and read_bytes < SPOOL_READ_BYTES:
+                        record = self._read_record(f)
+                        if not record:
+                            end_of_segment = True
+                            break
+                        payload, appended_ms = record
+                        offset += HEADER.size + len(payload)
+                        read_bytes += HEADER.size + len(payload)
+                        records.append(((segment, offset), appended_ms, payload))
+                self._read_position = (segment, offset)
+
+                if end_of_segment and self._read_position < self._write_position:
+                    if segment == self._write_position[0]:
+                        logger.error(f"Corrupt record in spool segment {segment} at offset {offset}, skipping")
+                        self._read_position = self._write_position
+                    else:
+                        # Fin de un segmento ya cerrado: pasar al siguiente
+                        following = [s for s in self._segments if s > segment]
+                        self._read_position = (following[0], 0) if following else self._write_position
+
+        # El JSON se decodifica fuera del lock
+        decoded = []
+        for position, appended_ms, payload in records:
+            try:
+                activities = json.loads(payload)
+            except ValueError:
+                activities = []
+            decoded.append((position, appended_ms, activities))
+        return decoded
+
+    def commit(self, position: Position):
+        """Marcar como confirmado todo lo anterior a la posición y borrar segmentos consumidos"""
+        with self._lock:
+            if position <= self._committed:
+                return
+            self._committed = position
+            self._full = False
+            while self._pending and self._pending[0][0] <= position:
+                _, _, size = self._pending.popleft()
+                self._pending_bytes -= size
+                self.metrics['committed'] += 1
+
+            consumed = [s for s in self._segments if s < position[0]]
+            for segment in consumed:
+                try:
+                    os.remove(self._segment_path(segment))
+                except OSError as e:
+                    logger.warning(f"Could not remove spool segment {segment}: {e}")
+            self._segments = [s for s in self._segments if s >= position[0]]
+            self._committed_cond.notify_all()
+
+    def rewind(self):
+        """Volver a leer desde la última posición confirmada (tras un fallo del lote)"""
+        with self._lock:
+            self._read_position = self._committed if self._committed[0] in self._segments else (self._segments[0], 0)
+
+    def wait_committed(self, position: Position, timeout: float) -> bool:
+        """Esperar a que una posición quede confirmada en la base de datos"""
+        deadline = time.time() + timeout
+        with self._committed_cond:
+            while self._committed < position:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._committed_cond.wait(remaining)
+        return True
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Profundidad (registros y bytes sin confirmar) y retraso del más antiguo"""
+        with self._lock:
+            oldest_ms = self._pending[0][1] if self._pending else None
+            depth = len(self._pending)
+            depth_bytes = self._pending_bytes
+            segments = len(self._segments)
+            full = self._full
+        return {
+            'enabled': self.is_open,
+            'depth': depth,
+            'depth_bytes': depth_bytes,
+            'lag_seconds': round(time.time() - oldest_ms / 1000, 3) if oldest_ms else 0.0,
+            'segments': segments,
+            'max_bytes': self.max_bytes,
+            'full': full,
+            **self.metrics
+        }
+
+    def close(self):
+        """fsync final y cierre del segmento de escritura"""
+        with self._lock:
+            if self._write_file is not None:
+                self._fsync()
+                self._write_file.close()
+                self._write_file = None
+            self.is_open = False
@@ -0,0 +1,62 @@
+"""
+Utilidades de fecha y hora compartidas.
+Todas las marcas de tiempo se generan con zona horaria y se almacenan
+también como milisegundos desde epoch para comparar rangos con enteros.
+"""
+import time
+from datetime import datetime, timedelta
+from typing import Any, Optional
+from zoneinfo import ZoneInfo
+
+# Zona horaria del sistema (los valores sin zona se interpretan en ella)
+TIMEZONE = ZoneInfo("America/Mexico_City")
+
+def now_iso() -> str:
+    """Marca de tiempo actual ISO 8601 con zona horaria"""
+    return datetime.now(TIMEZONE).isoformat()
+
+def now_epoch_ms() -> int:
+    """Milisegundos desde epoch del instante actual"""
+    return int(time.time() * 1000)
+
+def parse_timestamp(value: Any) -> Optional[datetime]:
+    """Convertir un timestamp ISO (con o sin zona) a datetime con zona"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, datetime):
+        parsed = value
+    else:
+        parsed = datetime.fromisoformat(str(value).strip().replace('Z', '+00:00'))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=TIMEZONE)
+    return parsed
+
+def to_epoch_ms(value: Any, default: Optional[int] = None) -> Optional[int]:
+    """
+    Convertir un timestamp a milisegundos desde epoch.
+    Acepta datetime, texto ISO o números (segundos o milisegundos).
+    """
+    if isinstance(value, bool):
+        return default
+    if isinstance(value, (int, float)):
+        # Valores pequeños son segundos, los grandes ya son milisegundos
+        return int(value * 1000) if value < 1e11 else int(value)
+    try:
+        parsed = parse_timestamp(value)
+    except (TypeError, ValueError):
+        return default
+    if parsed is None:
+        return default
+    return int(parsed.timestamp() * 1000)
+
+def days_ago_epoch_ms(days: float) -> int:
+    """Límite inferior en milisegundos para los últimos X días"""
+    return now_epoch_ms() - int(days * 86400 * 1000)
+
+def epoch_ms_to_date(epoch_ms: int) -> str:
+    """Fecha local (YYYY-MM-DD) de un instante en milisegundos"""
+    return datetime.fromtimestamp(epoch_ms / 1000, TIMEZONE).strftime('%Y-%m-%d')
+
+def local_date_days_ago(days: int) -> str:
+    """Fecha local (YYYY-MM-DD) de hace X días"""
+    return (datetime.now(TIMEZONE) - timedelta(days=days)).strftime('%Y-%m-%d')
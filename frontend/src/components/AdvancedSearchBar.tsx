@@ -1,6 +1,7 @@
 // src/components/AdvancedSearchBar.tsx - FIXED: Compatible with new Icons
 import React, { useState, useRef } from 'react';
 import { Activity } from '../types';
+import { API_ENDPOINTS } from '../config/api';
 import { 
   SearchIcon, 
   FilterIcon, 
@@ -159,7 +160,31 @@ const AdvancedSearchBar: React.FC<AdvancedSearchBarProps> = ({
     return filtered;
   };
 
-  const handleSearch = () => {
+  // Busca en todo el historial con el índice de texto completo del backend
+  const searchServer = async (searchQuery: string): Promise<Activity[] | null> => {
+    try {
+      const hours = normalizeTimeValue(timeRange) || 24;
+      const params = new URLSearchParams({
+        q: searchQuery,
+        start: (Date.now() - hours * 3600 * 1000).toString(),
+        sort: 'rank',
+        limit: '100'
+      });
+      const response = await fetch(`${API_ENDPOINTS.ACTIVITY_SEARCH}?${params}`, {
+        headers: { 'Accept': 'application/json' }
+      });
+      if (!response.ok) {
+        throw new Error(`HTTP ${response.status}: ${response.statusText}`);
+      }
+      const data = await response.json();
+      return data.data || [];
+    } catch (err) {
+      console.error('Error searching activities on server:', err);
+      return null;
+    }
+  };
+
+  const handleSearch = async () => {
     setIsSearching(true);
     
     // Parse query for filters
@@ -191,8 +216,9 @@ const AdvancedSearchBar: React.FC<AdvancedSearchBarProps> = ({
       arr.findIndex(x => x.field === f.field && x.value === f.value && x.operator === f.operator) === idx
     );
 
-    // Aplicar filtros y actualizar resultados
-    const results = applyFilters(allActivities, cleanQuery, uniqueFilters);
+    // Con texto libre se consulta el historial completo; si falla, se filtra lo cargado
+    const serverResults = query.trim() ? await searchServer(query.trim()) : null;
+    const results = serverResults ?? applyFilters(allActivities, cleanQuery, uniqueFilters);
     setFilteredActivities(results);
     onFilteredResultsChange(results);
     setIsSearching(false);
@@ -16,6 +16,7 @@ import {
   AlertIcon, ShieldIcon, NetworkIcon, SpinIcon, DatabaseIcon, ClockIcon,
   ReportIcon, SearchIcon, XIcon
 } from './Icons';
+import { API_ENDPOINTS } from '../config/api';
 import WorldMap from './WorldMap';
 import AdvancedSearchBar from './AdvancedSearchBar';
 
@@ -30,6 +31,9 @@ interface DashboardProps {
   error?: string | null;
 }
 
+// Rango del histórico (días) que muestra el dashboard y que exporta el servidor
+const HISTORICAL_DAYS = 7;
+
 // ===================================================================
 // UTILIDADES MEJORADAS - COMPONENTES MEMOIZADOS
 // ===================================================================
@@ -101,8 +105,9 @@ const Dashboard: React.FC<DashboardProps> = ({ stats, activities, loading = fals
     refresh: refreshHistorical,
     statusFilter,
     setStatusFilter,
+    sourceFilter,
   } = useOptimizedHistoricalData({
-    days: 7,
+    days: HISTORICAL_DAYS,
     pageSize: 10,
     autoRefresh: true,
     refreshInterval: 30000
@@ -375,6 +380,20 @@ const Dashboard: React.FC<DashboardProps> = ({ stats, activities, loading = fals
 
   // Export CSV mejorado con datos del hook
   const exportToCSV = () => {
+    // Histórico: exportación completa del rango en el servidor (streaming, sin límite de filas)
+    // con el mismo rango y filtros que la vista
+    if (currentDateRange === 'historical') {
+      const params = new URLSearchParams({
+        format: 'csv',
+        days: HISTORICAL_DAYS.toString(),
+        ...(statusFilter && { status: statusFilter }),
+        ...(sourceFilter && { source: sourceFilter })
+      });
+      window.location.href = `${API_ENDPOINTS.ACTIVITY_EXPORT}?${params}`;
+      setToastMsg(`Exporting full historical range (last ${HISTORICAL_DAYS} days${statusFilter ? `, ${statusFilter} risk` : ''}) from server`);
+      return;
+    }
+
     const currentLogs = displayActivities;
     const stats = getCurrentPeriodStats();
     
@@ -643,7 +662,7 @@ const Dashboard: React.FC<DashboardProps> = ({ stats, activities, loading = fals
         <div className="flex justify-between items-center mb-4">
           <h3 className="text-lg font-semibold text-white">Weekly Activity Trend</h3>
           <div className="text-xs text-gray-400">
-            Last 7 days • {totalActivities} total historical logs
+            Last {HISTORICAL_DAYS} days • {totalActivities} total historical logs
           </div>
         </div>
         <div className="h-64">
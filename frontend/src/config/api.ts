@@ -37,7 +37,12 @@ export const API_ENDPOINTS = {
   HISTORICAL_STATS: `${API_CONFIG.BASE_URL}/api/activities/stats`, 
   ACTIVITIES_STATS: `${API_CONFIG.BASE_URL}/api/activities/stats`,
   LIVE_ACTIVITIES: `${API_CONFIG.BASE_URL}/api/activities/live`,
+  ACTIVITY_TRENDS: `${API_CONFIG.BASE_URL}/api/activities/trends`,
+  ACTIVITY_SEARCH: `${API_CONFIG.BASE_URL}/api/activities/search`,
+  ACTIVITY_ARCHIVE: `${API_CONFIG.BASE_URL}/api/activities/archive`,
+  ACTIVITY_EXPORT: `${API_CONFIG.BASE_URL}/api/activities/export`,
   SYSTEM_STATS: `${API_CONFIG.BASE_URL}/api/system/stats`,
+  SYSTEM_STORAGE: `${API_CONFIG.BASE_URL}/api/system/storage`,
   
   // === ENDPOINTS LEGACY (COMPATIBILIDAD) ===
   HEALTH: `${API_CONFIG.BASE_URL}/api/health`,